@@ -108,13 +108,18 @@ def load_config(client, fd, include_aliases=False):
     Args:
         fd: opened file descriptor where data will be taken from
     """
-    json_config = _json_load(fd)
+    load_subsystems(client, _json_load(fd)['subsystems'], include_aliases)
 
+
+def load_subsystems(client, subsystems, include_aliases=False):
+    """Configure SPDK subsystems and targets like load_config, from an already parsed config.
+    Args:
+        subsystems: list of {"subsystem": name, "config": [requests]}, as in the "subsystems"
+            of a config written by save_config. It is not modified, so it can be shared by
+            calls loading it into several targets.
+    """
     # remove subsystems with no config
-    subsystems = json_config['subsystems']
-    for subsystem in list(subsystems):
-        if not subsystem['config']:
-            subsystems.remove(subsystem)
+    subsystems = [dict(s, config=list(s['config'])) for s in subsystems if s['config']]
 
     # check if methods in the config file are known
     allowed_methods = client.call('rpc_get_methods', {'include_aliases': include_aliases})
@@ -134,16 +139,19 @@ def load_config(client, fd, include_aliases=False):
         allowed_found = False
 
         for subsystem in list(subsystems):
-            config = subsystem['config']
-            for elem in list(config):
+            # Keep the entries which can't be called yet, removing the others one by one
+            # would be quadratic in the size of the config
+            remaining = []
+            for elem in subsystem['config']:
                 if 'method' not in elem or elem['method'] not in allowed_methods:
+                    remaining.append(elem)
                     continue
 
                 client.call(**elem)
-                config.remove(elem)
                 allowed_found = True
 
-            if not config:
+            subsystem['config'] = remaining
+            if not remaining:
                 subsystems.remove(subsystem)
 
         if 'framework_start_init' in allowed_methods:
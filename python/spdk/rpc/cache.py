@@ -0,0 +1,165 @@
+"""Client-side cache of results of read-mostly metadata RPCs.
+
+Methods like rpc_get_methods or nvmf_get_transports are called over and over by the
+tooling (load_config, SPDKCLI refreshes, SMA device managers), while their results
+only change when the configuration does. RPCCache keeps their results for a limited
+time (TTL) and drops them as soon as a state-changing method which may affect them
+is called through any of the clients it wraps:
+
+    cache = RPCCache()
+    client = cache.wrap(JSONRPCClient(addr))
+    rpc.rpc_get_methods(client, current=True)   # miss, sent to the target
+    rpc.rpc_get_methods(client, current=True)   # hit
+    rpc.framework_start_init(client)            # invalidates rpc_get_methods
+"""
+
+import copy
+import json
+import re
+import threading
+import time
+
+# Cached methods and the time (in seconds) their results are kept for
+DEFAULT_TTLS = {
+    'rpc_get_methods': 60.0,
+    'spdk_get_version': 300.0,
+    'framework_get_subsystems': 300.0,
+    'nvmf_get_transports': 10.0,
+    'sock_impl_get_options': 10.0,
+}
+
+# State-changing methods and the cached methods they affect, in addition to the cached
+# methods of the same module (i.e. with the same prefix, e.g. nvmf_create_transport
+# invalidates nvmf_get_transports). None stands for all the cached methods.
+INVALIDATES = {
+    'framework_start_init': None,
+    'spdk_kill_instance': None,
+    'sock_set_default_impl': ['sock_impl_get_options'],
+}
+
+
+def is_query(method):
+    return re.search(r"(^|_)get_", method) is not None
+
+
+class RPCCache(object):
+    def __init__(self, ttls=None, clock=time.monotonic):
+        """
+        Args:
+            ttls: dict of cached methods and their TTLs in seconds, DEFAULT_TTLS by default
+            clock: function returning the current time in seconds
+        """
+        self.ttls = dict(DEFAULT_TTLS if ttls is None else ttls)
+        self.clock = clock
+        self.hits = {}
+        self.misses = {}
+        self.invalidations = 0
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def wrap(self, client):
+        return CachedClient(client, self)
+
+    def is_cached(self, method):
+        return method in self.ttls
+
+    @staticmethod
+    def _key(method, params):
+        return method, json.dumps(params or {}, sort_keys=True)
+
+    def get(self, method, params):
+        """Get a copy of the cached result of a call.
+
+        Returns:
+            (True, result) on a cache hit, (False, None) on a miss.
+        """
+        key = self._key(method, params)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > self.clock():
+                self.hits[method] = self.hits.get(method, 0) + 1
+                return True, copy.deepcopy(entry[1])
+            self._entries.pop(key, None)
+            self.misses[method] = self.misses.get(method, 0) + 1
+        return False, None
+
+    def put(self, method, params, result):
+        with self._lock:
+            self._entries[self._key(method, params)] = (self.clock() + self.ttls[method], copy.deepcopy(result))
+
+    def invalidate(self, methods=None):
+        """Drop the cached results of the given methods, or of all of them"""
+        with self._lock:
+            for key in list(self._entries):
+                if methods is None or key[0] in methods:
+                    del self._entries[key]
+                    self.invalidations += 1
+
+    def on_call(self, method):
+        """Invalidate the results affected by a call of a (possibly state-changing) method"""
+        if self.is_cached(method) or is_query(method):
+            return
+        if method in INVALIDATES and INVALIDATES[method] is None:
+            self.invalidate()
+            return
+        prefix = method.split('_')[0] + '_'
+        self.invalidate([m for m in self.ttls if m.startswith(prefix)] + INVALIDATES.get(method, []))
+
+    def stats(self):
+        with self._lock:
+            methods = sorted(set(self.hits) | set(self.misses))
+            return {'hits': sum(self.hits.values()), 'misses': sum(self.misses.values()),
+                    'invalidations': self.invalidations, 'entries': len(self._entries),
+                    'methods': {m: {'hits': self.hits.get(m, 0), 'misses': self.misses.get(m, 0)} for m in methods}}
+
+
+class CachedClient(object):
+    """Wrapper of JSONRPCClient answering calls of cached methods from an RPCCache.
+
+    Any other attribute is the one of the wrapped client, so the wrapper can be used in
+    its place, including as a context manager.
+    """
+    def __init__(self, client, cache=None):
+        self.client = client
+        self.cache = cache if cache is not None else RPCCache()
+        # Methods of the requests sent with add_request, by request ID
+        self._pending = {}
+
+    def call(self, method, params={}):
+        if not self.cache.is_cached(method):
+            # Invalidate again once the call is done, as another client sharing the cache may
+            # have fetched and cached the old results while it was in progress
+            self.cache.on_call(method)
+            try:
+                return self.client.call(method, params)
+            finally:
+                self.cache.on_call(method)
+        hit, result = self.cache.get(method, params)
+        if not hit:
+            result = self.client.call(method, params)
+            self.cache.put(method, params, result)
+        return result
+
+    def add_request(self, method, params):
+        # Pipelined requests bypass the cache, but may still change the state.  Like with
+        # call(), the results are invalidated again once the response is received.
+        self.cache.on_call(method)
+        req_id = self.client.add_request(method, params)
+        self._pending[req_id] = method
+        return req_id
+
+    def recv(self):
+        response = self.client.recv()
+        method = self._pending.pop(response.get('id'), None)
+        if method is not None:
+            self.cache.on_call(method)
+        return response
+
+    def __getattr__(self, name):
+        return getattr(self.client, name)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exception_type, exception_value, traceback):
+        self.client.close()
@@ -0,0 +1,242 @@
+"""Change feed of a target's configuration, built on notify_get_notifications.
+
+Instead of periodically refetching whole lists (bdev_get_bdevs, ...), a consumer can
+keep its view of the target up to date from the notifications the target emits when
+its configuration changes. ChangeFeed fetches them from a cursor, decodes them into
+typed events and dispatches them to subscribers:
+
+    feed = ChangeFeed(JSONRPCClient(addr), FileCursor("/var/lib/app/spdk.cursor"))
+    feed.subscribe(on_bdev_added, [BdevRegistered])
+    feed.subscribe(on_resync, [Resync])
+    feed.start()
+
+The target keeps only the last 1024 notifications (SPDK_NOTIFY_MAX_EVENTS) and
+restarts numbering them from 0 when it is restarted. When the feed notices it missed
+notifications for either reason it dispatches a Resync event, after which subscribers
+must rebuild their state from a full listing.
+"""
+
+import json
+import logging
+import os
+import threading
+
+from . import notify
+from .client import JSONRPCException
+
+logger = logging.getLogger(__name__)
+
+
+class Event(object):
+    """Notification of a change on the target.
+
+    id is the position of the notification in the target's stream, type its type (e.g.
+    bdev_register) and ctx its context, usually the name of the affected object.
+    """
+    def __init__(self, id, type, ctx):
+        self.id = id
+        self.type = type
+        self.ctx = ctx
+
+    def __repr__(self):
+        return "%s(id=%r, ctx=%r)" % (type(self).__name__, self.id, self.ctx)
+
+
+class BdevEvent(Event):
+    @property
+    def bdev_name(self):
+        return self.ctx
+
+
+class BdevRegistered(BdevEvent):
+    pass
+
+
+class BdevUnregistered(BdevEvent):
+    pass
+
+
+class Resync(Event):
+    """Notifications were lost, because the target was restarted or overwrote them before
+    they were fetched. Subscribers keeping state derived from events must rebuild it. id
+    is the id of the next notification which will be dispatched."""
+    def __init__(self, id, reason):
+        super().__init__(id, 'resync', reason)
+
+    @property
+    def reason(self):
+        return self.ctx
+
+
+# Notification types and the events they are decoded into, others are decoded into Event
+EVENT_TYPES = {
+    'bdev_register': BdevRegistered,
+    'bdev_unregister': BdevUnregistered,
+}
+
+
+def register_event_type(notify_type, event_class):
+    EVENT_TYPES[notify_type] = event_class
+
+
+def decode_event(notification):
+    event_class = EVENT_TYPES.get(notification['type'], Event)
+    return event_class(notification['id'], notification['type'], notification['ctx'])
+
+
+class Cursor(object):
+    """Position of a consumer in the notification stream.
+
+    next_id is the id of the next notification to fetch and last the type and context of
+    the last one consumed, used to tell whether the target was restarted in between.
+    """
+    def __init__(self, next_id=0, last=None):
+        self.next_id = next_id
+        self.last = last
+
+    def advance(self, event):
+        self.next_id = event.id if isinstance(event, Resync) else event.id + 1
+        self.last = None if isinstance(event, Resync) else [event.type, event.ctx]
+
+    def save(self):
+        pass
+
+    def to_dict(self):
+        return {'next_id': self.next_id, 'last': self.last}
+
+
+class FileCursor(Cursor):
+    """Cursor persisted in a JSON file, so that a consumer resumes where it stopped"""
+    def __init__(self, path):
+        self.path = path
+        try:
+            with open(path, 'r') as fh:
+                state = json.load(fh)
+            super().__init__(state['next_id'], state.get('last'))
+        except FileNotFoundError:
+            super().__init__()
+
+    def save(self):
+        # Replace the file atomically, so that it's never left half-written
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w') as fh:
+            json.dump(self.to_dict(), fh)
+        os.replace(tmp_path, self.path)
+
+
+class ChangeFeed(object):
+    def __init__(self, client, cursor=None, batch=256, min_interval=0.05, max_interval=1.0):
+        """
+        Args:
+            client: JSONRPCClient used only by the feed
+            cursor: position to start from, Cursor() (the oldest notification kept by the target) by default
+            batch: maximum number of notifications fetched by a single call
+            min_interval: delay (in seconds) between polls while there are new notifications
+            max_interval: maximum delay between polls, reached by doubling the delay while there are none
+        """
+        self.client = client
+        self.cursor = cursor if cursor is not None else Cursor()
+        self.batch = batch
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self._subscribers = []
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def subscribe(self, callback, events=None):
+        """Call callback(event) for every event, or only for instances of the given event classes.
+
+        Returns:
+            Subscription to pass to unsubscribe().
+        """
+        subscription = (callback, tuple(events) if events else None)
+        with self._lock:
+            self._subscribers.append(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            self._subscribers.remove(subscription)
+
+    def _dispatch(self, event):
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for callback, events in subscribers:
+            if events is not None and not isinstance(event, events):
+                continue
+            try:
+                callback(event)
+            except Exception:
+                logger.exception("Subscriber %r failed to handle %r", callback, event)
+
+    def fetch(self):
+        """Fetch the next notifications after the cursor, without moving it.
+
+        The last consumed notification is fetched again: if it's gone or differs, the target
+        was restarted, if the first returned one is newer than the cursor, notifications
+        were overwritten. Either way a Resync event comes first.
+
+        Returns:
+            List of events, with at most batch notifications.
+        """
+        cursor = self.cursor
+        if cursor.next_id == 0:
+            notifications = notify.notify_get_notifications(self.client, max=self.batch)
+            if notifications and notifications[0]['id'] > 0:
+                return [Resync(notifications[0]['id'], 'notifications lost')] + \
+                    [decode_event(n) for n in notifications]
+            return [decode_event(n) for n in notifications]
+
+        notifications = notify.notify_get_notifications(self.client, id=cursor.next_id - 1, max=self.batch + 1)
+        if not notifications:
+            return [Resync(0, 'target restarted')]
+        first = notifications[0]
+        if first['id'] == cursor.next_id - 1:
+            if cursor.last is not None and [first['type'], first['ctx']] != cursor.last:
+                return [Resync(0, 'target restarted')]
+            return [decode_event(n) for n in notifications[1:]]
+        return [Resync(first['id'], 'notifications lost')] + [decode_event(n) for n in notifications]
+
+    def poll(self):
+        """Fetch all pending notifications and dispatch them to subscribers.
+
+        Returns:
+            Number of dispatched events.
+        """
+        count = 0
+        while True:
+            events = self.fetch()
+            for event in events:
+                self._dispatch(event)
+                self.cursor.advance(event)
+            count += len(events)
+            if not events:
+                break
+            self.cursor.save()
+        return count
+
+    def run(self, stop=None):
+        """Poll until stop (a threading.Event) is set"""
+        stop = stop if stop is not None else self._stop
+        interval = self.min_interval
+        while not stop.is_set():
+            try:
+                interval = self.min_interval if self.poll() else min(interval * 2, self.max_interval)
+            except JSONRPCException as ex:
+                logger.error("Failed to fetch notifications: %s", ex.message)
+                interval = self.max_interval
+            stop.wait(interval)
+
+    def start(self):
+        """Poll in a background thread"""
+        self._stop.clear()
+        self._thread = threading.Thread(target=self.run, name="ChangeFeed", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
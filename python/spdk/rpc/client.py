@@ -4,6 +4,11 @@ import time
 import os
 import logging
 import copy
+import re
+
+
+# Size of socket reads of responses
+RECV_SIZE = 65536
 
 
 def print_dict(d):
@@ -35,6 +40,89 @@ class JSONRPCException(Exception):
         self.message = message
 
 
+class JSONRPCConnectionError(JSONRPCException):
+    """The connection to the server failed or timed out.
+
+    maybe_executed is False if the request could not have reached the server, e.g. because
+    connecting to it failed, and True if the server may have executed it.
+    """
+    def __init__(self, message, maybe_executed=True):
+        super().__init__(message)
+        self.maybe_executed = maybe_executed
+
+
+# Methods which don't change the state of the application, besides the ones named *_get_*
+READ_ONLY_METHODS = frozenset([
+    'framework_wait_init',
+    'bdev_wait_for_examine',
+])
+
+
+def is_read_only(method):
+    """Whether executing a method more than once has the same effect as executing it once"""
+    return method in READ_ONLY_METHODS or re.search(r"(^|_)get_", method) is not None
+
+
+class RetryPolicy(object):
+    """When JSONRPCClient reconnects after a connection error and which calls it retries.
+
+    A call is retried, after reconnecting to the server, if the request couldn't have been
+    executed or its method is read-only. Calls of other methods fail with JSONRPCConnectionError,
+    since the server may have executed them. Attempts are spaced with exponential backoff.
+    """
+    def __init__(self, max_attempts=5, initial_delay=0.1, max_delay=5.0, read_only=is_read_only):
+        """
+        Args:
+            max_attempts: maximum number of attempts of a call, including the first one
+            initial_delay: delay in seconds before the second attempt, doubled for each further one
+            max_delay: maximum delay in seconds between attempts
+            read_only: function telling whether a method can be retried
+        """
+        self.max_attempts = max_attempts
+        self.initial_delay = initial_delay
+        self.max_delay = max_delay
+        self.read_only = read_only
+
+    def delays(self):
+        """Generate the delays before each attempt after the first one"""
+        delay = self.initial_delay
+        for _ in range(self.max_attempts - 1):
+            yield delay
+            delay = min(delay * 2, self.max_delay)
+
+
+def error_response_message(method, params, req_id, error):
+    """Describe a request and the error response it got"""
+    request = dict(params or {}, method=method, req_id=req_id)
+    return "\n".join(["request:", "%s" % json.dumps(request, indent=2),
+                      "Got JSON-RPC error response",
+                      "response:",
+                      json.dumps(error, indent=2)])
+
+
+class CallRecord(object):
+    """Measurements of a single JSONRPCClient.call(), passed to instrumentation hooks.
+
+    Hooks are objects with pre_call(record) and post_call(record) methods, called before
+    the request is sent and once its response was received or the call failed. Times are
+    in seconds: serialize_time is spent encoding the request, wait_time sending it and
+    waiting for the response and deserialize_time decoding the response. error is the
+    JSON-RPC error object of the response or the exception the call failed with.
+    """
+    def __init__(self, method, params):
+        self.method = method
+        self.params = params
+        self.request_id = None
+        self.request_bytes = 0
+        self.response_bytes = 0
+        self.serialize_time = 0.0
+        self.wait_time = 0.0
+        self.deserialize_time = 0.0
+        self.duration = 0.0
+        self.error = None
+        self.start = time.perf_counter()
+
+
 class JSONRPCClient(object):
     def __init__(self, addr, port=None, timeout=60.0, **kwargs):
         self.sock = None
@@ -45,11 +133,20 @@ class JSONRPCClient(object):
         self._logger.addHandler(ch)
         self.log_set_level(kwargs.get('log_level', logging.ERROR))
         connect_retries = kwargs.get('conn_retries', 0)
+        self.retry_policy = kwargs.get('retry_policy')
 
         self.timeout = timeout
+        self._addr = addr
+        self._port = port
         self._request_id = 0
         self._recv_buf = ""
         self._reqs = []
+        self._hooks = list(kwargs.get('hooks', []))
+        self._record = None
+
+        if self.retry_policy and 'conn_retries' not in kwargs:
+            self._reconnect(self.retry_policy.delays())
+            return
 
         for i in range(connect_retries):
             try:
@@ -75,23 +172,48 @@ class JSONRPCClient(object):
             if addr_type == socket.AF_UNIX:
                 self._logger.debug("Trying to connect to UNIX socket: %s", addr)
                 self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+                self.sock.settimeout(self.timeout)
                 self.sock.connect(addr)
             elif addr_type == socket.AF_INET6:
                 self._logger.debug("Trying to connect to IPv6 address addr:%s, port:%i", addr, port)
                 for res in socket.getaddrinfo(addr, port, socket.AF_INET6, socket.SOCK_STREAM, socket.SOL_TCP):
                     af, socktype, proto, canonname, sa = res
                 self.sock = socket.socket(af, socktype, proto)
+                self.sock.settimeout(self.timeout)
                 self.sock.connect(sa)
             elif addr_type == socket.AF_INET:
                 self._logger.debug("Trying to connect to IPv4 address addr:%s, port:%i'", addr, port)
                 self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+                self.sock.settimeout(self.timeout)
                 self.sock.connect((addr, port))
             else:
                 raise socket.error("Invalid or non-existing address: '%s'" % addr)
         except socket.error as ex:
-            raise JSONRPCException("Error while connecting to %s\n"
-                                   "Is SPDK application running?\n"
-                                   "Error details: %s" % (addr, ex))
+            if self.sock:
+                self.sock.close()
+                self.sock = None
+            raise JSONRPCConnectionError("Error while connecting to %s\n"
+                                         "Is SPDK application running?\n"
+                                         "Error details: %s" % (addr, ex), maybe_executed=False)
+
+    def _reconnect(self, delays):
+        """Connect to the server, retrying after each of the delays"""
+        for delay in delays:
+            try:
+                self._connect(self._addr, self._port)
+                return
+            except JSONRPCConnectionError as ex:
+                self._logger.info("Connecting failed, retrying in %.2fs: %s", delay, ex.message)
+                time.sleep(delay)
+        self._connect(self._addr, self._port)
+
+    def _disconnect(self):
+        """Drop a broken connection along with the partial responses and unsent requests"""
+        if self.sock:
+            self.sock.close()
+            self.sock = None
+        self._recv_buf = ""
+        self._reqs = []
 
     def get_logger(self):
         return self._logger
@@ -106,6 +228,13 @@ class JSONRPCClient(object):
         self._logger.setLevel(lvl)
         self._logger.info("Log level set to %s", lvl)
 
+    def add_hook(self, hook):
+        """Add an instrumentation hook, see CallRecord"""
+        self._hooks.append(hook)
+
+    def remove_hook(self, hook):
+        self._hooks.remove(hook)
+
     def close(self):
         if getattr(self, "sock", None):
             self.sock.shutdown(socket.SHUT_RDWR)
@@ -129,11 +258,26 @@ class JSONRPCClient(object):
 
     def flush(self):
         self._logger.debug("Flushing buffer")
-        # TODO: We can drop indent parameter
-        reqstr = "\n".join(json.dumps(req, indent=2) for req in self._reqs)
+        start = time.perf_counter()
+        reqstr = "\n".join(json.dumps(req) for req in self._reqs)
         self._reqs = []
         self._logger.info("Requests:\n%s\n", reqstr)
-        self.sock.sendall(reqstr.encode("utf-8"))
+        data = reqstr.encode("utf-8")
+        sent = time.perf_counter()
+        if not self.sock:
+            raise JSONRPCConnectionError("Not connected to %s" % self._addr, maybe_executed=False)
+        try:
+            self.sock.sendall(data)
+        except OSError as ex:
+            self.sock.close()
+            self.sock = None
+            # With several requests, the first ones may have been sent in full
+            raise JSONRPCConnectionError("Error while sending requests: %s" % ex,
+                                         maybe_executed=data.count(b"\n") > 0)
+        if self._record:
+            self._record.request_bytes += len(data)
+            self._record.serialize_time += sent - start
+            self._record.wait_time += time.perf_counter() - sent
 
     def send(self, method, params=None):
         id = self.add_request(method, params)
@@ -141,6 +285,7 @@ class JSONRPCClient(object):
         return id
 
     def decode_one_response(self):
+        start = time.perf_counter()
         try:
             self._logger.debug("Trying to decode response '%s'", self._recv_buf)
             buf = self._recv_buf.lstrip()
@@ -150,35 +295,105 @@ class JSONRPCClient(object):
         except ValueError:
             self._logger.debug("Partial response")
             return None
+        finally:
+            if self._record:
+                self._record.deserialize_time += time.perf_counter() - start
 
     def recv(self):
-        start_time = time.process_time()
+        start_time = time.monotonic()
         response = self.decode_one_response()
+        chunks = [self._recv_buf]
         while not response:
+            if not self.sock:
+                raise JSONRPCConnectionError("Not connected to %s" % self._addr)
             try:
-                timeout = self.timeout - (time.process_time() - start_time)
+                timeout = self.timeout - (time.monotonic() - start_time)
+                if timeout <= 0:
+                    raise socket.timeout()
                 self.sock.settimeout(timeout)
-                newdata = self.sock.recv(4096)
+                wait_start = time.perf_counter()
+                newdata = self.sock.recv(RECV_SIZE)
+                if self._record:
+                    self._record.wait_time += time.perf_counter() - wait_start
+                    self._record.response_bytes += len(newdata)
                 if not newdata:
+                    self._recv_buf = "".join(chunks)
                     self.sock.close()
                     self.sock = None
-                    raise JSONRPCException("Connection closed with partial response:\n%s\n" % self._recv_buf)
-                self._recv_buf += newdata.decode("utf-8")
+                    raise JSONRPCConnectionError("Connection closed with partial response:\n%s\n" % self._recv_buf)
+                chunks.append(newdata.decode("utf-8"))
+                # Decoding the whole buffer after each chunk is quadratic in the size of the response.
+                # SPDK terminates responses with a newline, so only try once one is received or
+                # the sender has paused at what may be the end of a response.
+                if b"\n" not in newdata and (len(newdata) == RECV_SIZE or not newdata.rstrip().endswith(b"}")):
+                    continue
+                self._recv_buf = "".join(chunks)
+                chunks = [self._recv_buf]
                 response = self.decode_one_response()
             except socket.timeout:
+                self._recv_buf = "".join(chunks)
                 break  # throw exception after loop to avoid Python freaking out about nested exceptions
             except ValueError:
                 continue  # incomplete response; keep buffering
+            except OSError as ex:
+                self._recv_buf = "".join(chunks)
+                self.sock.close()
+                self.sock = None
+                raise JSONRPCConnectionError("Error while receiving response: %s\n%s\n" % (ex, self._recv_buf))
 
         if not response:
-            raise JSONRPCException("Timeout while waiting for response:\n%s\n" % self._recv_buf)
+            raise JSONRPCConnectionError("Timeout while waiting for response:\n%s\n" % self._recv_buf)
 
-        self._logger.info("response:\n%s\n", json.dumps(response, indent=2))
+        if self._logger.isEnabledFor(logging.INFO):
+            self._logger.info("response:\n%s\n", json.dumps(response, indent=2))
         return response
 
     def call(self, method, params={}):
+        if not self._hooks:
+            return self._call_with_retries(method, params)
+
+        record = CallRecord(method, params)
+        for hook in self._hooks:
+            hook.pre_call(record)
+        self._record = record
+        try:
+            return self._call_with_retries(method, params)
+        except Exception as e:
+            record.error = record.error or e
+            raise
+        finally:
+            self._record = None
+            record.duration = time.perf_counter() - record.start
+            for hook in self._hooks:
+                hook.post_call(record)
+
+    def _call_with_retries(self, method, params):
+        if not self.retry_policy:
+            return self._call(method, params)
+
+        delays = self.retry_policy.delays()
+        while True:
+            try:
+                if not self.sock:
+                    self._connect(self._addr, self._port)
+                return self._call(method, params)
+            except JSONRPCConnectionError as ex:
+                # A late response to a timed out request would be taken for the response to the next one
+                self._disconnect()
+                if ex.maybe_executed and not self.retry_policy.read_only(method):
+                    ex.message += "\nNot retrying '%s', it may have been executed\n" % method
+                    raise ex
+                delay = next(delays, None)
+                if delay is None:
+                    raise ex
+                self._logger.info("Retrying '%s' in %.2fs: %s", method, delay, ex.message)
+                time.sleep(delay)
+
+    def _call(self, method, params):
         self._logger.debug("call('%s')" % method)
         req_id = self.send(method, params)
+        if self._record:
+            self._record.request_id = req_id
         try:
             response = self.recv()
         except JSONRPCException as e:
@@ -190,12 +405,8 @@ class JSONRPCClient(object):
                 raise e
 
         if 'error' in response:
-            params["method"] = method
-            params["req_id"] = req_id
-            msg = "\n".join(["request:", "%s" % json.dumps(params, indent=2),
-                             "Got JSON-RPC error response",
-                             "response:",
-                             json.dumps(response['error'], indent=2)])
-            raise JSONRPCException(msg)
+            if self._record:
+                self._record.error = response['error']
+            raise JSONRPCException(error_response_message(method, params, req_id, response['error']))
 
         return response['result']
@@ -0,0 +1,195 @@
+"""Execution of RPCs on many SPDK targets at once.
+
+Fleet runs a call, or any function taking a client, on a list of targets with a
+bounded number of them in progress at a time and a timeout for each, and yields the
+results as soon as each target is done:
+
+    fleet = Fleet([Target.parse(t) for t in ["/var/tmp/spdk.sock", "10.0.0.2:5260"]])
+    for result in fleet.call("bdev_get_iostat"):
+        print(result.target, result.error or result.result)
+
+aggregate_iostat() and merge_histograms() combine the results of bdev_get_iostat and
+bdev_get_histogram of all the targets into fleet-wide statistics.
+"""
+
+import base64
+import concurrent.futures
+import json
+import struct
+import time
+
+from . import load_subsystems
+from .client import JSONRPCClient, JSONRPCException
+from .instrumentation import LatencyHistogram
+
+DEFAULT_PORT = 5260
+
+
+class Target(object):
+    def __init__(self, addr, port=DEFAULT_PORT):
+        self.addr = addr
+        self.port = port
+
+    @classmethod
+    def parse(cls, spec, default_port=DEFAULT_PORT):
+        """Parse a target given as a UNIX domain socket path, IPv4 address, [IPv6 address], optionally
+        followed by :port"""
+        if spec.startswith('['):
+            addr, _, port = spec[1:].partition(']')
+            return cls(addr, int(port[1:]) if port.startswith(':') else default_port)
+        if spec.count(':') == 1:
+            addr, port = spec.split(':')
+            return cls(addr, int(port))
+        return cls(spec, default_port)
+
+    def __str__(self):
+        if ':' in self.addr:
+            return "[%s]:%d" % (self.addr, self.port)
+        if '/' in self.addr:
+            return self.addr
+        return "%s:%d" % (self.addr, self.port)
+
+
+class TargetResult(object):
+    """Outcome of an operation on a target: its result or the error it failed with, and its duration in seconds"""
+    def __init__(self, target, result=None, error=None, duration=0.0):
+        self.target = target
+        self.result = result
+        self.error = error
+        self.duration = duration
+
+    def to_dict(self):
+        ret = {'target': str(self.target), 'duration': self.duration}
+        if self.error is not None:
+            ret['error'] = self.error
+        else:
+            ret['result'] = self.result
+        return ret
+
+
+class Fleet(object):
+    def __init__(self, targets, concurrency=32, timeout=10.0, conn_retries=0):
+        """
+        Args:
+            targets: list of Targets
+            concurrency: maximum number of targets operated on at the same time
+            timeout: timeout in seconds for connecting to a target and waiting for each of its responses
+            conn_retries: number of retries of connecting to a target
+        """
+        self.targets = targets
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self.conn_retries = conn_retries
+
+    def _run(self, target, func):
+        start = time.monotonic()
+        try:
+            with JSONRPCClient(target.addr, target.port, timeout=self.timeout,
+                               conn_retries=self.conn_retries) as client:
+                result = func(client)
+            return TargetResult(target, result=result, duration=time.monotonic() - start)
+        except JSONRPCException as ex:
+            return TargetResult(target, error=ex.message.strip(), duration=time.monotonic() - start)
+        except (OSError, ValueError) as ex:
+            return TargetResult(target, error=str(ex), duration=time.monotonic() - start)
+
+    def map(self, func):
+        """Call func(client) for every target, with a new connection to it.
+
+        Yields:
+            TargetResults, in the order the targets are done.
+        """
+        if not self.targets:
+            return
+        with concurrent.futures.ThreadPoolExecutor(max_workers=min(self.concurrency, len(self.targets))) as executor:
+            futures = [executor.submit(self._run, target, func) for target in self.targets]
+            try:
+                for future in concurrent.futures.as_completed(futures):
+                    yield future.result()
+            finally:
+                # Don't start on the remaining targets if the caller stopped early
+                for future in futures:
+                    future.cancel()
+
+    def call(self, method, params=None):
+        return self.map(lambda client: client.call(method, params or {}))
+
+    def load_config(self, config):
+        """Load a configuration (JSON string as written by save_config, or the parsed dict) into
+        every target. It is parsed once and shared by all the targets."""
+        if isinstance(config, str):
+            config = json.loads(config)
+        return self.load_subsystems(config['subsystems'])
+
+    def load_subsystems(self, subsystems):
+        """Load the "subsystems" of a configuration, e.g. from provision.subsystems(), into every target"""
+        return self.map(lambda client: load_subsystems(client, subsystems))
+
+
+def _merge_stats(total, stats):
+    for key, value in stats.items():
+        if not isinstance(value, (int, float)) or isinstance(value, bool):
+            continue
+        if key not in total:
+            total[key] = value
+        elif key.startswith('max_') or key.endswith('_period'):
+            total[key] = max(total[key], value)
+        elif key.startswith('min_'):
+            total[key] = min(total[key], value)
+        else:
+            total[key] += value
+
+
+def aggregate_iostat(iostats):
+    """Aggregate bdev_get_iostat results of many targets.
+
+    Counters are summed, except for max_*, min_* and *_period ones. Latencies are converted from
+    ticks to seconds using the tick rate of each target (*_ticks -> *_seconds).
+
+    Returns:
+        Dict with the number of targets, totals over all their bdevs ('total') and over
+        the bdevs of the same name ('bdevs').
+    """
+    total = {'bdevs': 0}
+    bdevs = {}
+    count = 0
+    for iostat in iostats:
+        count += 1
+        tick_rate = iostat['tick_rate']
+        for bdev in iostat['bdevs']:
+            stats = {}
+            for key, value in bdev.items():
+                if key.endswith('_ticks'):
+                    stats[key[:-len('_ticks')] + '_seconds'] = value / tick_rate
+                else:
+                    stats[key] = value
+            total['bdevs'] += 1
+            _merge_stats(total, stats)
+            _merge_stats(bdevs.setdefault(bdev['name'], {}), stats)
+    return {'targets': count, 'total': total, 'bdevs': bdevs}
+
+
+def decode_histogram(histogram):
+    """Convert a bdev_get_histogram result into a LatencyHistogram.
+
+    Each bucket's I/Os are recorded with the bucket's upper bound, like histogram.py prints it.
+    """
+    data = base64.b64decode(histogram['histogram'])
+    bucket_shift = histogram['bucket_shift']
+    tsc_rate = histogram['tsc_rate']
+    ret = LatencyHistogram()
+    for index, (count, ) in enumerate(struct.iter_unpack('<Q', data)):
+        if not count:
+            continue
+        i, j = index >> bucket_shift, index & ((1 << bucket_shift) - 1)
+        end = (1 << (i + bucket_shift - 1)) + ((j + 1) << (i - 1)) if i > 0 else j + 1
+        ret.record(end / tsc_rate, count)
+    return ret
+
+
+def merge_histograms(histograms):
+    """Merge bdev_get_histogram results of many targets (with possibly different tick rates) into a LatencyHistogram"""
+    ret = LatencyHistogram()
+    for histogram in histograms:
+        ret.merge(decode_histogram(histogram))
+    return ret
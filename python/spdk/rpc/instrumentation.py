@@ -0,0 +1,204 @@
+"""Per-method statistics of JSON-RPC calls.
+
+RPCStats is an instrumentation hook of JSONRPCClient (see client.CallRecord), which
+aggregates the calls of any number of clients by method: number of calls and errors,
+request and response sizes, time spent serializing, waiting and deserializing and a
+histogram of call latencies. The statistics can be exported as JSON or in the
+OpenMetrics text format.
+"""
+
+import bisect
+import itertools
+import json
+import threading
+
+# Upper bounds (in seconds) of the buckets of exported OpenMetrics histograms
+OPENMETRICS_BUCKETS = [0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                       1.0, 2.5, 5.0, 10.0, 30.0, 60.0]
+PERCENTILES = [50, 90, 99, 99.9]
+
+
+class LatencyHistogram(object):
+    """HDR-style histogram of latencies with a relative error below 1% over the whole range.
+
+    Latencies are recorded in nanoseconds. Values below 256 have their own buckets, larger
+    ones are grouped in buckets of 128 values per power of two, each spanning under 1/128
+    of the values it holds. Only non-empty buckets are stored.
+    """
+    SUB_BUCKET_BITS = 8
+    SUB_BUCKET_HALF = 1 << (SUB_BUCKET_BITS - 1)
+
+    def __init__(self):
+        self.counts = {}
+        self.count = 0
+        self.total = 0
+        self.min = None
+        self.max = None
+
+    @classmethod
+    def _index(cls, value):
+        exponent = value.bit_length() - cls.SUB_BUCKET_BITS
+        if exponent <= 0:
+            return value
+        return exponent * cls.SUB_BUCKET_HALF + (value >> exponent)
+
+    @classmethod
+    def _highest_value(cls, index):
+        """Highest value falling into the bucket of the given index"""
+        if index < 2 * cls.SUB_BUCKET_HALF:
+            return index
+        exponent = index // cls.SUB_BUCKET_HALF - 1
+        return ((index - exponent * cls.SUB_BUCKET_HALF + 1) << exponent) - 1
+
+    def record(self, seconds, count=1):
+        value = max(0, int(seconds * 1e9))
+        index = self._index(value)
+        self.counts[index] = self.counts.get(index, 0) + count
+        self.count += count
+        self.total += value * count
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+
+    def merge(self, other):
+        for index, count in other.counts.items():
+            self.counts[index] = self.counts.get(index, 0) + count
+        self.count += other.count
+        self.total += other.total
+        if other.count:
+            self.min = other.min if self.min is None else min(self.min, other.min)
+            self.max = other.max if self.max is None else max(self.max, other.max)
+        return self
+
+    def buckets(self):
+        """Get (highest value in seconds, count) pairs of the non-empty buckets, in ascending order"""
+        return [(min(self._highest_value(i), self.max) / 1e9, self.counts[i]) for i in sorted(self.counts)]
+
+    def percentiles(self, percentiles):
+        """Get latencies (in seconds) below which the given percentages (0-100) of calls completed"""
+        if not self.count:
+            return [0.0] * len(percentiles)
+        buckets = self.buckets()
+        cumulative = list(itertools.accumulate(count for _, count in buckets))
+        results = []
+        for percentile in percentiles:
+            index = bisect.bisect_left(cumulative, max(1, percentile / 100 * self.count))
+            results.append(buckets[min(index, len(buckets) - 1)][0])
+        return results
+
+    def percentile(self, percentile):
+        return self.percentiles([percentile])[0]
+
+    def mean(self):
+        return self.total / self.count / 1e9 if self.count else 0.0
+
+    def cumulative_counts(self, bounds):
+        """Get numbers of calls with latency less or equal to each of the bounds (in seconds)"""
+        buckets = self.buckets()
+        counts = []
+        pos = 0
+        cumulative = 0
+        for bound in bounds:
+            while pos < len(buckets) and buckets[pos][0] <= bound:
+                cumulative += buckets[pos][1]
+                pos += 1
+            counts.append(cumulative)
+        return counts
+
+
+class MethodStats(object):
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.request_bytes = 0
+        self.response_bytes = 0
+        self.serialize_time = 0.0
+        self.wait_time = 0.0
+        self.deserialize_time = 0.0
+        self.latency = LatencyHistogram()
+
+    def add(self, record):
+        self.calls += 1
+        self.errors += record.error is not None
+        self.request_bytes += record.request_bytes
+        self.response_bytes += record.response_bytes
+        self.serialize_time += record.serialize_time
+        self.wait_time += record.wait_time
+        self.deserialize_time += record.deserialize_time
+        self.latency.record(record.duration)
+
+    def to_dict(self):
+        latency = {"min": (self.latency.min or 0) / 1e9, "mean": self.latency.mean(),
+                   "max": (self.latency.max or 0) / 1e9}
+        latency.update(("p%s" % p, v) for p, v in zip(PERCENTILES, self.latency.percentiles(PERCENTILES)))
+        return {"calls": self.calls, "errors": self.errors, "request_bytes": self.request_bytes,
+                "response_bytes": self.response_bytes, "serialize_time": self.serialize_time,
+                "wait_time": self.wait_time, "deserialize_time": self.deserialize_time,
+                "latency": latency, "histogram": self.latency.buckets()}
+
+
+class RPCStats(object):
+    """Instrumentation hook aggregating calls of JSONRPCClients by method.
+
+    Usage:
+        stats = RPCStats()
+        client = JSONRPCClient(addr, hooks=[stats])
+        ...
+        stats.write("rpc_stats.json")
+    """
+    def __init__(self):
+        self.methods = {}
+        self._lock = threading.Lock()
+
+    def pre_call(self, record):
+        pass
+
+    def post_call(self, record):
+        with self._lock:
+            if record.method not in self.methods:
+                self.methods[record.method] = MethodStats()
+            self.methods[record.method].add(record)
+
+    def to_dict(self):
+        with self._lock:
+            return {"methods": {name: stats.to_dict() for name, stats in sorted(self.methods.items())}}
+
+    def to_json(self, indent=2):
+        return json.dumps(self.to_dict(), indent=indent)
+
+    def to_openmetrics(self, prefix="spdk_rpc"):
+        with self._lock:
+            methods = sorted(self.methods.items())
+        lines = []
+
+        def counter(name, help, values):
+            lines.extend(["# TYPE %s_%s counter" % (prefix, name), "# HELP %s_%s %s" % (prefix, name, help)])
+            for labels, value in values:
+                lines.append("%s_%s_total{%s} %s" % (prefix, name, labels, value))
+
+        counter("calls", "Number of calls.", [('method="%s"' % m, s.calls) for m, s in methods])
+        counter("errors", "Number of failed calls.", [('method="%s"' % m, s.errors) for m, s in methods])
+        counter("request_bytes", "Size of requests in bytes.",
+                [('method="%s"' % m, s.request_bytes) for m, s in methods])
+        counter("response_bytes", "Size of responses in bytes.",
+                [('method="%s"' % m, s.response_bytes) for m, s in methods])
+        counter("phase_seconds", "Time spent serializing requests, waiting for responses and deserializing them.",
+                [('method="%s",phase="%s"' % (m, phase), getattr(s, "%s_time" % phase))
+                 for m, s in methods for phase in ["serialize", "wait", "deserialize"]])
+
+        name = "%s_call_duration_seconds" % prefix
+        lines.extend(["# TYPE %s histogram" % name, "# HELP %s Latency of calls." % name])
+        for method, stats in methods:
+            counts = stats.latency.cumulative_counts(OPENMETRICS_BUCKETS)
+            for bound, count in zip(OPENMETRICS_BUCKETS, counts):
+                lines.append('%s_bucket{method="%s",le="%s"} %d' % (name, method, bound, count))
+            lines.append('%s_bucket{method="%s",le="+Inf"} %d' % (name, method, stats.latency.count))
+            lines.append('%s_count{method="%s"} %d' % (name, method, stats.latency.count))
+            lines.append('%s_sum{method="%s"} %s' % (name, method, stats.latency.total / 1e9))
+        lines.append("# EOF")
+        return "\n".join(lines) + "\n"
+
+    def write(self, path):
+        """Write the statistics to a file, in the OpenMetrics format if its name ends with .prom
+        or .om, as JSON otherwise"""
+        with open(path, "w") as fh:
+            fh.write(self.to_openmetrics() if path.endswith((".prom", ".om")) else self.to_json())
@@ -0,0 +1,122 @@
+"""Pipelined execution of many requests over a single connection.
+
+Sending a request only after the response to the previous one was received makes
+bulk configuration (thousands of bdev_malloc_create calls) bound by round trips.
+Pipeline keeps up to a window of requests in flight instead.
+
+The SPDK RPC server dispatches requests as soon as it parses them, so a request sent
+before the previous response was received may run while the previous one is still in
+progress, if its method completes asynchronously (e.g. bdev_lvol_create waiting for
+blobstore or nvmf_subsystem_add_ns pausing the subsystem). To keep the semantics of
+executing the requests one by one, further requests are only sent while all the
+requests in flight are of methods known to complete before their handler returns
+(SYNC_METHODS). After a request of any other method, the pipeline waits for its
+response first.
+"""
+
+import collections
+
+from .client import JSONRPCException
+
+# Methods whose handlers complete the operation and send the response before returning
+SYNC_METHODS = frozenset([
+    'bdev_malloc_create',
+    'bdev_null_create',
+    'bdev_passthru_create',
+    'bdev_delay_create',
+    'bdev_error_create',
+    'nvmf_subsystem_add_host',
+    'nvmf_subsystem_allow_any_host',
+    'log_set_flag',
+    'log_clear_flag',
+    'log_set_level',
+    'log_set_print_level',
+    'rpc_get_methods',
+    'spdk_get_version',
+])
+
+
+class Pipeline(object):
+    """Sends requests keeping up to window of them in flight and returns their responses in order.
+
+    Usage:
+        pipeline = Pipeline(client, window=64)
+        for method, params in requests:
+            for context, response in pipeline.submit(method, params, context):
+                ...
+        for context, response in pipeline.drain():
+            ...
+    """
+    def __init__(self, client, window=64, sync_methods=SYNC_METHODS):
+        self.client = client
+        self.window = max(1, window)
+        self.sync_methods = sync_methods
+        # Requests in the order of submission: [id, context, response]
+        self._queue = collections.deque()
+        self._pending = {}
+        self._unsent = 0
+
+    def __len__(self):
+        return len(self._queue)
+
+    def _flush(self):
+        if self._unsent:
+            self.client.flush()
+            self._unsent = 0
+
+    def _recv(self):
+        response = self.client.recv()
+        entry = self._pending.pop(response.get('id'), None)
+        if entry is None:
+            raise JSONRPCException("Unexpected response:\n%s\n" % response)
+        entry[2] = response
+
+    def _completed(self):
+        completed = []
+        while self._queue and self._queue[0][2] is not None:
+            _, context, response = self._queue.popleft()
+            completed.append((context, response))
+        return completed
+
+    def submit(self, method, params=None, context=None):
+        """Queue a request, sending it and receiving responses as needed.
+
+        Returns:
+            List of (context, response) of the requests completed in the meantime, in submission order.
+        """
+        request_id = self.client.add_request(method, params)
+        entry = [request_id, context, None]
+        self._queue.append(entry)
+        self._pending[request_id] = entry
+        self._unsent += 1
+        if method not in self.sync_methods:
+            self._flush()
+            while entry[2] is None:
+                self._recv()
+        elif len(self._pending) >= self.window:
+            self._flush()
+            # Receive half of the window, so that the following requests are sent in batches
+            while len(self._pending) > self.window // 2:
+                self._recv()
+        return self._completed()
+
+    def drain(self):
+        """Wait for all the requests in flight.
+
+        Returns:
+            List of (context, response) of the remaining requests, in submission order.
+        """
+        self._flush()
+        while self._pending:
+            self._recv()
+        return self._completed()
+
+    def run(self, requests):
+        """Execute an iterable of (method, params, context), consumed lazily.
+
+        Yields:
+            (context, response) of each request, in order.
+        """
+        for method, params, context in requests:
+            yield from self.submit(method, params, context)
+        yield from self.drain()
@@ -0,0 +1,160 @@
+"""Bulk provisioning from compact templates.
+
+A template describes many similar requests with a few lines of JSON. Each step is a
+method with parameters, repeated for every combination of the values of its loop
+variables:
+
+    {
+      "vars": {"count": 100, "nqn": "nqn.2016-06.io.spdk"},
+      "steps": [
+        {"method": "bdev_malloc_create",
+         "foreach": {"s": {"range": ["{count}"]}, "n": {"range": [1, 5]}},
+         "params": {"name": "Malloc{s}_{n}", "num_blocks": 2048, "block_size": 512}},
+        {"method": "nvmf_create_subsystem",
+         "foreach": {"s": {"range": ["{count}"]}},
+         "params": {"nqn": "{nqn}:cnode{s:03d}", "allow_any_host": true}},
+        {"method": "nvmf_subsystem_add_ns",
+         "foreach": {"s": {"range": ["{count}"]}, "n": {"range": [1, 5]}},
+         "params": {"nqn": "{nqn}:cnode{s:03d}", "namespace": {"bdev_name": "Malloc{s}_{n}", "nsid": "{n}"}}}
+      ]
+    }
+
+"foreach" iterates over the product of the values of its variables (the last one
+varying fastest), "zip" over their values in parallel; a step can have both, the
+zipped values then form the outermost loop. Values are given as a list or as a
+{"range": [start, ]stop[, step]}. Strings in parameters are formatted with str.format()
+using the loop variables and "vars", a string consisting only of a single "{name}"
+is replaced by the value itself, keeping its type.
+
+expand() generates the requests lazily, so that they can be sent by provision() over a
+Pipeline or written by write_config() as a configuration for load_config, without ever
+holding all of them in memory. Targets started with --wait-for-rpc need the requests
+ordered by RPC state as load_config does, load() does that with the expanded
+subsystems directly, so they are held only once, instead of writing and re-reading
+a configuration.
+"""
+
+import itertools
+import json
+import re
+
+from . import _json_load, load_subsystems
+from .client import JSONRPCException, error_response_message
+from .pipeline import Pipeline
+
+_SINGLE_FIELD = re.compile(r"\{(\w+)\}")
+
+
+def load_template(fd):
+    """Load a template from a file object, file path or JSON string"""
+    return _json_load(fd)
+
+
+def _render(value, variables):
+    if isinstance(value, str):
+        match = _SINGLE_FIELD.fullmatch(value)
+        if match and match.group(1) in variables:
+            return variables[match.group(1)]
+        return value.format_map(variables)
+    if isinstance(value, dict):
+        return {k: _render(v, variables) for k, v in value.items()}
+    if isinstance(value, list):
+        return [_render(v, variables) for v in value]
+    return value
+
+
+def _values(spec, variables):
+    if isinstance(spec, dict) and 'range' in spec:
+        return range(*(int(_render(v, variables)) for v in spec['range']))
+    if isinstance(spec, list):
+        return spec
+    raise ValueError("Invalid loop values: %s" % json.dumps(spec))
+
+
+def _product(loops):
+    if not loops:
+        yield {}
+        return
+    for values in loops[0]():
+        for inner in _product(loops[1:]):
+            yield dict(values, **inner)
+
+
+def _iterations(step, variables):
+    """Generate dicts with the values of the loop variables of a step for each of its iterations"""
+    loops = []
+    if 'zip' in step:
+        names = list(step['zip'])
+        loops.append(lambda: (dict(zip(names, values))
+                              for values in zip(*(_values(step['zip'][n], variables) for n in names))))
+    for name, spec in step.get('foreach', {}).items():
+        loops.append(lambda name=name, spec=spec: ({name: value} for value in _values(spec, variables)))
+    return _product(loops)
+
+
+def expand(template):
+    """Generate (subsystem, method, params) of the requests described by a template, in order"""
+    constants = template.get('vars', {})
+    for step in template['steps']:
+        if 'method' not in step:
+            raise ValueError("Step without method: %s" % json.dumps(step))
+        method = step['method']
+        subsystem = step.get('subsystem', method.split('_')[0])
+        for iteration in _iterations(step, constants):
+            variables = dict(constants, **iteration)
+            yield subsystem, method, _render(step.get('params'), variables)
+
+
+def _grouped(template):
+    """Generate (subsystem, elems) of the consecutive requests of the same subsystem,
+    elems generating the requests as they appear in a configuration"""
+    for subsystem, requests in itertools.groupby(expand(template), key=lambda r: r[0]):
+        yield subsystem, ({'method': method, 'params': params} if params is not None else {'method': method}
+                          for _, method, params in requests)
+
+
+def subsystems(template):
+    """Return the requests of a template as the "subsystems" of a configuration"""
+    return [{'subsystem': subsystem, 'config': list(elems)} for subsystem, elems in _grouped(template)]
+
+
+def load(client, template, include_aliases=False):
+    """Execute the requests of a template like load_config would execute them from the
+    configuration written by write_config, without writing and parsing it."""
+    load_subsystems(client, subsystems(template), include_aliases)
+
+
+def write_config(template, fd):
+    """Write the requests of a template as a configuration which can be loaded with load_config.
+
+    Consecutive requests of the same subsystem are written as its config, so a step can
+    set the subsystem a request is listed in with "subsystem" (the prefix of the method
+    name by default).
+    """
+    fd.write('{\n  "subsystems": [')
+    first_subsystem = True
+    for subsystem, elems in _grouped(template):
+        fd.write('%s\n    {\n      "subsystem": %s,\n      "config": [' %
+                 ('' if first_subsystem else ',', json.dumps(subsystem)))
+        first_subsystem = False
+        separator = '\n'
+        for elem in elems:
+            fd.write(separator + '        ' + json.dumps(elem))
+            separator = ',\n'
+        fd.write('\n      ]\n    }')
+    fd.write('\n  ]\n}\n')
+
+
+def provision(client, template, window=64):
+    """Send the requests of a template over a Pipeline, stopping at the first error.
+
+    Returns:
+        Number of executed requests.
+    """
+    count = 0
+    requests = ((method, params, (method, params)) for _, method, params in expand(template))
+    for (method, params), response in Pipeline(client, window).run(requests):
+        if 'error' in response:
+            raise JSONRPCException(error_response_message(method, params, response['id'], response['error']))
+        count += 1
+    return count
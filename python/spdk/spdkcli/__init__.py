@@ -1 +1,2 @@
 from .ui_root import UIRoot
+from .batch import Batch
@@ -0,0 +1,195 @@
+from configshell_fb import ExecutionError
+from .ui_node import STATE_CHANGING_COMMANDS
+import re
+import time
+
+
+# State-changing commands which still have to be executed one RPC at a time: they either
+# read the tree they're about to modify or issue RPCs depending on each other's completion.
+SYNCHRONOUS_COMMANDS = ["delete_all", "delete_secret_all", "load_config", "load_subsystem_config"]
+
+
+class PipelinedClient(object):
+    """
+    Wrapper of JSONRPCClient sending state-changing requests without waiting for
+    their responses, which are collected in windows of up to `window` requests.
+    Queries (methods containing "_get_") are always synchronous and first wait for
+    all outstanding requests, so that they observe their effects.
+    """
+    def __init__(self, client, window=64):
+        self.client = client
+        self.window = window
+        self.deferred = False
+        self.tag = None
+        self.requests = 0
+        self.results = []
+        self.errors = []
+        self._pending = {}
+
+    @staticmethod
+    def is_query(method):
+        return re.search(r"(^|_)get_", method) is not None
+
+    def log_set_level(self, lvl):
+        self.client.log_set_level(lvl)
+
+    def call(self, method, params={}):
+        self.requests += 1
+        if not self.deferred or self.is_query(method):
+            self.drain()
+            return self.client.call(method, params)
+        req_id = self.client.add_request(method, params)
+        self._pending[req_id] = (self.tag, method, params)
+        if len(self._pending) >= self.window:
+            self.drain()
+
+    def drain(self):
+        """Send the buffered requests and wait for all outstanding responses."""
+        if not self._pending:
+            return
+        self.client.flush()
+        while self._pending:
+            response = self.client.recv()
+            tag, method, params = self._pending.pop(response["id"])
+            if "error" in response:
+                self.errors.append((tag, method, params, response["error"]))
+            else:
+                self.results.append((tag, method, response["result"]))
+
+
+class Batch(object):
+    """
+    Executes a script of spdkcli commands as a single pipelined stream of JSON-RPC
+    requests.  The tree is only synchronized with the target when a command needs
+    its current state (queries, paths created earlier in the script) and once at
+    the end, instead of after every state-changing command.
+    """
+    def __init__(self, root, lines):
+        self.root = root
+        self.shell = root.shell
+        self.commands = []
+        self.errors = []
+        for lineno, line in enumerate(lines, 1):
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            try:
+                path, command, pparams, kparams = self.shell._parse_cmdline(line)[1:]
+            except Exception as e:
+                self.errors.append((lineno, line, "Syntax error: %s" % e))
+                continue
+            self.commands.append((lineno, line, path, command, pparams, kparams))
+
+    def validate(self):
+        """
+        Check the commands against the current tree without executing them.  Paths
+        which don't exist yet are assumed to be created by preceding commands and are
+        only checked once the script gets to them.
+
+        Returns:
+            List of (line number, line, error message) tuples.
+        """
+        cwd = self.root
+        for lineno, line, path, command, pparams, kparams in self.commands:
+            node = self._get_node(self.root if path.startswith("/") else cwd, path or ".")
+            if not command or command == "cd":
+                # Follow the working directory, as long as it's already known
+                cwd = node if not command else self._get_node(node, pparams[0] if pparams else "/")
+                continue
+            if node is None or command in ["ls", "ll"]:
+                continue
+            try:
+                self._check_command(node, command, pparams, kparams)
+            except ExecutionError as e:
+                self.errors.append((lineno, line, str(e)))
+        return self.errors
+
+    @staticmethod
+    def _get_node(node, path):
+        if node is None:
+            return None
+        try:
+            return node.get_node(path)
+        except ValueError:
+            return None
+
+    @staticmethod
+    def _check_command(node, command, pparams, kparams):
+        if command not in node.list_commands():
+            raise ExecutionError("Command not found %s" % command)
+        node.assert_params(node.get_command_method(command), pparams, kparams)
+
+    def _sync(self, client):
+        client.drain()
+        cwd = self.shell._current_node.path
+        self.root.refresh()
+        try:
+            self.shell._current_node = self.root.get_node(cwd)
+        except ValueError:
+            self.shell._current_node = self.root
+
+    def _resolve(self, path):
+        return self._get_node(self.shell._current_node, path or ".")
+
+    def run(self, window=64):
+        """
+        Execute the commands, stopping at the first one which fails synchronously.
+        Requests already sent when a pipelined one fails are still executed.
+
+        Returns:
+            List of (line number, line, error message) tuples.
+        """
+        client = PipelinedClient(self.root.client, window)
+        interactive, loglevel = self.shell.interactive, self.shell.prefs['loglevel_console']
+        lines = {}
+        dirty = False
+        start = time.monotonic()
+
+        self.root.stop_prefetch()
+        self.root.set_rpc_target(client)
+        self.shell.interactive = False
+        self.shell._current_node = self.root
+        try:
+            for lineno, line, path, command, pparams, kparams in self.commands:
+                lines[lineno] = line
+                pipelined = command in STATE_CHANGING_COMMANDS and command not in SYNCHRONOUS_COMMANDS \
+                    and not path.endswith("*")
+                node = self._resolve(path) if pipelined else None
+                if dirty and (not pipelined or node is None):
+                    self._sync(client)
+                    dirty = False
+                    node = self._resolve(path) if pipelined else None
+                client.tag = lineno
+                client.deferred = pipelined
+                # Results of pipelined commands aren't known yet, they're displayed once received
+                self.shell.prefs['loglevel_console'] = 'warning' if pipelined else loglevel
+                try:
+                    if not pipelined:
+                        self.shell._execute_command(path, command, pparams, kparams)
+                    elif node is None:
+                        raise ExecutionError("No such path %s" % path)
+                    else:
+                        node.execute_command(command, pparams, kparams)
+                except Exception as e:
+                    self.errors.append((lineno, line, getattr(e, "message", str(e))))
+                    break
+                finally:
+                    self.shell.prefs['loglevel_console'] = loglevel
+                dirty = dirty or pipelined
+            client.deferred = False
+            client.drain()
+        finally:
+            self.shell.interactive = interactive
+            self.root.set_rpc_target(client.client)
+            self.root.refresh()
+            self.shell._current_node = self.root
+
+        for lineno, method, result in client.results:
+            if result is not True:
+                self.shell.log.info("%d: %s" % (lineno, result))
+        for lineno, method, params, error in client.errors:
+            self.errors.append((lineno, lines[lineno], "%s: %s" % (method, error.get("message"))))
+        self.errors.sort()
+        self.shell.log.info("Executed %d commands with %d requests in %.3f s" %
+                            (len(lines), client.requests, time.monotonic() - start))
+        return self.errors
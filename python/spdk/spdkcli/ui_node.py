@@ -1,4 +1,5 @@
 from configshell_fb import ConfigNode, ExecutionError
+from functools import wraps
 from uuid import UUID
 from ..rpc.client import JSONRPCException
 import json
@@ -13,10 +14,74 @@ def convert_bytes_to_human(size):
         size /= 1024.0
 
 
+# Commands modifying SPDK configuration, which require the tree to be refreshed
+STATE_CHANGING_COMMANDS = ["create", "delete", "delete_all", "add_initiator",
+                           "allow_any_host", "bdev_split_create", "add_lun",
+                           "iscsi_target_node_add_pg_ig_maps", "remove_target", "add_secret",
+                           "bdev_split_delete", "bdev_pmem_delete_pool",
+                           "bdev_pmem_create_pool", "delete_secret_all",
+                           "delete_initiator", "set_auth", "delete_secret",
+                           "iscsi_target_node_remove_pg_ig_maps", "load_config",
+                           "load_subsystem_config"]
+
+
+def lazy(refresh):
+    # For nodes listing SPDK objects: refresh() only marks the children as out
+    # of date, they're built the next time they're accessed (cd, ls, completion).
+    @wraps(refresh)
+    def w(self):
+        self._pending_refresh = refresh
+    return w
+
+
 class UINode(ConfigNode):
     def __init__(self, name, parent=None, shell=None):
+        self._pending_refresh = None
+        self._hide_children = False
         ConfigNode.__init__(self, name, parent, shell)
 
+    @property
+    def children(self):
+        if self._hide_children:
+            return ()
+        self.materialize()
+        return ConfigNode.children.fget(self)
+
+    def get_child(self, name):
+        self.materialize()
+        return ConfigNode.get_child(self, name)
+
+    def materialize(self):
+        """Build the children of a lazy node, if they're out of date."""
+        refresh, self._pending_refresh = self._pending_refresh, None
+        if refresh is not None:
+            refresh(self)
+
+    def is_materialized(self):
+        return self._pending_refresh is None
+
+    def count_children(self, listing):
+        """Number of children for summary(). Unless they're already built, count the
+        entries of the listing they're built from instead of building them.
+
+        Args:
+            listing: function returning the entries, usually from the root's RPC snapshot.
+        """
+        if self.is_materialized():
+            return len(ConfigNode.children.fget(self))
+        return sum(1 for _ in listing())
+
+    def _render_tree(self, root, margin=None, depth=None, do_list=False):
+        # ConfigNode gets the children of every node it renders, even of the ones at the
+        # requested depth, whose children aren't printed. Don't build them just for that.
+        if depth == 0 and margin is not None and isinstance(root, UINode) and not root.is_materialized():
+            root._hide_children = True
+            try:
+                return ConfigNode._render_tree(self, root, margin, depth, do_list)
+            finally:
+                root._hide_children = False
+        return ConfigNode._render_tree(self, root, margin, depth, do_list)
+
     def refresh(self):
         for child in self.children:
             child.refresh()
@@ -24,7 +89,12 @@ class UINode(ConfigNode):
     def refresh_node(self):
         self.refresh()
 
+    def snapshot_keys(self):
+        """Keys of the root's RPC snapshot this node's children are built from."""
+        return []
+
     def ui_command_refresh(self):
+        self.get_root().invalidate()
         self.refresh()
 
     def ui_command_ll(self, path=None, depth=None):
@@ -34,6 +104,7 @@ class UINode(ConfigNode):
         self.ui_command_ls(path, depth)
 
     def execute_command(self, command, pparams=[], kparams={}):
+        self.get_root().stop_prefetch()
         try:
             result = ConfigNode.execute_command(self, command,
                                                 pparams, kparams)
@@ -43,17 +114,10 @@ class UINode(ConfigNode):
             self.shell.log.debug("Command %s succeeded." % command)
             return result
         finally:
-            if self.shell.interactive and\
-                command in ["create", "delete", "delete_all", "add_initiator",
-                            "allow_any_host", "bdev_split_create", "add_lun",
-                            "iscsi_target_node_add_pg_ig_maps", "remove_target", "add_secret",
-                            "bdev_split_delete", "bdev_pmem_delete_pool",
-                            "bdev_pmem_create_pool", "delete_secret_all",
-                            "delete_initiator", "set_auth", "delete_secret",
-                            "iscsi_target_node_remove_pg_ig_maps", "load_config",
-                            "load_subsystem_config"]:
-                self.get_root().refresh()
-                self.refresh_node()
+            if self.shell.interactive and command in STATE_CHANGING_COMMANDS:
+                self.get_root().refresh_affected(self)
+            if self.shell.interactive:
+                self.get_root().prefetch()
 
 
 class UIBdevs(UINode):
@@ -83,11 +147,15 @@ class UILvolStores(UINode):
         UINode.__init__(self, "lvol_stores", parent)
         self.refresh()
 
+    @lazy
     def refresh(self):
         self._children = set([])
         for lvs in self.get_root().bdev_lvol_get_lvstores():
             UILvsObj(lvs, self)
 
+    def snapshot_keys(self):
+        return ["bdev_lvol_get_lvstores"]
+
     def delete(self, name, uuid):
         if name is None and uuid is None:
             self.shell.log.error("Please specify one of the identifiers: "
@@ -120,7 +188,7 @@ class UILvolStores(UINode):
 
     def ui_command_delete_all(self):
         rpc_messages = ""
-        for lvs in self._children:
+        for lvs in self.children:
             try:
                 self.delete(None, lvs.lvs.uuid)
             except JSONRPCException as e:
@@ -129,7 +197,7 @@ class UILvolStores(UINode):
             raise JSONRPCException(rpc_messages)
 
     def summary(self):
-        return "Lvol stores: %s" % len(self.children), None
+        return "Lvol stores: %s" % self.count_children(self.get_root().bdev_lvol_get_lvstores), None
 
 
 class UIBdev(UINode):
@@ -137,11 +205,18 @@ class UIBdev(UINode):
         UINode.__init__(self, name, parent)
         self.refresh()
 
+    @lazy
     def refresh(self):
         self._children = set([])
-        for bdev in self.get_root().bdev_get_bdevs(self.name):
+        for bdev in self.list_bdevs():
             UIBdevObj(bdev, self)
 
+    def list_bdevs(self):
+        return self.get_root().bdev_get_bdevs(self.name)
+
+    def snapshot_keys(self):
+        return [("bdev_get_bdevs", self.name.replace("_", " "))]
+
     def ui_command_get_bdev_iostat(self, name=None):
         ret = self.get_root().bdev_get_iostat(name=name)
         self.shell.log.info(json.dumps(ret, indent=2))
@@ -149,7 +224,7 @@ class UIBdev(UINode):
     def ui_command_delete_all(self):
         """Delete all bdevs from this tree node."""
         rpc_messages = ""
-        for bdev in self._children:
+        for bdev in self.children:
             try:
                 self.delete(bdev.name)
             except JSONRPCException as e:
@@ -158,7 +233,7 @@ class UIBdev(UINode):
             raise JSONRPCException(rpc_messages)
 
     def summary(self):
-        return "Bdevs: %d" % len(self.children), None
+        return "Bdevs: %d" % self.count_children(self.list_bdevs), None
 
 
 class UIMallocBdev(UIBdev):
@@ -298,7 +373,7 @@ class UINvmeBdev(UIBdev):
 
     def ui_command_delete_all(self):
         rpc_messages = ""
-        ctrlrs = [x.name for x in self._children]
+        ctrlrs = [x.name for x in self.children]
         ctrlrs = [x.rsplit("n", 1)[0] for x in ctrlrs]
         ctrlrs = set(ctrlrs)
         for ctrlr in ctrlrs:
@@ -548,11 +623,18 @@ class UIVirtioScsiBdev(UIBdev):
     def __init__(self, parent):
         UIBdev.__init__(self, "virtioscsi_disk", parent)
 
+    @lazy
     def refresh(self):
         self._children = set([])
-        for bdev in self.get_root().bdev_virtio_scsi_get_devices():
+        for bdev in self.list_bdevs():
             UIVirtioScsiBdevObj(bdev, self)
 
+    def list_bdevs(self):
+        return self.get_root().bdev_virtio_scsi_get_devices()
+
+    def snapshot_keys(self):
+        return ["bdev_virtio_scsi_get_devices", ("bdev_get_bdevs", "virtio scsi disk")]
+
     def ui_command_create(self, name, trtype, traddr,
                           vq_count=None, vq_size=None):
 
@@ -651,7 +733,6 @@ class UIVhosts(UINode):
 
     def refresh(self):
         self._children = set([])
-        self.get_root().list_vhost_ctrls()
         UIVhostBlk(self)
         UIVhostScsi(self)
 
@@ -661,6 +742,9 @@ class UIVhost(UINode):
         UINode.__init__(self, name, parent)
         self.refresh()
 
+    def snapshot_keys(self):
+        return ["vhost_get_controllers"]
+
     def ui_command_delete(self, name):
         """
         Delete a Vhost controller from configuration.
@@ -676,6 +760,7 @@ class UIVhostBlk(UIVhost):
         UIVhost.__init__(self, "block", parent)
         self.refresh()
 
+    @lazy
     def refresh(self):
         self._children = set([])
         for ctrlr in self.get_root().vhost_get_controllers(ctrlr_type=self.name):
@@ -704,6 +789,7 @@ class UIVhostScsi(UIVhost):
         UIVhost.__init__(self, "scsi", parent)
         self.refresh()
 
+    @lazy
     def refresh(self):
         self._children = set([])
         for ctrlr in self.get_root().vhost_get_controllers(ctrlr_type=self.name):
@@ -756,6 +842,7 @@ class UIVhostScsiCtrlObj(UIVhostCtrl):
         """
         self.get_root().vhost_scsi_controller_remove_target(ctrlr=self.ctrlr.ctrlr,
                                                             scsi_target_num=int(target_num))
+        self.get_root().invalidate()
         for ctrlr in self.get_root().vhost_get_controllers(ctrlr_type="scsi"):
             if ctrlr.ctrlr == self.ctrlr.ctrlr:
                 self.ctrlr = ctrlr
@@ -773,6 +860,7 @@ class UIVhostScsiCtrlObj(UIVhostCtrl):
         self.get_root().vhost_scsi_controller_add_target(ctrlr=self.ctrlr.ctrlr,
                                                          scsi_target_num=int(target_num),
                                                          bdev_name=bdev_name)
+        self.get_root().invalidate()
         for ctrlr in self.get_root().vhost_get_controllers(ctrlr_type="scsi"):
             if ctrlr.ctrlr == self.ctrlr.ctrlr:
                 self.ctrlr = ctrlr
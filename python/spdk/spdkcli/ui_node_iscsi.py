@@ -1,6 +1,6 @@
 from configshell_fb import ExecutionError
 from ..rpc.client import JSONRPCException
-from .ui_node import UINode
+from .ui_node import UINode, lazy
 
 
 class UIISCSI(UINode):
@@ -23,6 +23,7 @@ class UIISCSIGlobalParams(UINode):
         UINode.__init__(self, "global_params", parent)
         self.refresh()
 
+    @lazy
     def refresh(self):
         self._children = set([])
         iscsi_global_params = self.get_root().iscsi_get_options()
@@ -31,6 +32,9 @@ class UIISCSIGlobalParams(UINode):
         for param, val in iscsi_global_params.items():
             UIISCSIGlobalParam("%s: %s" % (param, val), self)
 
+    def snapshot_keys(self):
+        return ["iscsi_get_options"]
+
     def ui_command_set_auth(self, g=None, d=None, r=None, m=None):
         """Set CHAP authentication for discovery service.
 
@@ -57,18 +61,26 @@ class UIISCSIGlobalParam(UINode):
 class UIISCSIDevices(UINode):
     def __init__(self, parent):
         UINode.__init__(self, "target_nodes", parent)
-        self.scsi_devices = list()
         self.refresh()
 
+    @lazy
     def refresh(self):
         self._children = set([])
+        for device, node in self.list_devices():
+            UIISCSIDevice(device, node, self)
+
+    def list_devices(self):
+        """Pairs of SCSI devices and the target nodes they belong to"""
         self.target_nodes = list(self.get_root().iscsi_get_target_nodes())
         self.scsi_devices = list(self.get_root().scsi_get_devices())
         for device in self.scsi_devices:
             for node in self.target_nodes:
                 if hasattr(device, "device_name") and node['name'] \
                         == device.device_name:
-                    UIISCSIDevice(device, node, self)
+                    yield device, node
+
+    def snapshot_keys(self):
+        return ["iscsi_get_target_nodes", "scsi_get_devices"]
 
     def delete(self, name):
         self.get_root().iscsi_delete_target_node(target_node_name=name)
@@ -127,6 +139,7 @@ class UIISCSIDevices(UINode):
     def ui_command_delete_all(self):
         """Delete all target nodes"""
         rpc_messages = ""
+        self.materialize()
         for device in self.scsi_devices:
             try:
                 self.delete(device.device_name)
@@ -150,13 +163,7 @@ class UIISCSIDevices(UINode):
             name=name, bdev_name=bdev_name, lun_id=lun_id)
 
     def summary(self):
-        count = 0
-        for device in self.scsi_devices:
-            for node in self.target_nodes:
-                if hasattr(device, "device_name") and node['name'] \
-                        == device.device_name:
-                    count = count + 1
-        return "Target nodes: %d" % count, None
+        return "Target nodes: %d" % self.count_children(self.list_devices), None
 
 
 class UIISCSIDevice(UINode):
@@ -325,6 +332,7 @@ class UIPortalGroups(UINode):
     def ui_command_delete_all(self):
         """Delete all portal groups"""
         rpc_messages = ""
+        self.materialize()
         for pg in self.pgs:
             try:
                 self.delete(pg.tag)
@@ -333,6 +341,7 @@ class UIPortalGroups(UINode):
         if rpc_messages:
             raise JSONRPCException(rpc_messages)
 
+    @lazy
     def refresh(self):
         self._children = set([])
         self.pgs = list(self.get_root().iscsi_get_portal_groups())
@@ -342,8 +351,11 @@ class UIPortalGroups(UINode):
             except JSONRPCException as e:
                 self.shell.log.error(e.message)
 
+    def snapshot_keys(self):
+        return ["iscsi_get_portal_groups"]
+
     def summary(self):
-        return "Portal groups: %d" % len(self.pgs), None
+        return "Portal groups: %d" % self.count_children(self.get_root().iscsi_get_portal_groups), None
 
 
 class UIPortalGroup(UINode):
@@ -403,6 +415,7 @@ class UIInitiatorGroups(UINode):
     def ui_command_delete_all(self):
         """Delete all initiator groups"""
         rpc_messages = ""
+        self.materialize()
         for ig in self.igs:
             try:
                 self.delete(ig.tag)
@@ -443,14 +456,18 @@ class UIInitiatorGroups(UINode):
             tag=tag, initiators=initiators,
             netmasks=netmasks)
 
+    @lazy
     def refresh(self):
         self._children = set([])
         self.igs = list(self.get_root().iscsi_get_initiator_groups())
         for ig in self.igs:
             UIInitiatorGroup(ig, self)
 
+    def snapshot_keys(self):
+        return ["iscsi_get_initiator_groups"]
+
     def summary(self):
-        return "Initiator groups: %d" % len(self.igs), None
+        return "Initiator groups: %d" % self.count_children(self.get_root().iscsi_get_initiator_groups), None
 
 
 class UIInitiatorGroup(UINode):
@@ -479,14 +496,18 @@ class UIISCSIConnections(UINode):
         UINode.__init__(self, "iscsi_connections", parent)
         self.refresh()
 
+    @lazy
     def refresh(self):
         self._children = set([])
         self.iscsicons = list(self.get_root().iscsi_get_connections())
         for ic in self.iscsicons:
             UIISCSIConnection(ic, self)
 
+    def snapshot_keys(self):
+        return ["iscsi_get_connections"]
+
     def summary(self):
-        return "Connections: %d" % len(self.iscsicons), None
+        return "Connections: %d" % self.count_children(self.get_root().iscsi_get_connections), None
 
 
 class UIISCSIConnection(UINode):
@@ -514,6 +535,7 @@ class UIISCSIAuthGroups(UINode):
         UINode.__init__(self, "auth_groups", parent)
         self.refresh()
 
+    @lazy
     def refresh(self):
         self._children = set([])
         self.iscsi_auth_groups = list(self.get_root().iscsi_get_auth_groups())
@@ -522,6 +544,9 @@ class UIISCSIAuthGroups(UINode):
         for ag in self.iscsi_auth_groups:
             UIISCSIAuthGroup(ag, self)
 
+    def snapshot_keys(self):
+        return ["iscsi_get_auth_groups"]
+
     def delete(self, tag):
         self.get_root().iscsi_delete_auth_group(tag=tag)
 
@@ -556,6 +581,7 @@ class UIISCSIAuthGroups(UINode):
     def ui_command_delete_all(self):
         """Delete all authentication groups."""
         rpc_messages = ""
+        self.materialize()
         for iscsi_auth_group in self.iscsi_auth_groups:
             try:
                 self.delete(iscsi_auth_group['tag'])
@@ -599,6 +625,7 @@ class UIISCSIAuthGroups(UINode):
         """
         rpc_messages = ""
         tag = self.ui_eval_param(tag, "number", None)
+        self.materialize()
         for ag in self.iscsi_auth_groups:
             if ag['tag'] == tag:
                 for secret in ag['secrets']:
@@ -610,7 +637,7 @@ class UIISCSIAuthGroups(UINode):
             raise JSONRPCException(rpc_messages)
 
     def summary(self):
-        return "Groups: %s" % len(self.iscsi_auth_groups), None
+        return "Groups: %s" % self.count_children(lambda: self.get_root().iscsi_get_auth_groups() or []), None
 
 
 class UIISCSIAuthGroup(UINode):
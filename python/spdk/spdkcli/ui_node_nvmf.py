@@ -1,5 +1,5 @@
 from ..rpc.client import JSONRPCException
-from .ui_node import UINode
+from .ui_node import UINode, lazy
 
 
 class UINVMf(UINode):
@@ -18,11 +18,15 @@ class UINVMfTransports(UINode):
         UINode.__init__(self, "transport", parent)
         self.refresh()
 
+    @lazy
     def refresh(self):
         self._children = set([])
         for transport in self.get_root().nvmf_get_transports():
             UINVMfTransport(transport, self)
 
+    def snapshot_keys(self):
+        return ["nvmf_get_transports"]
+
     def ui_command_create(self, trtype, max_queue_depth=None, max_io_qpairs_per_ctrlr=None,
                           in_capsule_data_size=None, max_io_size=None, io_unit_size=None, max_aq_depth=None):
         """Create a transport with given parameters
@@ -52,7 +56,7 @@ class UINVMfTransports(UINode):
                                               max_aq_depth=max_aq_depth)
 
     def summary(self):
-        return "Transports: %s" % len(self.children), None
+        return "Transports: %s" % self.count_children(self.get_root().nvmf_get_transports), None
 
 
 class UINVMfTransport(UINode):
@@ -66,11 +70,15 @@ class UINVMfSubsystems(UINode):
         UINode.__init__(self, "subsystem", parent)
         self.refresh()
 
+    @lazy
     def refresh(self):
         self._children = set([])
         for subsystem in self.get_root().nvmf_get_subsystems():
             UINVMfSubsystem(subsystem, self)
 
+    def snapshot_keys(self):
+        return ["nvmf_get_subsystems"]
+
     def delete(self, subsystem_nqn):
         self.get_root().nvmf_delete_subsystem(nqn=subsystem_nqn)
 
@@ -103,7 +111,7 @@ class UINVMfSubsystems(UINode):
     def ui_command_delete_all(self):
         """Delete all subsystems"""
         rpc_messages = ""
-        for child in self._children:
+        for child in self.children:
             try:
                 self.delete(child.subsystem.nqn)
             except JSONRPCException as e:
@@ -112,7 +120,7 @@ class UINVMfSubsystems(UINode):
             raise JSONRPCException(rpc_messages)
 
     def summary(self):
-        return "Subsystems: %s" % len(self.children), None
+        return "Subsystems: %s" % self.count_children(self.get_root().nvmf_get_subsystems), None
 
 
 class UINVMfSubsystem(UINode):
@@ -129,9 +137,9 @@ class UINVMfSubsystem(UINode):
             UINVMfSubsystemNamespaces(self.subsystem.namespaces, self)
 
     def refresh_node(self):
-        for subsystem in self.get_root().nvmf_get_subsystems():
-            if subsystem.nqn == self.subsystem.nqn:
-                self.subsystem = subsystem
+        subsystem = self.get_root().nvmf_get_subsystem(self.subsystem.nqn)
+        if subsystem is not None:
+            self.subsystem = subsystem
         self.refresh()
 
     def ui_command_show_details(self):
@@ -173,9 +181,9 @@ class UINVMfSubsystemListeners(UINode):
             UINVMfSubsystemListener(address, self)
 
     def refresh_node(self):
-        for subsystem in self.get_root().nvmf_get_subsystems():
-            if subsystem.nqn == self.parent.subsystem.nqn:
-                self.listen_addresses = subsystem.listen_addresses
+        subsystem = self.get_root().nvmf_get_subsystem(self.parent.subsystem.nqn)
+        if subsystem is not None:
+            self.listen_addresses = subsystem.listen_addresses
         self.refresh()
 
     def delete(self, trtype, traddr, trsvcid, adrfam=None):
@@ -244,9 +252,9 @@ class UINVMfSubsystemHosts(UINode):
             UINVMfSubsystemHost(host, self)
 
     def refresh_node(self):
-        for subsystem in self.get_root().nvmf_get_subsystems():
-            if subsystem.nqn == self.parent.subsystem.nqn:
-                self.hosts = subsystem.hosts
+        subsystem = self.get_root().nvmf_get_subsystem(self.parent.subsystem.nqn)
+        if subsystem is not None:
+            self.hosts = subsystem.hosts
         self.refresh()
 
     def delete(self, host):
@@ -303,9 +311,9 @@ class UINVMfSubsystemNamespaces(UINode):
             UINVMfSubsystemNamespace(namespace, self)
 
     def refresh_node(self):
-        for subsystem in self.get_root().nvmf_get_subsystems():
-            if subsystem.nqn == self.parent.subsystem.nqn:
-                self.namespaces = subsystem.namespaces
+        subsystem = self.get_root().nvmf_get_subsystem(self.parent.subsystem.nqn)
+        if subsystem is not None:
+            self.namespaces = subsystem.namespaces
         self.refresh()
 
     def delete(self, nsid):
@@ -3,6 +3,7 @@ from .ui_node_nvmf import UINVMf
 from .ui_node_iscsi import UIISCSI
 from .. import rpc
 from functools import wraps
+import threading
 
 
 class UIRoot(UINode):
@@ -18,10 +19,125 @@ class UIRoot(UINode):
         self.current_nvmf_subsystems = []
         self.set_rpc_target(client)
         self.verbose = False
+        # Results of the RPCs listing SPDK objects, shared by all nodes until the snapshot is
+        # invalidated, which also bumps its generation.  The last known results are kept to find
+        # out which parts of the tree need to be rebuilt after a state-changing command.
+        self.generation = 0
+        self._snapshot = {}
+        self._last = {}
+        self._derived = {}
+        self._lock = threading.RLock()
+        self._prefetch = None
+        self._prefetch_stop = None
         self.is_init = self.check_init()
         self.methods = []
 
+    def invalidate(self):
+        """Drop the RPC snapshot, so that the current state is fetched on next access."""
+        self.stop_prefetch()
+        self.generation += 1
+        self._snapshot = {}
+        self._derived = {}
+
+    def snapshot(self, key):
+        """Return the result of a listing RPC, calling it only once per snapshot generation.
+
+        Args:
+            key: RPC method name or a ("bdev_get_bdevs", product_name) tuple selecting bdevs of
+                 a single type.
+        """
+        with self._lock:
+            if key not in self._snapshot:
+                if isinstance(key, tuple):
+                    method, product_name = key
+                    result = [x for x in self.snapshot(method) if product_name in x["product_name"].lower()]
+                else:
+                    result = getattr(self._rpc_module(key), key)(self.client)
+                self._snapshot[key] = result
+                self._last[key] = result
+            return self._snapshot[key]
+
+    def prefetch(self):
+        """Fetch the snapshot entries of nodes which haven't been built yet in the background, while
+        the shell is waiting for user input.  Any command stops the prefetch before it's executed, so
+        the client is only shared with the (serialized) snapshot lookups done by path completion.
+        """
+        self.stop_prefetch()
+        if not self.is_init:
+            return
+        # Start with the nodes below the current working directory, as the user is most likely
+        # to go there next.
+        cwd = self.shell._current_node.path.rstrip("/") + "/"
+        nodes = sorted(self._listing_nodes(), key=lambda n: not n.path.startswith(cwd))
+        keys = []
+        for node in nodes:
+            if node.is_materialized():
+                continue
+            for key in node.snapshot_keys():
+                method = key[0] if isinstance(key, tuple) else key
+                if key not in self._snapshot and key not in keys and method in self.methods:
+                    keys.append(key)
+        self._prefetch_stop = threading.Event()
+        self._prefetch = threading.Thread(target=self._prefetch_keys, args=(keys, self._prefetch_stop),
+                                          daemon=True)
+        self._prefetch.start()
+
+    def _prefetch_keys(self, keys, stop):
+        for key in keys:
+            if stop.is_set():
+                return
+            try:
+                self.snapshot(key)
+            except Exception:
+                # Errors are reported once the node is actually accessed
+                return
+
+    def stop_prefetch(self):
+        if self._prefetch is not None:
+            self._prefetch_stop.set()
+            self._prefetch.join()
+            self._prefetch = None
+
+    @staticmethod
+    def _rpc_module(method):
+        for module in [rpc.bdev, rpc.lvol, rpc.vhost, rpc.nvmf, rpc.iscsi, rpc.subsystem]:
+            if hasattr(module, method):
+                return module
+        raise AttributeError("Unknown RPC method: %s" % method)
+
+    def _listing_nodes(self, node=None, depth=0):
+        # Nodes listing SPDK objects are never deeper than two levels below the root, so there's
+        # no need to walk through the (possibly huge) lists of objects themselves.
+        node = node or self
+        for child in list(node._children):
+            if child.snapshot_keys():
+                yield child
+            elif depth < 1:
+                yield from self._listing_nodes(child, depth + 1)
+
+    def refresh_affected(self, node):
+        """Refresh the tree after a state-changing command was executed on a given node.  The node
+        itself is always refreshed, while other nodes are only rebuilt if the snapshot entries
+        they are built from have changed.
+        """
+        previous = dict(self._last)
+        self.invalidate()
+        node.refresh_node()
+        for other in self._listing_nodes():
+            # Nodes which haven't been built yet will use the new snapshot anyway
+            if not other.is_materialized():
+                continue
+            # Nodes on the same branch as the modified one have already been refreshed
+            paths = sorted([other.path.rstrip("/") + "/", node.path.rstrip("/") + "/"], key=len)
+            if paths[1].startswith(paths[0]):
+                continue
+            for key in other.snapshot_keys():
+                if key in previous and self.snapshot(key) != previous[key]:
+                    other.refresh()
+                    break
+
     def refresh(self):
+        self.invalidate()
         self.methods = self.rpc_get_methods(current=True)
         if self.is_init is False:
             methods = "\n".join(self.methods)
@@ -102,15 +218,14 @@ class UIRoot(UINode):
 
     def bdev_get_bdevs(self, bdev_type):
         if self.is_init:
-            self.current_bdevs = rpc.bdev.bdev_get_bdevs(self.client)
+            self.current_bdevs = self.snapshot("bdev_get_bdevs")
             # Following replace needs to be done in order for some of the bdev
             # listings to work: logical volumes, split disk.
             # For example logical volumes: listing in menu is "Logical_Volume"
             # (cannot have space), but the product name in SPDK is "Logical Volume"
             bdev_type = bdev_type.replace("_", " ")
-            for bdev in [x for x in self.current_bdevs if bdev_type in x["product_name"].lower()]:
-                test = Bdev(bdev)
-                yield test
+            for bdev in self.snapshot(("bdev_get_bdevs", bdev_type)):
+                yield Bdev(bdev)
 
     def bdev_get_iostat(self, **kwargs):
         return rpc.bdev.bdev_get_iostat(self.client, **kwargs)
@@ -191,7 +306,7 @@ class UIRoot(UINode):
     @is_method_available
     def bdev_lvol_get_lvstores(self):
         if self.is_init:
-            self.current_lvol_stores = rpc.lvol.bdev_lvol_get_lvstores(self.client)
+            self.current_lvol_stores = self.snapshot("bdev_lvol_get_lvstores")
             for lvs in self.current_lvol_stores:
                 yield LvolStore(lvs)
 
@@ -260,13 +375,13 @@ class UIRoot(UINode):
     @is_method_available
     def bdev_virtio_scsi_get_devices(self):
         if self.is_init:
-            for bdev in rpc.vhost.bdev_virtio_scsi_get_devices(self.client):
+            for bdev in self.snapshot("bdev_virtio_scsi_get_devices"):
                 test = Bdev(bdev)
                 yield test
 
     def list_vhost_ctrls(self):
         if self.is_init:
-            self.current_vhost_ctrls = rpc.vhost.vhost_get_controllers(self.client)
+            self.current_vhost_ctrls = self.snapshot("vhost_get_controllers")
 
     @verbose
     @is_method_available
@@ -305,7 +420,7 @@ class UIRoot(UINode):
 
     def list_nvmf_transports(self):
         if self.is_init:
-            self.current_nvmf_transports = rpc.nvmf.nvmf_get_transports(self.client)
+            self.current_nvmf_transports = self.snapshot("nvmf_get_transports")
 
     @verbose
     @is_method_available
@@ -317,7 +432,7 @@ class UIRoot(UINode):
 
     def list_nvmf_subsystems(self):
         if self.is_init:
-            self.current_nvmf_subsystems = rpc.nvmf.nvmf_get_subsystems(self.client)
+            self.current_nvmf_subsystems = self.snapshot("nvmf_get_subsystems")
 
     @verbose
     @is_method_available
@@ -327,6 +442,17 @@ class UIRoot(UINode):
             for subsystem in self.current_nvmf_subsystems:
                 yield NvmfSubsystem(subsystem)
 
+    def nvmf_get_subsystem(self, nqn):
+        """Return a single subsystem from the snapshot, or None if it doesn't exist"""
+        if not self.is_init or "nvmf_get_subsystems" not in self.methods:
+            return None
+        self.list_nvmf_subsystems()
+        key = ("nvmf_get_subsystems", "nqn")
+        if key not in self._derived:
+            self._derived[key] = {x["nqn"]: x for x in self.current_nvmf_subsystems}
+        subsystem = self._derived[key].get(nqn)
+        return NvmfSubsystem(subsystem) if subsystem is not None else None
+
     @verbose
     def create_nvmf_subsystem(self, **kwargs):
         rpc.nvmf.nvmf_create_subsystem(self.client, **kwargs)
@@ -371,14 +497,14 @@ class UIRoot(UINode):
     @is_method_available
     def scsi_get_devices(self):
         if self.is_init:
-            for device in rpc.iscsi.scsi_get_devices(self.client):
+            for device in self.snapshot("scsi_get_devices"):
                 yield ScsiObj(device)
 
     @verbose
     @is_method_available
     def iscsi_get_target_nodes(self):
         if self.is_init:
-            for tg in rpc.iscsi.iscsi_get_target_nodes(self.client):
+            for tg in self.snapshot("iscsi_get_target_nodes"):
                 yield tg
 
     @verbose
@@ -393,14 +519,14 @@ class UIRoot(UINode):
     @is_method_available
     def iscsi_get_portal_groups(self):
         if self.is_init:
-            for pg in rpc.iscsi.iscsi_get_portal_groups(self.client):
+            for pg in self.snapshot("iscsi_get_portal_groups"):
                 yield ScsiObj(pg)
 
     @verbose
     @is_method_available
     def iscsi_get_initiator_groups(self):
         if self.is_init:
-            for ig in rpc.iscsi.iscsi_get_initiator_groups(self.client):
+            for ig in self.snapshot("iscsi_get_initiator_groups"):
                 yield ScsiObj(ig)
 
     @verbose
@@ -421,9 +547,9 @@ class UIRoot(UINode):
 
     @verbose
     @is_method_available
-    def iscsi_get_connections(self, **kwargs):
+    def iscsi_get_connections(self):
         if self.is_init:
-            for ic in rpc.iscsi.iscsi_get_connections(self.client, **kwargs):
+            for ic in self.snapshot("iscsi_get_connections"):
                 yield ic
 
     @verbose
@@ -453,7 +579,9 @@ class UIRoot(UINode):
     @verbose
     @is_method_available
     def iscsi_get_auth_groups(self, **kwargs):
-        return rpc.iscsi.iscsi_get_auth_groups(self.client, **kwargs)
+        if kwargs:
+            return rpc.iscsi.iscsi_get_auth_groups(self.client, **kwargs)
+        return self.snapshot("iscsi_get_auth_groups")
 
     @verbose
     def iscsi_create_auth_group(self, **kwargs):
@@ -478,10 +606,12 @@ class UIRoot(UINode):
     @verbose
     @is_method_available
     def iscsi_get_options(self, **kwargs):
-        return rpc.iscsi.iscsi_get_options(self.client, **kwargs)
+        if kwargs:
+            return rpc.iscsi.iscsi_get_options(self.client, **kwargs)
+        return self.snapshot("iscsi_get_options")
 
     def has_subsystem(self, subsystem):
-        for system in rpc.subsystem.framework_get_subsystems(self.client):
+        for system in self.snapshot("framework_get_subsystems"):
             if subsystem.lower() == system["subsystem"].lower():
                 return True
         return False
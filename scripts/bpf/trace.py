@@ -1,11 +1,16 @@
 #!/usr/bin/env python3
 
 from argparse import ArgumentParser
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import defaultdict
 from dataclasses import dataclass, field
-from itertools import islice
+from itertools import repeat
 from typing import Dict, List, TypeVar
 import ctypes as ct
+import heapq
 import ijson
+import json
 import magic
 import os
 import re
@@ -50,26 +55,187 @@ class DTraceEntry:
     name: str
     args: Dict[str, TypeVar('ArgumentType', str, int)]
 
-    def __init__(self, probe, args):
-        valmap = {int: lambda x: int(x, 16),
-                  str: lambda x: x.strip().strip("'")}
-        self.name = probe.name
-        self.args = {}
-        for name, value in args.items():
-            arg = probe.args.get(name)
-            if arg is None:
-                raise ValueError(f'Unexpected argument: {name}')
-            self.args[name] = valmap[arg.type](value)
+
+class DTraceColumns:
+    """Stores all invocations of a single DTrace probe in a columnar form: integer arguments are
+    kept in compact unsigned 64-bit arrays, while string arguments are interned.  The values are
+    buffered as strings and converted in bulk every CHUNK_SIZE invocations.
+    """
+    CHUNK_SIZE = 1 << 16
+
+    def __init__(self, probe):
+        self.probe = probe
+        self.columns = {name: array('Q') if arg.type is int else []
+                        for name, arg in probe.args.items()}
+        self._names = tuple(probe.args.keys())
+        self._pending = [[] for _ in self._names]
+
+    def __len__(self):
+        return len(next(iter(self.columns.values()), ()))
+
+    def __getitem__(self, name):
+        return self.columns[name]
+
+    def append(self, args):
+        pairs = [a.partition('=') for a in args.split(',')] if args.strip() else []
+        names = tuple(n.strip() for n, _, _ in pairs)
+        if names != self._names:
+            raise ValueError(f'Unexpected arguments: {", ".join(names)}')
+        for pending, (_, _, value) in zip(self._pending, pairs):
+            pending.append(value)
+        if len(self._pending[0]) >= self.CHUNK_SIZE:
+            self.flush()
+
+    def flush(self):
+        if len(self._names) == 0 or len(self._pending[0]) == 0:
+            return
+        for name, pending in zip(self._names, self._pending):
+            if self.probe.args[name].type is int:
+                self.columns[name].extend(map(int, pending, repeat(16)))
+            else:
+                self.columns[name].extend(sys.intern(v.strip().strip("'")) for v in pending)
+            pending.clear()
+
+    def sort(self):
+        """Orders the invocations by their tsc.  The output of each CPU is already sorted, so the
+        ascending runs of invocations are merged together (k-way, stable) instead of sorted.
+        """
+        self.flush()
+        tsc = self.columns.get('tsc')
+        if tsc is None:
+            return
+        bounds = [i + 1 for i in range(len(tsc) - 1) if tsc[i] > tsc[i + 1]]
+        if len(bounds) == 0:
+            return
+        runs = [range(b, e) for b, e in zip([0] + bounds, bounds + [len(tsc)])]
+        order = array('Q', heapq.merge(*runs, key=tsc.__getitem__))
+        for name, column in self.columns.items():
+            if isinstance(column, array):
+                self.columns[name] = array(column.typecode, (column[i] for i in order))
+            else:
+                self.columns[name] = [column[i] for i in order]
+
+    def entries(self):
+        """Generator returning the invocations as DTraceEntry objects"""
+        names, columns = self._names, tuple(self.columns.values())
+        for values in zip(*columns):
+            yield DTraceEntry(name=self.probe.name, args=dict(zip(names, values)))
+
+
+class DTraceProbeIndex:
+    """Inventory of the SPDK_DTRACE_PROBE points defined in the source tree.  Scanning every
+    source file is slow, so the results are cached on disk along with the git HEAD they were
+    collected at.  As long as HEAD doesn't change, only the files modified since then (and the
+    ones that were modified during the last run) are checked, by their mtime and size.
+    """
+    _regex = re.compile(r'SPDK_DTRACE_PROBE([0-9]*)\((\w+)')
+    _srcdirs = ['app', 'examples', 'include', 'lib', 'module', 'test']
+    _excluded = ['include/spdk_internal/usdt.h']
+
+    def __init__(self, rootdir=None, cache=None):
+        self._rootdir = rootdir or os.path.abspath(f'{os.path.dirname(__file__)}/../..')
+        self._cache = cache or os.environ.get('SPDK_DTRACE_PROBE_CACHE',
+                                              f'{self._rootdir}/build/dtrace_probes.json')
+
+    def _git(self, *args):
+        try:
+            output = subprocess.check_output(['git'] + list(args), cwd=self._rootdir,
+                                             stderr=subprocess.DEVNULL)
+            return str(output, 'ascii')
+        except (OSError, subprocess.CalledProcessError):
+            return None
+
+    def _git_files(self, *args):
+        output = self._git(*args, '*.[ch]', *[f':!:{f}' for f in self._excluded])
+        return None if output is None else [f for f in output.split('\n') if len(f) > 0]
+
+    def _list_files(self):
+        files = self._git_files('ls-files')
+        if files is not None:
+            return files
+        # Not a git checkout, walk the directories containing SPDK's sources instead
+        files = []
+        for srcdir in self._srcdirs:
+            for path, _, names in os.walk(os.path.join(self._rootdir, srcdir)):
+                for name in names:
+                    if name.endswith(('.c', '.h')):
+                        fname = os.path.relpath(os.path.join(path, name), self._rootdir)
+                        if fname not in self._excluded:
+                            files.append(fname)
+        return files
+
+    def _load_cache(self):
+        try:
+            with open(self._cache, 'r') as file:
+                cache = json.load(file)
+            if isinstance(cache.get('files'), dict):
+                return cache
+        except (OSError, ValueError, AttributeError):
+            pass
+        return {'head': None, 'dirty': [], 'files': {}}
+
+    def _store_cache(self, cache):
+        try:
+            os.makedirs(os.path.dirname(self._cache), exist_ok=True)
+            with tempfile.NamedTemporaryFile(mode='w', dir=os.path.dirname(self._cache),
+                                             delete=False) as file:
+                json.dump(cache, file)
+            os.replace(file.name, self._cache)
+        except OSError:
+            # The cache is only an optimization, so it's fine if it cannot be written
+            pass
+
+    def _scan(self, fname):
+        probes = {}
+        with open(os.path.join(self._rootdir, fname), 'r') as file:
+            for match in self._regex.finditer(file.read()):
+                nargs, name = match.group(1), match.group(2)
+                nargs = int(nargs) if len(nargs) > 0 else 0
+                # Add one to accommodate for the tsc being the first arg
+                probes[name] = nargs + 1
+        return probes
+
+    def _update(self, files, fnames):
+        """Rescans the files whose mtime or size differ from their entry, drops the removed ones"""
+        for fname in fnames:
+            try:
+                st = os.stat(os.path.join(self._rootdir, fname))
+            except OSError:
+                files.pop(fname, None)
+                continue
+            entry = files.get(fname)
+            if entry is None or entry['mtime'] != st.st_mtime_ns or entry['size'] != st.st_size:
+                files[fname] = {'mtime': st.st_mtime_ns, 'size': st.st_size,
+                                'probes': self._scan(fname)}
+
+    def probes(self):
+        """Returns a dict of (probe_name, number_of_arguments)"""
+        cache = self._load_cache()
+        head = (self._git('rev-parse', 'HEAD') or '').strip() or None
+        dirty = self._git_files('diff', '--name-only', 'HEAD', '--') if head is not None else None
+        files = dict(cache['files'])
+        if head is not None and dirty is not None and cache['head'] == head:
+            self._update(files, set(dirty) | set(cache['dirty']))
+        else:
+            fnames = self._list_files()
+            files = {f: files[f] for f in fnames if f in files}
+            self._update(files, fnames)
+        updated = {'head': head, 'dirty': sorted(dirty or []), 'files': files}
+        if updated != cache:
+            self._store_cache(updated)
+        probes = {}
+        for entry in files.values():
+            probes.update(entry['probes'])
+        return probes
 
 
 class DTrace:
     """Generates bpftrace script based on the supplied probe points, parses its
-    output and stores is as a list of DTraceEntry sorted by their tsc.
+    output and stores it as a set of DTraceColumns (one per probe) sorted by their tsc.
     """
     def __init__(self, probes, file=None):
         self._avail_probes = self._list_probes()
         self._probes = {p.name: p for p in probes}
-        self.entries = self._parse(file) if file is not None else []
         # Sanitize the probe definitions
         for probe in probes:
             if probe.name not in self._avail_probes:
@@ -79,40 +245,33 @@ class DTrace:
                     raise ValueError('Invalid probe argument position')
                 if arg.type not in (int, str):
                     raise ValueError('Invalid argument type')
+        self._data = {p.name: DTraceColumns(p) for p in probes}
+        if file is not None:
+            self._parse(file if isinstance(file, (list, tuple)) else [file])
+
+    def __getitem__(self, name):
+        """Returns the DTraceColumns of a given probe"""
+        return self._data[name]
+
+    def _parse(self, files):
+        for file in files:
+            for line in file:
+                name, _, args = line.rstrip('\n').partition(': ')
+                data = self._data.get(name)
+                # Skip the line if we don't recognize the probe name
+                if data is None:
+                    continue
+                data.append(args)
+        for data in self._data.values():
+            data.sort()
 
-    def _parse(self, file):
-        regex = re.compile(r'(\w+): (.*)')
-        entries = []
-
-        for line in file.readlines():
-            match = regex.match(line)
-            if match is None:
-                continue
-            name, args = match.groups()
-            probe = self._probes.get(name)
-            # Skip the line if we don't recognize the probe name
-            if probe is None:
-                continue
-            entries.append(DTraceEntry(probe, args=dict(a.strip().split('=')
-                                                        for a in args.split(','))))
-        entries.sort(key=lambda e: e.args['tsc'])
-        return entries
+    def entries(self):
+        """Generator returning DTraceEntry objects of all probes sorted by their tsc"""
+        return heapq.merge(*[d.entries() for d in self._data.values() if 'tsc' in d.columns],
+                           key=lambda e: e.args['tsc'])
 
     def _list_probes(self):
-        files = subprocess.check_output(['git', 'ls-files', '*.[ch]',
-                                        ':!:include/spdk_internal/usdt.h'])
-        files = filter(lambda f: len(f) > 0, str(files, 'ascii').split('\n'))
-        regex = re.compile(r'SPDK_DTRACE_PROBE([0-9]*)\((\w+)')
-        probes = {}
-
-        for fname in files:
-            with open(fname, 'r') as file:
-                for match in regex.finditer(file.read()):
-                    nargs, name = match.group(1), match.group(2)
-                    nargs = int(nargs) if len(nargs) > 0 else 0
-                    # Add one to accommodate for the tsc being the first arg
-                    probes[name] = nargs + 1
-        return probes
+        return DTraceProbeIndex().probes()
 
     def _gen_usdt(self, probe):
         usdt = (f'usdt:__EXE__:{probe.name} {{' +
@@ -451,6 +610,12 @@ class Trace:
     def register_object(self, obj):
         self._objects.append(obj)
 
+    def entries(self):
+        return self._provider.entries()
+
+    def tsc_rate(self):
+        return self._provider.tsc_rate()
+
     def print(self):
         def get_us(tsc, off):
             return ((tsc - off) * 10 ** 6) / self._provider.tsc_rate()
@@ -471,6 +636,96 @@ class Trace:
                 args).rstrip())
 
 
+class CPUProfile:
+    """Attributes the time spent on each lcore to the trace entry owners (e.g. b01 or t02, as
+    described by the trace's owner table) and threads running there.  The time between two
+    consecutive entries recorded on the same lcore is assigned to the first one, unless it's
+    longer than the idle threshold, in which case the lcore is considered idle.  The owner
+    indices are counted separately for each owner type, so they don't identify pollers.  Thread
+    names are resolved using the output of the framework_get_reactors RPC, if provided.
+    """
+    IDLE = 'idle'
+
+    def __init__(self, trace: Trace, window_us=1000, idle_us=100, reactors=None):
+        self._trace = trace
+        self._window = max(int(window_us * trace.tsc_rate() / 10 ** 6), 1)
+        self._idle = int(idle_us * trace.tsc_rate() / 10 ** 6)
+        self._threads = {}
+        for reactor in (reactors or {}).get('reactors', []):
+            self._threads[reactor['lcore']] = [t['name'] for t in reactor['lw_threads']]
+        # Total time spent per (lcore, thread, owner, tpoint)
+        self.totals = defaultdict(int)
+        # Busy time of each (lcore, thread, owner) per time window
+        self.windows = defaultdict(lambda: defaultdict(int))
+        self._offset = None
+        self._process()
+
+    def _resolve(self, lcore, owner):
+        """Returns the name of the thread and the owner of an entry"""
+        threads = self._threads.get(lcore)
+        thread = threads[0] if threads is not None and len(threads) == 1 else None
+        return thread, owner
+
+    def _account(self, lcore, key, begin, end):
+        self.totals[(lcore,) + key] += end - begin
+        if key[1] == self.IDLE:
+            return
+        owner = (lcore,) + key[:2]
+        while begin < end:
+            window = (begin - self._offset) // self._window
+            wend = min(end, self._offset + (window + 1) * self._window)
+            self.windows[owner][window] += wend - begin
+            begin = wend
+
+    def _process(self):
+        last = {}
+        names = {}
+        for entry in self._trace.entries():
+            self._offset = entry.tsc if self._offset is None else self._offset
+            prev = last.get(entry.lcore)
+            if prev is not None:
+                tsc, key = prev
+                if entry.tsc - tsc > self._idle:
+                    self._account(entry.lcore, (None, self.IDLE, None), tsc, entry.tsc)
+                else:
+                    self._account(entry.lcore, key, tsc, entry.tsc)
+            owner = (entry.lcore, entry.poller)
+            if owner not in names:
+                names[owner] = self._resolve(entry.lcore, entry.poller)
+            last[entry.lcore] = (entry.tsc, names[owner] + (entry.tpoint.name,))
+
+    def folded(self):
+        """Generator returning the totals as folded stacks (consumable by flamegraph.pl), with
+        the values expressed in TSC ticks
+        """
+        for (lcore, thread, owner, tpoint), ticks in sorted(self.totals.items(), key=str):
+            frames = [f'reactor_{lcore}'] + [f for f in (thread, owner, tpoint) if f is not None]
+            yield '{} {}'.format(';'.join(frames), ticks)
+
+    def timeline(self):
+        """Generator returning (timestamp_us, lcore, thread, owner, duty_cycle) tuples for each
+        time window, where the duty cycle is the fraction of the window an owner was running
+        """
+        nwindows = max((max(w) + 1 for w in self.windows.values()), default=0)
+        owners = sorted(self.windows.items(), key=str)
+        for window in range(nwindows):
+            timestamp = window * self._window * 10 ** 6 / self._trace.tsc_rate()
+            for (lcore, thread, owner), busy in owners:
+                yield timestamp, lcore, thread, owner, busy.get(window, 0) / self._window
+
+    def summary(self):
+        """Generator returning (lcore, thread, owner, share) tuples, where share is the fraction
+        of traced time an lcore spent in a given owner
+        """
+        lcores = defaultdict(int)
+        owners = defaultdict(int)
+        for (lcore, thread, owner, _), ticks in self.totals.items():
+            lcores[lcore] += ticks
+            owners[(lcore, thread, owner)] += ticks
+        for (lcore, thread, owner), ticks in sorted(owners.items(), key=lambda p: -p[1]):
+            yield lcore, thread, owner, ticks / lcores[lcore]
+
+
 class SPDKObject:
     """Describes a specific type of an SPDK objects (e.g. qpair, thread, etc.)"""
     @dataclass
@@ -532,37 +787,42 @@ class QPair(SPDKObject):
             'TCP_WRITE_DONE',
             'TCP_READ_DONE',
             'TCP_REQ_AWAIT_R2T_ACK'])
-        self._objects = []
-        self._find_objects(dtrace.entries)
-
-    def _find_objects(self, dprobes):
-        def probe_match(probe, other):
-            return probe.args['qpair'] == other.args['qpair']
-
-        for i, dprobe in enumerate(dprobes):
-            if dprobe.name != 'nvmf_poll_group_add_qpair':
-                continue
+        self._objects = defaultdict(list)
+        self._find_objects(dtrace)
+
+    def _find_objects(self, dtrace):
+        def index(data):
+            # Group the probes by qpair, keeping the order of their tsc
+            result = defaultdict(lambda: (array('Q'), []))
+            for i, (tsc, qpair) in enumerate(zip(data['tsc'], data['qpair'])):
+                result[qpair][0].append(tsc)
+                result[qpair][1].append(i)
+            return result
+
+        added = dtrace['nvmf_poll_group_add_qpair']
+        removed = index(dtrace['nvmf_poll_group_remove_qpair'])
+        ctrlrs = dtrace['nvmf_ctrlr_add_qpair']
+        ctrlr_index = index(ctrlrs)
+
+        for tsc, qpair, thread in zip(added['tsc'], added['qpair'], added['thread']):
             # We've found a new qpair, now find the probe indicating its destruction
-            last_idx, last = next((((i + j + 1), d) for j, d in enumerate(islice(dprobes, i, None))
-                                   if d.name == 'nvmf_poll_group_remove_qpair' and
-                                   probe_match(d, dprobe)), (None, None))
-            obj = SPDKObject.Lifetime(begin=dprobe.args['tsc'],
-                                      end=last.args['tsc'] if last is not None else TSC_MAX,
-                                      ptr=dprobe.args['qpair'],
-                                      properties={'ptr': hex(dprobe.args['qpair']),
-                                                  'thread': dprobe.args['thread']})
-            for other in filter(lambda p: probe_match(p, dprobe), dprobes[i:last_idx]):
-                if other.name == 'nvmf_ctrlr_add_qpair':
-                    for prop in ['qid', 'subnqn', 'hostnqn']:
-                        obj.properties[prop] = other.args[prop]
-            self._objects.append(obj)
+            rtscs, _ = removed.get(qpair, ((), ()))
+            ridx = bisect_left(rtscs, tsc)
+            obj = SPDKObject.Lifetime(begin=tsc, end=rtscs[ridx] if ridx < len(rtscs) else TSC_MAX,
+                                      ptr=qpair, properties={'ptr': hex(qpair), 'thread': thread})
+            ctscs, cidxs = ctrlr_index.get(qpair, ((), ()))
+            cidx = bisect_right(ctscs, obj.end) - 1
+            if cidx >= 0 and ctscs[cidx] >= obj.begin:
+                for prop in ['qid', 'subnqn', 'hostnqn']:
+                    obj.properties[prop] = ctrlrs[prop][cidxs[cidx]]
+            self._objects[qpair].append(obj)
 
     def _annotate(self, entry):
         qpair = entry.args.get('qpair')
         if qpair is None:
             return None
-        for obj in self._objects:
-            if obj.ptr == qpair and obj.begin <= entry.tsc <= obj.end:
+        for obj in self._objects.get(qpair, []):
+            if obj.begin <= entry.tsc <= obj.end:
                 return {'qpair': obj.properties}
         return None
 
@@ -588,13 +848,34 @@ def build_dtrace(file=None):
                   DTraceArgument(name='hostnqn', pos=4, type=str)])], file)
 
 
-def print_trace(trace_file, dtrace_file):
-    dtrace = build_dtrace(dtrace_file)
+def print_trace(trace_file, dtrace_files):
+    dtrace = build_dtrace(dtrace_files)
     trace = Trace(trace_file)
     trace.register_object(QPair(trace, dtrace))
     trace.print()
 
 
+def print_profile(trace_file, args):
+    def load(fname):
+        if fname is None:
+            return None
+        with open(fname, 'r') as file:
+            return json.load(file)
+
+    profile = CPUProfile(Trace(trace_file), window_us=args.window, idle_us=args.idle_threshold,
+                         reactors=load(args.reactors))
+    if args.folded:
+        for line in profile.folded():
+            print(line)
+    else:
+        for timestamp, lcore, thread, owner, duty in profile.timeline():
+            print('{:16.3f} {:3} {:24} {:24} {:6.2f}%'.format(
+                timestamp, lcore, thread or '', owner or '', duty * 100))
+        print('\n{:3} {:24} {:24} {:>7}'.format('lcore', 'thread', 'owner', 'share'))
+        for lcore, thread, owner, share in profile.summary():
+            print('{:3} {:24} {:24} {:6.2f}%'.format(lcore, thread or '', owner or '', share * 100))
+
+
 def main(argv):
     parser = ArgumentParser(description='SPDK trace annotation script')
     parser.add_argument('-i', '--input',
@@ -602,16 +883,29 @@ def main(argv):
                              'raw binary produced by the SPDK application itself)')
     parser.add_argument('-g', '--generate', help='Generate bpftrace script', action='store_true')
     parser.add_argument('-r', '--record', help='Record BPF traces on PID', metavar='PID', type=int)
-    parser.add_argument('-b', '--bpftrace', help='BPF trace script to use for annotations')
+    parser.add_argument('-b', '--bpftrace', help='BPF trace script to use for annotations.  Can be ' +
+                        'specified multiple times, in which case the outputs are merged', action='append')
+    parser.add_argument('-f', '--folded', help='Print the time spent in each trace owner as folded ' +
+                        'stacks, suitable for generating flamegraphs', action='store_true')
+    parser.add_argument('-t', '--timeline', help='Print per-owner duty cycle over time',
+                        action='store_true')
+    parser.add_argument('-w', '--window', help='Duty cycle time window in microseconds',
+                        type=float, default=1000)
+    parser.add_argument('--idle-threshold', help='Gap between trace entries (in microseconds) ' +
+                        'above which an lcore is considered idle', type=float, default=100)
+    parser.add_argument('--reactors', help='Output of the framework_get_reactors RPC, used to ' +
+                        'map lcores to threads')
     args = parser.parse_args(argv)
 
     if args.generate:
         print(build_dtrace().generate())
     elif args.record:
         build_dtrace().record(args.record)
+    elif args.folded or args.timeline:
+        print_profile(open(args.input, 'r') if args.input is not None else sys.stdin, args)
     else:
         print_trace(open(args.input, 'r') if args.input is not None else sys.stdin,
-                    open(args.bpftrace) if args.bpftrace is not None else None)
+                    [open(f) for f in args.bpftrace] if args.bpftrace is not None else None)
 
 
 if __name__ == '__main__':
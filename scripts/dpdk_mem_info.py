@@ -1,9 +1,19 @@
 #!/usr/bin/env python3
 
 import argparse
+import bisect
+import json
 import os
+import sys
+import time
+from collections import defaultdict, deque
 from enum import Enum
 
+sys.path.append(os.path.dirname(__file__) + '/../python')
+
+import spdk.rpc as rpc  # noqa
+from spdk.rpc.client import JSONRPCClient, JSONRPCException  # noqa
+
 
 class memory:
     def __init__(self, size):
@@ -83,23 +93,38 @@ class memory:
             print("memzone name {} is invalid. please see the summary for valid memzone.\n".format(name))
 
     def associate_heap_elements_and_memzones(self):
+        # Heap elements never overlap, so the only element which can contain a memzone is
+        # the last one starting at or below its address.
+        elements = sorted((element for heap_obj in self.heaps for element in heap_obj.busy_malloc_elements),
+                          key=lambda x: x.addr)
+        addresses = [element.addr for element in elements]
         for zone in self.memzones:
-            for heap_obj in self.heaps:
-                for element in heap_obj.busy_malloc_elements:
-                    if element.check_memzone_compatibility(zone):
-                        heap_obj.busy_memzone_elements.append(element)
-                        heap_obj.busy_malloc_elements.remove(element)
+            idx = bisect.bisect_right(addresses, zone.address) - 1
+            if idx >= 0 and elements[idx].memzone is None:
+                elements[idx].check_memzone_compatibility(zone)
 
-    def associate_memzones_and_mempools(self):
-        for pool in self.mempools:
-            for zone in self.memzones:
-                if pool.name in zone.name:
-                    pool.add_memzone(zone)
+        for heap_obj in self.heaps:
+            heap_obj.busy_memzone_elements += [x for x in heap_obj.busy_malloc_elements if x.memzone is not None]
+            heap_obj.busy_malloc_elements = [x for x in heap_obj.busy_malloc_elements if x.memzone is None]
 
-        for pool in self.mempools:
-            for zone in pool.memzones:
-                if zone in self.memzones:
-                    self.memzones.remove(zone)
+    def associate_memzones_and_mempools(self):
+        # Memzones backing a mempool are named after it: MP_<name> for the pool itself,
+        # MP_<name>_<n> for each of its memory chunks and RG_MP_<name> for its ring.
+        pools = {pool.name: pool for pool in self.mempools}
+        memzones = []
+        for zone in self.memzones:
+            pool = None
+            for prefix in ["RG_MP_", "MP_"]:
+                if zone.name.startswith(prefix):
+                    name = zone.name[len(prefix):]
+                    base, sep, chunk = name.rpartition("_")
+                    pool = pools.get(name) or (pools.get(base) if chunk.isdigit() else None)
+                    break
+            if pool is not None:
+                pool.add_memzone(zone)
+            else:
+                memzones.append(zone)
+        self.memzones = memzones
 
 
 class heap_elem_status(Enum):
@@ -108,6 +133,8 @@ class heap_elem_status(Enum):
 
 
 class heap_element:
+    __slots__ = ['status', 'size', 'addr', 'memzone']
+
     def __init__(self, size, status, addr):
         self.status = status
         self.size = size
@@ -154,25 +181,63 @@ class heap:
             size = size + element.size
         return size
 
+    def get_largest_free_size(self):
+        return max((x.size for x in self.free_elements), default=0)
+
+    def get_fragmentation(self):
+        """Share of free memory which can't be allocated in a single block"""
+        free_size = self.get_element_size(self.free_elements)
+        if free_size == 0:
+            return 0.0
+        return 1.0 - self.get_largest_free_size() / free_size
+
+    def get_free_size_histogram(self):
+        """Number and total size of free elements, bucketed by the next power of two of their size"""
+        histogram = defaultdict(lambda: [0, 0])
+        for element in self.free_elements:
+            bucket = 1 << max(element.size - 1, 0).bit_length()
+            histogram[bucket][0] += 1
+            histogram[bucket][1] += element.size
+        return sorted(histogram.items())
+
     def print_summary(self, header):
-        print("{}size: {:>15} heap id: {}".format(header, B_to_MiB(self.size), self.id))
+        print("{}size: {:>15} heap id: {} largest free block: {:>15} fragmentation: {:.2%}"
+              .format(header, B_to_MiB(self.size), self.id, B_to_MiB(self.get_largest_free_size()),
+                      self.get_fragmentation()))
+
+    def print_fragmentation_stats(self, header):
+        print("{}free size: {} largest free block: {} fragmentation: {:.2%}"
+              .format(header, B_to_MiB(self.get_element_size(self.free_elements)),
+                      B_to_MiB(self.get_largest_free_size()), self.get_fragmentation()))
+        print("{}free size histogram:".format(header))
+        for bucket, (count, size) in self.get_free_size_histogram():
+            print("{}  <= {:>15}: {:>8} element(s) with size: {:>15}"
+                  .format(header, B_to_MiB(bucket), count, B_to_MiB(size)))
 
     def print_detailed_stats(self):
         print("heap id: {} total size: {} number of busy elements: {} number of free elements: {}"
               .format(self.id, B_to_MiB(self.size), len(self.busy_malloc_elements), len(self.free_elements)))
+        self.print_fragmentation_stats("  ")
         self.print_element_stats(self.free_elements, "free", "  ")
         self.print_element_stats(self.busy_malloc_elements, "standard malloc", "  ")
         self.print_element_stats(self.busy_memzone_elements, "memzone associated", "  ")
 
 
 class mempool:
-    def __init__(self, name, num_objs, num_populated_objs, obj_size):
+    def __init__(self, name, num_objs, num_populated_objs, obj_size, num_free_objs=None):
         self.name = name
         self.num_objs = num_objs
         self.num_populated_objs = num_populated_objs
         self.obj_size = obj_size
+        self.num_free_objs = num_free_objs
         self.memzones = []
 
+    def get_num_used_objs(self):
+        # Objects sitting neither in the common pool nor in the per-lcore caches
+        if self.num_free_objs is None:
+            return None
+        return self.num_populated_objs - self.num_free_objs
+
     def add_memzone(self, memzone):
         self.memzones.append(memzone)
 
@@ -226,11 +291,9 @@ class segment:
 class parse_state(Enum):
     PARSE_MEMORY_SIZE = 0
     PARSE_MEMZONES = 1
-    PARSE_MEMZONE_SEGMENTS = 2
-    PARSE_MEMPOOLS = 3
-    PARSE_MEMPOOL_INFO = 4
-    PARSE_HEAPS = 5
-    PARSE_HEAP_ELEMENTS = 6
+    PARSE_MEMPOOLS = 2
+    PARSE_MALLOC_STATS = 3
+    PARSE_HEAPS = 4
 
 
 def B_to_MiB(raw_value):
@@ -270,120 +333,220 @@ def parse_mempool_name(line):
     return name
 
 
-def parse_mem_stats(stat_path):
-    state = parse_state.PARSE_MEMORY_SIZE
-    with open(stat_path, "r") as stats:
+def add_mempool(memory_struct, mempool_info):
+    if mempool_info is None:
+        return
+    try:
+        num_free_objs = None
+        if 'common_pool_count' in mempool_info:
+            num_free_objs = int(mempool_info['common_pool_count'], 0) + int(mempool_info.get('total_cache_count', '0'), 0)
+        new_mempool = mempool(mempool_info['name'], int(mempool_info['size'], 0),
+                              int(mempool_info['populated_size'], 0), int(mempool_info['total_obj_size'], 0),
+                              num_free_objs)
+        memory_struct.add_mempool(new_mempool)
+    except KeyError:
+        print("proper key values not provided for mempool.")
 
-        line = stats.readline()
-        while line != '':
-            if state == parse_state.PARSE_MEMORY_SIZE:
-                if "DPDK memory size" in line:
-                    mem_size = int(line.replace("DPDK memory size ", ""))
-                    memory_struct = memory(mem_size)
-                    state = parse_state.PARSE_MEMZONES
-                line = stats.readline()
-
-            if state == parse_state.PARSE_MEMZONES:
-                if line.find("Zone") == 0:
-                    zone = parse_zone(line)
-                    state = parse_state.PARSE_MEMZONE_SEGMENTS
-                line = stats.readline()
-
-            if state == parse_state.PARSE_MEMZONE_SEGMENTS:
-                if line.find("Zone") == 0:
-                    memory_struct.add_memzone(zone)
-                    state = parse_state.PARSE_MEMZONES
-                    continue
-                elif line.lstrip().find("addr:") == 0:
-                    segment = parse_segment(line)
-                    zone.add_segment(segment)
-                elif "DPDK mempools." in line:
-                    state = parse_state.PARSE_MEMPOOLS
-                    continue
-                line = stats.readline()
-
-            if state == parse_state.PARSE_MEMPOOLS:
-                mempool_info = {}
-                if line.find("mempool") == 0:
-                    mempool_info['name'] = parse_mempool_name(line)
-                    state = parse_state.PARSE_MEMPOOL_INFO
-                line = stats.readline()
-
-            if state == parse_state.PARSE_MEMPOOL_INFO:
-                if line.find("mempool") == 0:
-                    try:
-                        new_mempool = mempool(mempool_info['name'], int(mempool_info['size'], 0),
-                                              int(mempool_info['populated_size'], 0), int(mempool_info['total_obj_size'], 0))
-                        memory_struct.add_mempool(new_mempool)
-                    except KeyError:
-                        print("proper key values not provided for mempool.")
-                    state = parse_state.PARSE_MEMPOOLS
-                    continue
-                elif "cache" in line:
-                    pass
-                elif "DPDK malloc stats." in line:
-                    try:
-                        new_mempool = mempool(mempool_info['name'], int(mempool_info['size'], 0),
-                                              int(mempool_info['populated_size'], 0), int(mempool_info['total_obj_size'], 0))
-                        memory_struct.add_mempool(new_mempool)
-                    except KeyError:
-                        print("proper key values not provided for mempool.")
-                    while "DPDK malloc heaps." not in line:
-                        line = stats.readline()
-                    state = parse_state.PARSE_HEAPS
-                else:
-                    try:
-                        field, value = line.strip().split('=')
-                        mempool_info[field] = value
-                    except Exception as e:
-                        pass
-                line = stats.readline()
-
-            if state == parse_state.PARSE_HEAPS:
-                trash, heap_id = line.strip().split(':')
-                line = stats.readline()
-                trash, heap_size = line.split(':')
-                line = stats.readline()
-                trash, num_allocations = line.split(':')
-                if int(heap_size, 0) == 0:
-                    pass
-                else:
-                    new_heap = heap(heap_id.lstrip(), int(heap_size, 0), int(num_allocations, 0))
-                    memory_struct.add_heap(new_heap)
-                    state = parse_state.PARSE_HEAP_ELEMENTS
-
-                line = stats.readline()
-
-            if state == parse_state.PARSE_HEAP_ELEMENTS:
-                if line.find("Heap id") == 0:
-                    state = parse_state.PARSE_HEAPS
-                    continue
-                elif line.find("Malloc element at") == 0:
-                    trash, address, status = line.rsplit(maxsplit=2)
-                    line = stats.readline()
-                    trash, length, trash = line.split(maxsplit=2)
-                    line = stats.readline()
-                    if "FREE" in status:
-                        element = heap_element(int(length, 0), heap_elem_status.FREE, int(address, 0))
-                    else:
-                        element = heap_element(int(length, 0), heap_elem_status.BUSY, int(address, 0))
-                    new_heap.add_element(element)
-                line = stats.readline()
+
+def parse_mem_stats_lines(lines):
+    """Parse the output of env_dpdk_get_mem_stats in a single pass over its lines."""
+    state = parse_state.PARSE_MEMORY_SIZE
+    memory_struct = None
+    zone = None
+    mempool_info = None
+    new_heap = None
+    heap_info = {}
+    element = None
+
+    for line in lines:
+        if state == parse_state.PARSE_MEMORY_SIZE:
+            if "DPDK memory size" in line:
+                memory_struct = memory(int(line.replace("DPDK memory size ", "")))
+                state = parse_state.PARSE_MEMZONES
+
+        elif state == parse_state.PARSE_MEMZONES:
+            if line.startswith("Zone"):
+                zone = parse_zone(line)
+                memory_struct.add_memzone(zone)
+            elif zone is not None and line.lstrip().startswith("addr:"):
+                zone.add_segment(parse_segment(line))
+            elif "DPDK mempools." in line:
+                state = parse_state.PARSE_MEMPOOLS
+
+        elif state == parse_state.PARSE_MEMPOOLS:
+            if line.startswith("mempool"):
+                add_mempool(memory_struct, mempool_info)
+                mempool_info = {'name': parse_mempool_name(line)}
+            elif "DPDK malloc stats." in line:
+                add_mempool(memory_struct, mempool_info)
+                state = parse_state.PARSE_MALLOC_STATS
+            elif mempool_info is not None and "=" in line:
+                field, value = line.strip().split('=', 1)
+                mempool_info[field] = value
+
+        elif state == parse_state.PARSE_MALLOC_STATS:
+            if "DPDK malloc heaps." in line:
+                state = parse_state.PARSE_HEAPS
+
+        elif line.startswith("Malloc element at"):
+            trash, address, status = line.rsplit(maxsplit=2)
+            element = (int(address, 0), heap_elem_status.FREE if "FREE" in status else heap_elem_status.BUSY)
+        elif line.startswith("  len:"):
+            if element is not None and new_heap is not None:
+                trash, length, trash = line.split(maxsplit=2)
+                new_heap.add_element(heap_element(int(length, 0), element[1], element[0]))
+            element = None
+        elif line.startswith("Heap id"):
+            trash, heap_id = line.strip().split(':')
+            heap_info = {'id': heap_id.lstrip()}
+            new_heap = None
+        elif line.startswith("Heap size"):
+            trash, heap_info['size'] = line.split(':')
+        elif line.startswith("Heap alloc count"):
+            trash, num_allocations = line.split(':')
+            if int(heap_info['size'], 0) != 0:
+                new_heap = heap(heap_info['id'], int(heap_info['size'], 0), int(num_allocations, 0))
+                memory_struct.add_heap(new_heap)
 
     memory_struct.associate_heap_elements_and_memzones()
     memory_struct.associate_memzones_and_mempools()
     return memory_struct
 
 
+def parse_mem_stats(stat_path):
+    with open(stat_path, "r") as stats:
+        return parse_mem_stats_lines(stats)
+
+
+def get_mem_stats_sample(memory_struct, timestamp):
+    """Reduce parsed memory stats to a compact sample of per heap, mempool and memzone usage"""
+    return {'time': timestamp,
+            'heaps': {h.id: [h.get_element_size(h.busy_malloc_elements) + h.get_element_size(h.busy_memzone_elements),
+                             h.get_element_size(h.free_elements), h.get_largest_free_size(),
+                             round(h.get_fragmentation(), 4)]
+                      for h in memory_struct.heaps},
+            'mempools': {p.name: [p.get_memzone_size_sum(), p.get_num_used_objs()] for p in memory_struct.mempools},
+            'memzones': {z.name: z.size for z in memory_struct.memzones}}
+
+
+def print_mem_stats_diff(prev, cur):
+    print("{} (+{:.1f}s)".format(time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(cur['time'])),
+                                 cur['time'] - prev['time']))
+    for heap_id, (busy, free, largest, frag) in sorted(cur['heaps'].items()):
+        old_busy, old_free, old_largest, old_frag = prev['heaps'].get(heap_id, [0, 0, 0, 0.0])
+        if (busy, free, largest) != (old_busy, old_free, old_largest):
+            print("  heap id: {} busy: {:+} B free: {:+} B largest free block: {:+} B fragmentation: {:+.2%}"
+                  .format(heap_id, busy - old_busy, free - old_free, largest - old_largest, frag - old_frag))
+    for name, (size, used) in sorted(cur['mempools'].items()):
+        old_size, old_used = prev['mempools'].get(name, [0, 0])
+        if (size, used) != (old_size, old_used):
+            print("  mempool: {} size: {:+} B objects in use: {}"
+                  .format(name, size - old_size, "{:+}".format(used - (old_used or 0)) if used is not None else "n/a"))
+    for name in sorted(set(cur['memzones']) - set(prev['memzones'])):
+        print("  memzone reserved: {} size: {}".format(name, B_to_MiB(cur['memzones'][name])))
+    for name in sorted(set(prev['memzones']) - set(cur['memzones'])):
+        print("  memzone freed: {} size: {}".format(name, B_to_MiB(prev['memzones'][name])))
+
+
+def is_growing(values):
+    return None not in values and values[-1] > values[0] and all(a <= b for a, b in zip(values, values[1:]))
+
+
+def find_mem_stats_trends(samples):
+    """Flag usage which has only grown over all the given samples.
+
+    Returns:
+        List of warning messages.
+    """
+    warnings = []
+    heaps = set.intersection(*(set(x['heaps']) for x in samples))
+    for heap_id in sorted(heaps):
+        series = [x['heaps'][heap_id] for x in samples]
+        if is_growing([x[0] for x in series]):
+            warnings.append("heap id: {} busy size grew by {} over {} samples"
+                            .format(heap_id, B_to_MiB(series[-1][0] - series[0][0]), len(samples)))
+        if is_growing([x[3] for x in series]):
+            warnings.append("heap id: {} fragmentation grew from {:.2%} to {:.2%} over {} samples"
+                            .format(heap_id, series[0][3], series[-1][3], len(samples)))
+    mempools = set.intersection(*(set(x['mempools']) for x in samples))
+    for name in sorted(mempools):
+        series = [x['mempools'][name] for x in samples]
+        if is_growing([x[1] for x in series]):
+            warnings.append("mempool: {} objects in use grew from {} to {} over {} samples"
+                            .format(name, series[0][1], series[-1][1], len(samples)))
+    if is_growing([sum(x['memzones'].values()) for x in samples]):
+        warnings.append("memzones grew by {} over {} samples"
+                        .format(B_to_MiB(sum(samples[-1]['memzones'].values()) - sum(samples[0]['memzones'].values())),
+                                len(samples)))
+    return warnings
+
+
+def monitor_mem_stats(args):
+    """Periodically dump the memory stats of a running application and track their changes"""
+    client = JSONRPCClient(args.server_addr, args.port, args.timeout)
+    samples = deque(maxlen=args.window)
+    output = open(args.output, "a") if args.output else None
+    count = 0
+    try:
+        while args.count == 0 or count < args.count:
+            if count > 0:
+                time.sleep(args.interval)
+            result = rpc.env_dpdk.env_dpdk_get_mem_stats(client)
+            sample = get_mem_stats_sample(parse_mem_stats(result['filename']), time.time())
+            if output is not None:
+                output.write(json.dumps(sample, separators=(',', ':')) + "\n")
+                output.flush()
+            if samples:
+                print_mem_stats_diff(samples[-1], sample)
+            samples.append(sample)
+            if len(samples) == args.window:
+                for warning in find_mem_stats_trends(list(samples)):
+                    print("  WARNING: {}".format(warning))
+            sys.stdout.flush()
+            count += 1
+    finally:
+        client.close()
+        if output is not None:
+            output.close()
+
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description='Dumps memory stats for DPDK. If no arguments are provided, it dumps a general summary.')
     parser.add_argument('-f', dest="stats_file", help='path to a dpdk memory stats file.', default='/tmp/spdk_mem_dump.txt')
     parser.add_argument('-m', '--heap', dest="heap", help='Print detailed information about the given heap.', default=None)
     parser.add_argument('-p', '--mempool', dest="mempool", help='Print detailed information about the given mempool.', default=None)
     parser.add_argument('-z', '--memzone', dest="memzone", help='Print detailed information about the given memzone.', default=None)
+    parser.add_argument('-i', '--interval', dest="interval", type=float, default=None,
+                        help='Instead of analyzing a single file, call env_dpdk_get_mem_stats every INTERVAL seconds '
+                        'and report the changes between consecutive dumps.')
+    parser.add_argument('-n', '--count', dest="count", type=int, default=0,
+                        help='Number of dumps to take in the periodic mode (0 means run forever).')
+    parser.add_argument('-w', '--window', dest="window", type=int, default=10,
+                        help='Number of consecutive dumps usage must have grown over to be reported. Default: 10')
+    parser.add_argument('-o', '--output', dest="output", default=None,
+                        help='Append the samples taken in the periodic mode to a file, one JSON object per line.')
+    parser.add_argument('-s', '--server', dest='server_addr', default='/var/tmp/spdk.sock',
+                        help='RPC domain socket path or IP address of the application to monitor.')
+    parser.add_argument('-r', '--port', dest='port', default=5260, type=int,
+                        help='RPC port number (if server_addr is IP address)')
+    parser.add_argument('-t', '--timeout', dest='timeout', default=60.0, type=float,
+                        help='Timeout as a floating point number expressed in seconds waiting for response. Default: 60.0')
 
     args = parser.parse_args()
 
+    if args.interval is not None:
+        if args.window < 2:
+            print("Error, the window needs to span at least two dumps.")
+            exit(1)
+        try:
+            monitor_mem_stats(args)
+        except JSONRPCException as ex:
+            print(ex.message)
+            exit(1)
+        except KeyboardInterrupt:
+            pass
+        exit(0)
+
     if not os.path.exists(args.stats_file):
         print("Error, specified stats file does not exist. Please make sure you have run the"
               "env_dpdk_get_mem_stats rpc on the spdk app you want to analyze.")
@@ -1,5 +1,6 @@
 #!/usr/bin/env python3
 
+import atexit
 import logging
 import os
 import sys
@@ -9,6 +10,7 @@ import time
 sys.path.append(os.path.dirname(__file__) + '/../python')
 
 import spdk.rpc as rpc  # noqa
+from spdk.rpc.instrumentation import RPCStats  # noqa
 
 
 SPDK_CPU_STAT = "/proc/stat"
@@ -363,8 +365,14 @@ def io_stat_display(args, cpu_info, stat):
 def io_stat_display_loop(args):
     interval = args.interval
     time_in_second = args.time_in_second
+    hooks = []
+    if args.rpc_stats:
+        rpc_stats = RPCStats()
+        hooks.append(rpc_stats)
+        atexit.register(rpc_stats.write, args.rpc_stats)
     args.client = rpc.client.JSONRPCClient(
-        args.server_addr, args.port, args.timeout, log_level=getattr(logging, args.verbose.upper()))
+        args.server_addr, args.port, args.timeout, log_level=getattr(logging, args.verbose.upper()),
+        hooks=hooks)
 
     last_cpu_stat = None
     bdev_stats = None
@@ -438,6 +446,10 @@ if __name__ == "__main__":
                         action='store_true', help="Display extended statistics.",
                         required=False, default=False)
 
+    parser.add_argument('--rpc-stats', dest='rpc_stats', metavar='FILE',
+                        help='Record per-method statistics of the RPC calls and write them to FILE \
+                        at exit, in the OpenMetrics format if its name ends with .prom, as JSON otherwise')
+
     args = parser.parse_args()
     if ((args.interval == 0 and args.time_in_second != 0) or
             (args.interval != 0 and args.time_in_second == 0)):
@@ -0,0 +1,240 @@
+"""Parser of fio JSON and JSON+ output shared by the performance test scripts.
+
+All latencies are reported in microseconds, regardless of the units used by the
+fio version which produced the output. Completion latency histograms (JSON+
+output only) are kept per job and can be merged across jobs, runs and hosts,
+so that percentiles of the combined workload are computed from all of its IO
+instead of averaging percentiles of its parts.
+
+fio output is parsed incrementally, one job at a time, so that large JSON+ files
+(thousands of histogram bins per job and direction) aren't loaded whole. Parsed
+jobs keep their histograms as numpy arrays.
+"""
+
+import itertools
+
+import ijson
+import numpy as np
+
+DIRECTIONS = ["read", "write", "trim"]
+
+
+class LatencyHistogram:
+    """Completion latency histogram: latency values (in ns) with their IO counts"""
+
+    def __init__(self, values=None, counts=None):
+        self.values = np.asarray(values if values is not None else [], dtype=np.int64)
+        self.counts = np.asarray(counts if counts is not None else [], dtype=np.int64)
+
+    @classmethod
+    def from_bins(cls, bins):
+        """Create the histogram from the "bins" dict of fio JSON+ output"""
+        if not bins:
+            return cls()
+        values = np.fromiter((int(v) for v in bins.keys()), dtype=np.int64, count=len(bins))
+        counts = np.fromiter(bins.values(), dtype=np.int64, count=len(bins))
+        order = np.argsort(values)
+        return cls(values[order], counts[order])
+
+    @classmethod
+    def merge(cls, histograms):
+        histograms = [h for h in histograms if h is not None and h.total]
+        if not histograms:
+            return cls()
+        if len(histograms) == 1:
+            return histograms[0]
+        values, inverse = np.unique(np.concatenate([h.values for h in histograms]), return_inverse=True)
+        counts = np.bincount(inverse, weights=np.concatenate([h.counts for h in histograms]))
+        return cls(values, counts.astype(np.int64))
+
+    def __add__(self, other):
+        return LatencyHistogram.merge([self, other])
+
+    @property
+    def total(self):
+        return int(self.counts.sum())
+
+    def percentiles(self, percentiles):
+        """Get latencies (in us) below which the given percentages (0-100) of IO completed"""
+        percentiles = np.asarray(percentiles, dtype=np.float64)
+        if not self.total:
+            return np.zeros(percentiles.shape)
+        cumulative = np.cumsum(self.counts)
+        idx = np.searchsorted(cumulative, percentiles / 100 * cumulative[-1], side="left")
+        return self.values[np.minimum(idx, len(self.values) - 1)] / 1000
+
+    def percentile(self, percentile):
+        return float(self.percentiles([percentile])[0])
+
+    def mean(self):
+        return float(np.dot(self.values, self.counts) / self.total / 1000) if self.total else 0.0
+
+    def to_bins(self):
+        return dict(zip(self.values.tolist(), self.counts.tolist()))
+
+
+class FioStats:
+    """Results of a single IO direction (read, write or trim) of a job, or of merged jobs"""
+
+    def __init__(self, iops=0.0, bw=0.0, total_ios=0, lat_mean=0.0, lat_min=0.0, lat_max=0.0,
+                 clat_percentiles=None, histogram=None):
+        self.iops = iops
+        self.bw = bw
+        self.total_ios = total_ios
+        self.lat_mean = lat_mean
+        self.lat_min = lat_min
+        self.lat_max = lat_max
+        # Percentiles of completion latency as reported by fio, percentage -> latency in us
+        self.clat_percentiles = clat_percentiles or {}
+        self.histogram = histogram or LatencyHistogram()
+
+    @staticmethod
+    def _lat(stats, prefix):
+        # Latency section and its multiplier to microseconds. Latest fio versions report
+        # latencies in ns ("lat_ns"), older ones in us ("lat") and some in ms ("lat_ms")
+        for unit, scale in [("ns", 1 / 1000), ("us", 1), ("ms", 1000)]:
+            if "%s_%s" % (prefix, unit) in stats:
+                return stats["%s_%s" % (prefix, unit)], scale
+        return stats.get(prefix, {}), 1
+
+    @classmethod
+    def from_json(cls, stats):
+        lat, scale = cls._lat(stats, "lat")
+        clat, clat_scale = cls._lat(stats, "clat")
+        clat_percentiles = {float(p): v * clat_scale for p, v in clat.get("percentile", {}).items()}
+        histogram = LatencyHistogram.from_bins(clat.get("bins")) if clat_scale == 1 / 1000 else None
+        return cls(iops=float(stats.get("iops", 0)), bw=float(stats.get("bw", 0)),
+                   total_ios=int(stats.get("total_ios", 0)),
+                   lat_mean=float(lat.get("mean", 0)) * scale, lat_min=float(lat.get("min", 0)) * scale,
+                   lat_max=float(lat.get("max", 0)) * scale,
+                   clat_percentiles=clat_percentiles, histogram=histogram)
+
+    @classmethod
+    def merge(cls, stats):
+        """Combine results of jobs running at the same time (e.g. on different initiators).
+
+        Throughput is summed and mean latency weighted by the number of IO. Percentiles
+        are computed from the merged histograms if all the jobs have them (JSON+ output),
+        otherwise they're approximated by an IO weighted average of reported percentiles.
+        """
+        stats = [s for s in stats if s.total_ios]
+        if not stats:
+            return cls()
+        total_ios = sum(s.total_ios for s in stats)
+        merged = cls(iops=sum(s.iops for s in stats), bw=sum(s.bw for s in stats), total_ios=total_ios,
+                     lat_mean=sum(s.lat_mean * s.total_ios for s in stats) / total_ios,
+                     lat_min=min(s.lat_min for s in stats), lat_max=max(s.lat_max for s in stats))
+        keys = sorted(set.intersection(*[set(s.clat_percentiles) for s in stats]))
+        # A histogram of only some of the jobs would misrepresent the others, keep it empty then
+        if all(s.histogram.total for s in stats):
+            merged.histogram = LatencyHistogram.merge([s.histogram for s in stats])
+            merged.clat_percentiles = dict(zip(keys, merged.histogram.percentiles(keys).tolist()))
+        else:
+            merged.clat_percentiles = {k: sum(s.clat_percentiles[k] * s.total_ios for s in stats) / total_ios for k in keys}
+        return merged
+
+    def percentile(self, percentile):
+        """Get completion latency percentile (in us), computing it from the histogram if available"""
+        if self.histogram.total:
+            return self.histogram.percentile(percentile)
+        return self.clat_percentiles.get(float(percentile), 0.0)
+
+    def percentiles(self, percentiles):
+        if self.histogram.total:
+            return self.histogram.percentiles(percentiles)
+        return np.array([self.clat_percentiles.get(float(p), 0.0) for p in percentiles])
+
+
+class FioJob:
+    def __init__(self, name, options=None, stats=None):
+        self.name = name
+        self.options = options or {}
+        self.stats = stats or {d: FioStats() for d in DIRECTIONS}
+
+    @property
+    def read(self):
+        return self.stats["read"]
+
+    @property
+    def write(self):
+        return self.stats["write"]
+
+    @property
+    def trim(self):
+        return self.stats["trim"]
+
+    @classmethod
+    def from_json(cls, job, global_options=None):
+        options = dict(global_options or {}, **job.get("job options", {}))
+        return cls(job.get("jobname", ""), options,
+                   {d: FioStats.from_json(job[d]) if d in job else FioStats() for d in DIRECTIONS})
+
+
+def _fio_json_chunks(fh, chunk_size=1 << 16):
+    """Generate (document number, chunk) of the JSON documents in fio output.
+
+    Anything printed around the documents (e.g. warnings printed by fio) is skipped.
+    fio pretty-prints its output, so a document starts with a line beginning with "{"
+    and ends with a "}" line.
+    """
+    number, in_document, chunk, length = 0, False, [], 0
+    for line in fh:
+        if not in_document:
+            if not line.startswith(b"{"):
+                continue
+            in_document = True
+        chunk.append(line)
+        length += len(line)
+        if line.rstrip() == b"}":
+            in_document = False
+        if length >= chunk_size or not in_document:
+            yield number, b"".join(chunk)
+            chunk, length = [], 0
+            if not in_document:
+                number += 1
+    if chunk:
+        yield number, b"".join(chunk)
+
+
+def iter_fio_jobs(fio_output_file):
+    """Iterate over all the jobs of fio output, as they are parsed.
+
+    The output is parsed incrementally, so only the jobs of the chunk being parsed are held
+    in memory as JSON. Anything preceding the JSON output (e.g. warnings printed by fio) is
+    skipped and files containing results of several fio invocations are supported.
+    """
+    with open(fio_output_file, "rb") as fh:
+        for _, chunks in itertools.groupby(_fio_json_chunks(fh), key=lambda c: c[0]):
+            # "global options" precede "jobs" in a document, so they're parsed first
+            options, jobs = ijson.sendable_list(), ijson.sendable_list()
+            parsers = [ijson.items_coro(options, "global options", use_float=True),
+                       ijson.items_coro(jobs, "jobs.item", use_float=True)]
+            global_options = {}
+            for _, chunk in chunks:
+                for parser in parsers:
+                    parser.send(chunk)
+                if options:
+                    global_options = options.pop()
+                for job in jobs:
+                    yield FioJob.from_json(job, global_options)
+                del jobs[:]
+            for parser in parsers:
+                parser.close()
+
+
+def read_fio_jobs(fio_output_file):
+    return list(iter_fio_jobs(fio_output_file))
+
+
+def merge_jobs(jobs, name="all"):
+    """Combine jobs running at the same time into a single one, see FioStats.merge()"""
+    jobs = list(jobs)
+    return FioJob(name, jobs[0].options if jobs else {},
+                  {d: FioStats.merge([j.stats[d] for j in jobs]) for d in DIRECTIONS})
+
+
+def read_fio_results(fio_output_files):
+    """Read fio output of all hosts taking part in a single run and merge all of their jobs"""
+    if isinstance(fio_output_files, str):
+        fio_output_files = [fio_output_files]
+    return merge_jobs(job for f in fio_output_files for job in iter_fio_jobs(f))
@@ -1,6 +1,9 @@
 import os
 import re
 import json
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from itertools import product, chain
 from subprocess import check_output, CalledProcessError, Popen
 
@@ -40,3 +43,47 @@ def get_nvme_devices():
 
 def nvmet_command(nvmet_bin, command):
     return check_output("%s %s" % (nvmet_bin, command), shell=True).decode(encoding="utf-8")
+
+
+def run_parallel(func, items):
+    """Call func(item) for each of the items at the same time, each one in its own thread.
+    Waits for all the calls to finish and returns their results in the order of items.
+    If any of the calls failed, the exception raised by the first one is re-raised."""
+    with ThreadPoolExecutor(max_workers=max(len(items), 1)) as executor:
+        futures = [executor.submit(func, item) for item in items]
+    return [f.result() for f in futures]
+
+
+class StartBarrier:
+    """Synchronizes the start of a workload on several hosts.
+
+    Each participating thread calls wait() before each run. Once all of them
+    reached it, they are released with a common wall-clock start time, lead_time
+    seconds in the future, so that the hosts can start their workloads at the
+    same moment regardless of how long it takes to dispatch the command to them.
+    Threads which only observe the workload (e.g. measurements) can follow the
+    first run with wait_for_start()."""
+
+    def __init__(self, parties, lead_time):
+        self.lead_time = lead_time
+        self.start_time = None
+        self._started = threading.Event()
+        self._barrier = threading.Barrier(parties, action=self._set_start_time)
+
+    def _set_start_time(self):
+        self.start_time = time.time() + self.lead_time
+        self._started.set()
+
+    def wait(self):
+        self._barrier.wait()
+        return self.start_time
+
+    def wait_for_start(self):
+        self._started.wait()
+        if self.start_time is not None:
+            time.sleep(max(0, self.start_time - time.time()))
+
+    def abort(self):
+        # Don't leave the other participants waiting for a host which failed
+        self._barrier.abort()
+        self._started.set()
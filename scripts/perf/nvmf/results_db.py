@@ -0,0 +1,315 @@
+#!/usr/bin/env python3
+
+import os
+import sys
+import json
+import math
+import time
+import sqlite3
+import hashlib
+import argparse
+import subprocess
+from collections import OrderedDict
+
+sys.path.append(os.path.dirname(__file__) + '/..')
+
+from fio_results import LatencyHistogram, read_fio_results  # noqa
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS sessions (
+    id INTEGER PRIMARY KEY,
+    timestamp REAL NOT NULL,
+    git_sha TEXT NOT NULL,
+    config_hash TEXT NOT NULL,
+    config TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY,
+    session_id INTEGER NOT NULL REFERENCES sessions(id),
+    host TEXT NOT NULL,
+    block_size TEXT NOT NULL,
+    io_depth INTEGER NOT NULL,
+    rw TEXT NOT NULL,
+    rwmixread INTEGER NOT NULL,
+    num_jobs INTEGER,
+    rate_iops INTEGER NOT NULL,
+    run INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS results (
+    run_id INTEGER NOT NULL REFERENCES runs(id),
+    direction TEXT NOT NULL,
+    iops REAL NOT NULL,
+    bw REAL NOT NULL,
+    lat_mean_us REAL NOT NULL,
+    lat_min_us REAL NOT NULL,
+    lat_max_us REAL NOT NULL,
+    PRIMARY KEY (run_id, direction)
+);
+CREATE TABLE IF NOT EXISTS clat_bins (
+    run_id INTEGER NOT NULL REFERENCES runs(id),
+    direction TEXT NOT NULL,
+    bin_ns INTEGER NOT NULL,
+    count INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS sessions_git_sha ON sessions(git_sha);
+CREATE INDEX IF NOT EXISTS runs_session ON runs(session_id);
+CREATE INDEX IF NOT EXISTS clat_bins_run ON clat_bins(run_id);
+"""
+
+WORKLOAD_KEYS = ["block_size", "io_depth", "rw", "rwmixread", "num_jobs", "rate_iops"]
+
+# Metric name, direction in which it gets worse
+METRICS = OrderedDict([
+    ("iops", "lower"),
+    ("bw", "lower"),
+    ("p50_lat_us", "higher"),
+    ("p99_lat_us", "higher"),
+    ("p99.9_lat_us", "higher"),
+    ("p99.99_lat_us", "higher"),
+])
+
+
+def get_git_sha(spdk_dir):
+    try:
+        return subprocess.check_output(["git", "-C", spdk_dir, "rev-parse", "HEAD"],
+                                       stderr=subprocess.DEVNULL).decode(encoding="utf-8").strip()
+    except (subprocess.CalledProcessError, FileNotFoundError):
+        return "unknown"
+
+
+# Config keys holding credentials, in any of the config sections
+CREDENTIAL_KEYS = ["password"]
+
+
+def _redact(config):
+    """Copy of the config without credentials, which are neither stored nor influence the results"""
+    config = json.loads(json.dumps(config))
+    for section in config.values():
+        if isinstance(section, dict):
+            for key in CREDENTIAL_KEYS:
+                section.pop(key, None)
+    return config
+
+
+def get_config_hash(config):
+    return hashlib.sha256(json.dumps(_redact(config), sort_keys=True).encode()).hexdigest()
+
+
+def betainc(a, b, x):
+    """Regularized incomplete beta function I_x(a, b), evaluated with Lentz's continued fraction"""
+    if x <= 0:
+        return 0.0
+    if x >= 1:
+        return 1.0
+    if x > (a + 1) / (a + b + 2):
+        return 1.0 - betainc(b, a, 1.0 - x)
+
+    front = math.exp(math.lgamma(a + b) - math.lgamma(a) - math.lgamma(b) +
+                     a * math.log(x) + b * math.log(1.0 - x)) / a
+    tiny = 1e-300
+    f, c, d = 1.0, 1.0, 0.0
+    for i in range(400):
+        m = i // 2
+        if i == 0:
+            numerator = 1.0
+        elif i % 2 == 0:
+            numerator = (m * (b - m) * x) / ((a + 2 * m - 1) * (a + 2 * m))
+        else:
+            numerator = -((a + m) * (a + b + m) * x) / ((a + 2 * m) * (a + 2 * m + 1))
+        d = 1.0 + numerator * d
+        d = 1.0 / (d if abs(d) > tiny else tiny)
+        c = 1.0 + numerator / c
+        c = c if abs(c) > tiny else tiny
+        f *= c * d
+        if abs(1.0 - c * d) < 1e-12:
+            break
+    return front * (f - 1.0)
+
+
+def welch_t_test(a, b):
+    """Two-sided Welch's t-test. Returns the p-value of the samples a and b having the
+    same mean, or None if there's not enough samples to tell."""
+    if len(a) < 2 or len(b) < 2:
+        return None
+    mean_a, mean_b = sum(a) / len(a), sum(b) / len(b)
+    var_a = sum((x - mean_a) ** 2 for x in a) / (len(a) - 1) / len(a)
+    var_b = sum((x - mean_b) ** 2 for x in b) / (len(b) - 1) / len(b)
+    if var_a + var_b == 0:
+        return 1.0 if mean_a == mean_b else 0.0
+    t = (mean_a - mean_b) / math.sqrt(var_a + var_b)
+    df = (var_a + var_b) ** 2 / (var_a ** 2 / (len(a) - 1) + var_b ** 2 / (len(b) - 1))
+    return betainc(df / 2, 0.5, df / (df + t * t))
+
+
+class ResultsDB:
+    def __init__(self, path):
+        self.path = path
+        self.conn = sqlite3.connect(path)
+        self.conn.executescript(SCHEMA)
+
+    def close(self):
+        self.conn.close()
+
+    def add_session(self, git_sha, config):
+        with self.conn:
+            cur = self.conn.execute("INSERT INTO sessions (timestamp, git_sha, config_hash, config) VALUES (?, ?, ?, ?)",
+                                    (time.time(), git_sha, get_config_hash(config), json.dumps(_redact(config))))
+        return cur.lastrowid
+
+    def add_run(self, session_id, host, workload, run, fio_json_file):
+        """Store results of a single fio run from its JSON (or JSON+, including clat histograms) output"""
+        job = read_fio_results(fio_json_file)
+
+        with self.conn:
+            cur = self.conn.execute("INSERT INTO runs (session_id, host, %s, run) VALUES (?, ?, %s, ?)" %
+                                    (", ".join(WORKLOAD_KEYS), ", ".join("?" * len(WORKLOAD_KEYS))),
+                                    (session_id, host, *[workload.get(k) for k in WORKLOAD_KEYS], run))
+            run_id = cur.lastrowid
+            for direction in ["read", "write"]:
+                d = job.stats[direction]
+                self.conn.execute("INSERT INTO results (run_id, direction, iops, bw, lat_mean_us, lat_min_us, lat_max_us) "
+                                  "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                                  (run_id, direction, d.iops, d.bw, d.lat_mean, d.lat_min, d.lat_max))
+                self.conn.executemany("INSERT INTO clat_bins (run_id, direction, bin_ns, count) VALUES (?, ?, ?, ?)",
+                                      [(run_id, direction, b, c) for b, c in d.histogram.to_bins().items()])
+        return run_id
+
+    def find_sessions(self, selector):
+        """Get the IDs of sessions matching selector: a session ID or a git sha (prefix)"""
+        if selector.isdigit():
+            rows = self.conn.execute("SELECT id FROM sessions WHERE id = ?", (int(selector),)).fetchall()
+            if rows:
+                return [r[0] for r in rows]
+        rows = self.conn.execute("SELECT id FROM sessions WHERE git_sha LIKE ? ORDER BY id", (selector + "%",)).fetchall()
+        return [r[0] for r in rows]
+
+    def list_sessions(self):
+        return self.conn.execute("SELECT s.id, s.timestamp, s.git_sha, s.config_hash, COUNT(r.id) FROM sessions s "
+                                 "LEFT JOIN runs r ON r.session_id = s.id GROUP BY s.id ORDER BY s.id").fetchall()
+
+    def get_samples(self, session_ids):
+        """Compute metrics of each repetition of each workload in given sessions.
+
+        Results of all initiators taking part in a run are combined: throughput is
+        summed and latency percentiles are computed from the merged clat histograms
+        of both read and write IO.
+
+        Returns:
+            Dict of workload tuple (in WORKLOAD_KEYS order) -> dict of metric -> list of samples.
+        """
+        placeholders = ", ".join("?" * len(session_ids))
+        runs = OrderedDict()
+        for row in self.conn.execute("SELECT r.id, r.session_id, r.run, %s, SUM(x.iops), SUM(x.bw) FROM runs r "
+                                     "JOIN results x ON x.run_id = r.id WHERE r.session_id IN (%s) "
+                                     "GROUP BY r.id ORDER BY r.id" % (", ".join("r." + k for k in WORKLOAD_KEYS), placeholders),
+                                     session_ids):
+            run_id, session_id, run = row[:3]
+            workload = tuple(row[3:3 + len(WORKLOAD_KEYS)])
+            sample = runs.setdefault((workload, session_id, run), {"iops": 0, "bw": 0, "histograms": []})
+            sample["iops"] += row[-2]
+            sample["bw"] += row[-1]
+            bins = self.conn.execute("SELECT bin_ns, count FROM clat_bins WHERE run_id = ? ORDER BY bin_ns", (run_id,)).fetchall()
+            if bins:
+                sample["histograms"].append(LatencyHistogram(*zip(*bins)))
+
+        samples = OrderedDict()
+        for (workload, _, _), sample in runs.items():
+            metrics = samples.setdefault(workload, {m: [] for m in METRICS})
+            histogram = LatencyHistogram.merge(sample["histograms"])
+            metrics["iops"].append(sample["iops"])
+            metrics["bw"].append(sample["bw"])
+            for p, value in zip([50, 99, 99.9, 99.99], histogram.percentiles([50, 99, 99.9, 99.99])):
+                metrics["p%s_lat_us" % p].append(float(value))
+        return samples
+
+    def compare(self, base_ids, new_ids, alpha=0.05, threshold=5.0):
+        """Compare workloads run in both base and new sessions.
+
+        A metric is flagged as a regression if it got worse by more than threshold
+        percent and the difference is statistically significant (Welch's t-test
+        p-value below alpha). If either side has a single repetition only, the
+        significance can't be evaluated and the threshold alone decides.
+
+        Returns:
+            List of (workload, metric, base mean, new mean, change in %, p-value, regression) tuples.
+        """
+        base, new = self.get_samples(base_ids), self.get_samples(new_ids)
+        report = []
+        for workload in base:
+            if workload not in new:
+                continue
+            for metric, worse in METRICS.items():
+                a, b = base[workload][metric], new[workload][metric]
+                mean_a, mean_b = sum(a) / len(a), sum(b) / len(b)
+                change = (mean_b - mean_a) / mean_a * 100 if mean_a else 0.0
+                p_value = welch_t_test(a, b)
+                degraded = change < -threshold if worse == "lower" else change > threshold
+                regression = degraded and (p_value is None or p_value < alpha)
+                report.append((workload, metric, mean_a, mean_b, change, p_value, regression))
+        return report
+
+
+def print_sessions(db):
+    print("%5s  %-19s  %-12s  %-12s  %s" % ("id", "time", "git sha", "config", "runs"))
+    for session_id, timestamp, git_sha, config_hash, runs in db.list_sessions():
+        date = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(timestamp))
+        print("%5d  %-19s  %-12s  %-12s  %d" % (session_id, date, git_sha[:12], config_hash[:12], runs))
+
+
+def print_comparison(report):
+    print("%-32s  %-13s  %14s  %14s  %8s  %7s" % ("workload", "metric", "base", "new", "change", "p-value"))
+    for workload, metric, mean_a, mean_b, change, p_value, regression in report:
+        block_size, io_depth, rw, rwmixread, num_jobs, rate_iops = workload
+        name = "%s_%s_%s_m_%s" % (block_size, io_depth, rw, rwmixread)
+        if num_jobs:
+            name += "_j%s" % num_jobs
+        if rate_iops:
+            name += "_r%s" % rate_iops
+        p_value = "n/a" if p_value is None else "%.4f" % p_value
+        flag = "  REGRESSION" if regression else ""
+        print("%-32s  %-13s  %14.3f  %14.3f  %+7.2f%%  %7s%s" % (name, metric, mean_a, mean_b, change, p_value, flag))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="NVMe-oF performance results database",
+                                     formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('-d', '--database', type=str, required=True,
+                        help='SQLite results database file.')
+    subparsers = parser.add_subparsers(dest='command')
+    subparsers.required = True
+
+    subparsers.add_parser('list', help='List test sessions stored in the database.')
+
+    p = subparsers.add_parser('compare', help='Compare results of two (sets of) sessions and report regressions. '
+                              'Exits with 1 if any were found.')
+    p.add_argument('base', help='Baseline session ID or git sha (prefix). All sessions with a matching sha are used.')
+    p.add_argument('new', help='Session ID or git sha (prefix) to compare against the baseline.')
+    p.add_argument('-a', '--alpha', type=float, default=0.05,
+                   help='Significance level of the difference between base and new results.')
+    p.add_argument('-t', '--threshold', type=float, default=5.0,
+                   help='Minimum change (in percent) of a metric for it to be reported as a regression.')
+    p.add_argument('-r', '--regressions-only', action='store_true',
+                   help='Only print metrics flagged as regressions.')
+
+    args = parser.parse_args()
+
+    if not os.path.exists(args.database):
+        print("Database %s does not exist" % args.database)
+        sys.exit(1)
+    db = ResultsDB(args.database)
+
+    if args.command == 'list':
+        print_sessions(db)
+    elif args.command == 'compare':
+        base_ids, new_ids = db.find_sessions(args.base), db.find_sessions(args.new)
+        for selector, ids in [(args.base, base_ids), (args.new, new_ids)]:
+            if not ids:
+                print("No sessions matching %s" % selector)
+                sys.exit(1)
+        report = db.compare(base_ids, new_ids, args.alpha, args.threshold)
+        if args.regressions_only:
+            report = [r for r in report if r[-1]]
+        print_comparison(report)
+        if any(r[-1] for r in report):
+            sys.exit(1)
+    db.close()
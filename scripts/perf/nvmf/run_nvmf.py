@@ -18,11 +18,17 @@ from collections import OrderedDict
 import paramiko
 import pandas as pd
 from common import *
+from results_db import ResultsDB, get_git_sha
+from telemetry import TelemetrySampler
+from sweep import LoadSweep, summarize_fio_results
 
 sys.path.append(os.path.dirname(__file__) + '/../../../python')
 
+sys.path.append(os.path.dirname(__file__) + '/..')
+
 import spdk.rpc as rpc  # noqa
 import spdk.rpc.client as rpc_client  # noqa
+from fio_results import read_fio_results  # noqa
 
 
 class Server:
@@ -350,6 +356,11 @@ class Target(Server):
         self.bandwidth_count = 0
         self.enable_dpdk_memory = False
         self.dpdk_wait_time = 0
+        self.enable_telemetry = False
+        self.telemetry_delay = 0
+        self.telemetry_interval = 1
+        self.telemetry_count = 0
+        self.telemetry_format = "csv"
         self.enable_zcopy = False
         self.scheduler_name = "static"
         self.null_block = 0
@@ -367,6 +378,14 @@ class Target(Server):
             self.enable_bandwidth, self.bandwidth_count = target_config["enable_bandwidth"]
         if "enable_dpdk_memory" in target_config:
             self.enable_dpdk_memory, self.dpdk_wait_time = target_config["enable_dpdk_memory"]
+        if "telemetry_settings" in target_config:
+            self.enable_telemetry, self.telemetry_delay, self.telemetry_interval, self.telemetry_count = \
+                target_config["telemetry_settings"][:4]
+            if len(target_config["telemetry_settings"]) > 4:
+                self.telemetry_format = target_config["telemetry_settings"][4]
+            if self.telemetry_format not in TelemetrySampler.FORMATS:
+                raise ValueError("Unsupported telemetry_settings format: %s, valid ones: %s" %
+                                 (self.telemetry_format, ", ".join(TelemetrySampler.FORMATS)))
         if "scheduler_settings" in target_config:
             self.scheduler_name = target_config["scheduler_settings"]
         if "zcopy_settings" in target_config:
@@ -415,72 +434,14 @@ class Target(Server):
         self.log_print("Done zipping")
 
     def read_json_stats(self, file):
-        with open(file, "r") as json_data:
-            data = json.load(json_data)
-            job_pos = 0  # job_post = 0 because using aggregated results
-
-            # Check if latency is in nano or microseconds to choose correct dict key
-            def get_lat_unit(key_prefix, dict_section):
-                # key prefix - lat, clat or slat.
-                # dict section - portion of json containing latency bucket in question
-                # Return dict key to access the bucket and unit as string
-                for k, _ in dict_section.items():
-                    if k.startswith(key_prefix):
-                        return k, k.split("_")[1]
-
-            def get_clat_percentiles(clat_dict_leaf):
-                if "percentile" in clat_dict_leaf:
-                    p99_lat = float(clat_dict_leaf["percentile"]["99.000000"])
-                    p99_9_lat = float(clat_dict_leaf["percentile"]["99.900000"])
-                    p99_99_lat = float(clat_dict_leaf["percentile"]["99.990000"])
-                    p99_999_lat = float(clat_dict_leaf["percentile"]["99.999000"])
-
-                    return [p99_lat, p99_9_lat, p99_99_lat, p99_999_lat]
-                else:
-                    # Latest fio versions do not provide "percentile" results if no
-                    # measurements were done, so just return zeroes
-                    return [0, 0, 0, 0]
-
-            read_iops = float(data["jobs"][job_pos]["read"]["iops"])
-            read_bw = float(data["jobs"][job_pos]["read"]["bw"])
-            lat_key, lat_unit = get_lat_unit("lat", data["jobs"][job_pos]["read"])
-            read_avg_lat = float(data["jobs"][job_pos]["read"][lat_key]["mean"])
-            read_min_lat = float(data["jobs"][job_pos]["read"][lat_key]["min"])
-            read_max_lat = float(data["jobs"][job_pos]["read"][lat_key]["max"])
-            clat_key, clat_unit = get_lat_unit("clat", data["jobs"][job_pos]["read"])
-            read_p99_lat, read_p99_9_lat, read_p99_99_lat, read_p99_999_lat = get_clat_percentiles(
-                data["jobs"][job_pos]["read"][clat_key])
-
-            if "ns" in lat_unit:
-                read_avg_lat, read_min_lat, read_max_lat = [x / 1000 for x in [read_avg_lat, read_min_lat, read_max_lat]]
-            if "ns" in clat_unit:
-                read_p99_lat = read_p99_lat / 1000
-                read_p99_9_lat = read_p99_9_lat / 1000
-                read_p99_99_lat = read_p99_99_lat / 1000
-                read_p99_999_lat = read_p99_999_lat / 1000
-
-            write_iops = float(data["jobs"][job_pos]["write"]["iops"])
-            write_bw = float(data["jobs"][job_pos]["write"]["bw"])
-            lat_key, lat_unit = get_lat_unit("lat", data["jobs"][job_pos]["write"])
-            write_avg_lat = float(data["jobs"][job_pos]["write"][lat_key]["mean"])
-            write_min_lat = float(data["jobs"][job_pos]["write"][lat_key]["min"])
-            write_max_lat = float(data["jobs"][job_pos]["write"][lat_key]["max"])
-            clat_key, clat_unit = get_lat_unit("clat", data["jobs"][job_pos]["write"])
-            write_p99_lat, write_p99_9_lat, write_p99_99_lat, write_p99_999_lat = get_clat_percentiles(
-                data["jobs"][job_pos]["write"][clat_key])
-
-            if "ns" in lat_unit:
-                write_avg_lat, write_min_lat, write_max_lat = [x / 1000 for x in [write_avg_lat, write_min_lat, write_max_lat]]
-            if "ns" in clat_unit:
-                write_p99_lat = write_p99_lat / 1000
-                write_p99_9_lat = write_p99_9_lat / 1000
-                write_p99_99_lat = write_p99_99_lat / 1000
-                write_p99_999_lat = write_p99_999_lat / 1000
-
-        return [read_iops, read_bw, read_avg_lat, read_min_lat, read_max_lat,
-                read_p99_lat, read_p99_9_lat, read_p99_99_lat, read_p99_999_lat,
-                write_iops, write_bw, write_avg_lat, write_min_lat, write_max_lat,
-                write_p99_lat, write_p99_9_lat, write_p99_99_lat, write_p99_999_lat]
+        return self.get_job_stats(read_fio_results(file))
+
+    @staticmethod
+    def get_job_stats(job):
+        stats = []
+        for d in [job.read, job.write]:
+            stats += [d.iops, d.bw, d.lat_mean, d.lat_min, d.lat_max, *d.percentiles([99, 99.9, 99.99, 99.999]).tolist()]
+        return stats
 
     def parse_results(self, results_dir, csv_file):
         files = os.listdir(results_dir)
@@ -521,7 +482,7 @@ class Target(Server):
             # If "_CPU" exists in name - ignore it
             # Initiators for the same job could have different num_cores parameter
             job_name = re.sub(r"_\d+CPU", "", job_name)
-            job_result_files = [x for x in json_files if x.startswith(job_name)]
+            job_result_files = [x for x in json_files if x.startswith(job_name + "_")]
             self.log_print("Matching result files for current fio config:")
             for j in job_result_files:
                 self.log_print("\t %s" % j)
@@ -543,7 +504,7 @@ class Target(Server):
                         separate_stats.append(stats)
                         self.log_print(stats)
                     except JSONDecodeError as e:
-                        self.log_print("ERROR: Failed to parse %s results! Results might be incomplete!")
+                        self.log_print("ERROR: Failed to parse %s results! Results might be incomplete!" % r)
 
                 init_results = [sum(x) for x in zip(*separate_stats)]
                 init_results = [x / len(separate_stats) for x in init_results]
@@ -555,13 +516,22 @@ class Target(Server):
                     fh.write(header_line + "\n")
                     fh.write(",".join([job_name, *["{0:.3f}".format(x) for x in init_results]]) + "\n")
 
-            # Sum results of all initiators running this FIO job.
-            # Latency results are an average of latencies from accros all initiators.
-            inits_avg_results = [sum(x) for x in zip(*inits_avg_results)]
+            # Merge results of all initiators running this FIO job in the same run, so that
+            # latency percentiles are computed from all of their IO, then average the runs.
+            runs = {}
+            for r in job_result_files:
+                # Files are named <job_name>[_<N>CPU][_run_<run>]_<initiator>.json, the initiator
+                # name may contain "_" so take the run from the known part of the name instead
+                run = re.match(r"_run_(\d+)_", re.sub(r"_\d+CPU", "", r)[len(job_name):])
+                runs.setdefault(run.group(1) if run else None, []).append(os.path.join(results_dir, r))
+            separate_stats = []
+            for r in runs.values():
+                try:
+                    separate_stats.append(self.get_job_stats(read_fio_results(r)))
+                except JSONDecodeError as e:
+                    self.log_print("ERROR: Failed to parse %s results! Results might be incomplete!" % r)
+            inits_avg_results = [sum(x) / len(separate_stats) for x in zip(*separate_stats)]
             inits_avg_results = OrderedDict(zip(headers, inits_avg_results))
-            for key in inits_avg_results:
-                if "lat" in key:
-                    inits_avg_results[key] /= len(inits_names)
 
             # Aggregate separate read/write values into common labels
             # Take rw_mixread into consideration for mixed read/write workloads.
@@ -646,6 +616,11 @@ class Target(Server):
         rpc.env.env_dpdk_get_mem_stats
         os.rename("/tmp/spdk_mem_dump.txt", "%s/spdk_mem_dump.txt" % (results_dir))
 
+    def measure_telemetry(self, results_dir, telemetry_file_name):
+        self.log_print("Waiting %d delay before sampling telemetry" % self.telemetry_delay)
+        time.sleep(self.telemetry_delay)
+        TelemetrySampler(self, self.telemetry_interval, self.telemetry_count).run(results_dir, telemetry_file_name)
+
     def sys_config(self):
         self.log_print("====Kernel release:====")
         self.log_print(os.uname().release)
@@ -703,6 +678,7 @@ class Initiator(Server):
         self.exec_cmd(["sudo", "rm", "-rf", "%s/nvmf_perf" % self.spdk_dir])
         self.exec_cmd(["mkdir", "-p", "%s" % self.spdk_dir])
         self._nics_json_obj = json.loads(self.exec_cmd(["ip", "-j", "address", "show"]))
+        self.clock_offset = self.get_clock_offset()
 
         if "skip_spdk_install" not in general_config or general_config["skip_spdk_install"] is False:
             self.copy_spdk("/tmp/spdk.zip")
@@ -742,6 +718,24 @@ class Initiator(Server):
 
         return out
 
+    def get_clock_offset(self, samples=5):
+        # Estimate the difference between the initiator's and local wall clocks, using the
+        # sample with the shortest round trip as the least affected by SSH latency.
+        best_rtt, offset = None, 0
+        for _ in range(samples):
+            t0 = time.time()
+            remote_time = float(self.exec_cmd(["date", "+%s.%N"]))
+            t1 = time.time()
+            if best_rtt is None or t1 - t0 < best_rtt:
+                best_rtt, offset = t1 - t0, remote_time - (t0 + t1) / 2
+        self.log_print("Clock offset: %.6f s (round trip %.6f s)" % (offset, best_rtt))
+        return offset
+
+    def wait_until_cmd(self, start_time):
+        # Command sleeping on the initiator until local wall-clock time start_time
+        remote_start_time = start_time + self.clock_offset
+        return ["python3", "-c", "'import time; time.sleep(max(0, %.6f - time.time()))'" % remote_start_time, "&&"]
+
     def put_file(self, local, remote_dest):
         ftp = self.ssh_connection.open_sftp()
         ftp.put(local, remote_dest)
@@ -762,8 +756,7 @@ class Initiator(Server):
     def copy_result_files(self, dest_dir):
         self.log_print("Copying results")
 
-        if not os.path.exists(dest_dir):
-            os.mkdir(dest_dir)
+        os.makedirs(dest_dir, exist_ok=True)
 
         # Get list of result files from initiator and copy them back to target
         file_list = self.exec_cmd(["ls", "%s/nvmf_perf" % self.spdk_dir]).strip().split("\n")
@@ -888,6 +881,8 @@ registerfiles=1
         fio_config = fio_config + filename_section
 
         fio_config_filename = "%s_%s_%s_m_%s" % (block_size, io_depth, rw, rwmixread)
+        if rate_iops:
+            fio_config_filename += "_r%s" % rate_iops
         if hasattr(self, "num_cores"):
             fio_config_filename += "_%sCPU" % self.num_cores
         fio_config_filename += ".fio"
@@ -911,27 +906,37 @@ registerfiles=1
         else:
             self.log_print("WARNING: you have disabled intel_pstate and using default cpu governance.")
 
-    def run_fio(self, fio_config_file, run_num=None):
+    def run_fio(self, fio_config_file, run_num=None, start_barrier=None):
         job_name, _ = os.path.splitext(fio_config_file)
         self.log_print("Starting FIO run for job: %s" % job_name)
         self.log_print("Using FIO: %s" % self.fio_bin)
 
-        if run_num:
-            for i in range(1, run_num + 1):
-                output_filename = job_name + "_run_" + str(i) + "_" + self.name + ".json"
-                try:
-                    output = self.exec_cmd(["sudo", self.fio_bin, fio_config_file, "--output-format=json",
-                                            "--output=%s" % output_filename, "--eta=never"], True)
-                    self.log_print(output)
-                except subprocess.CalledProcessError as e:
-                    self.log_print("ERROR: Fio process failed!")
-                    self.log_print(e.stdout)
-        else:
-            output_filename = job_name + "_" + self.name + ".json"
-            output = self.exec_cmd(["sudo", self.fio_bin,
-                                    fio_config_file, "--output-format=json",
-                                    "--output" % output_filename], True)
-            self.log_print(output)
+        def fio_cmd(output_filename):
+            cmd = ["sudo", self.fio_bin, fio_config_file, "--output-format=json+",
+                   "--output=%s" % output_filename, "--eta=never"]
+            if start_barrier:
+                # Wait for the other initiators and start at the same time as them
+                cmd = [*self.wait_until_cmd(start_barrier.wait()), *cmd]
+            return cmd
+
+        try:
+            if run_num:
+                for i in range(1, run_num + 1):
+                    output_filename = job_name + "_run_" + str(i) + "_" + self.name + ".json"
+                    try:
+                        output = self.exec_cmd(fio_cmd(output_filename), True)
+                        self.log_print(output)
+                    except subprocess.CalledProcessError as e:
+                        self.log_print("ERROR: Fio process failed!")
+                        self.log_print(e.stdout)
+            else:
+                output_filename = job_name + "_" + self.name + ".json"
+                output = self.exec_cmd(fio_cmd(output_filename), True)
+                self.log_print(output)
+        except Exception:
+            if start_barrier:
+                start_barrier.abort()
+            raise
         self.log_print("FIO run finished. Results in: %s" % output_filename)
 
     def sys_config(self):
@@ -1444,6 +1449,8 @@ if __name__ == "__main__":
                         help='Results directory.')
     parser.add_argument('-s', '--csv-filename', type=str, default='nvmf_results.csv',
                         help='CSV results filename.')
+    parser.add_argument('-d', '--results-db', type=str, default=None,
+                        help='SQLite database to store the results in, along with results of previous test runs.')
 
     args = parser.parse_args()
 
@@ -1457,6 +1464,11 @@ if __name__ == "__main__":
     general_config = data["general"]
     target_config = data["target"]
     initiator_configs = [data[x] for x in data.keys() if "initiator" in x]
+    fio_start_lead_time = 5
+    fio_sweep = None
+    results_db = ResultsDB(args.results_db) if args.results_db else None
+    # Take a copy before the configuration gets updated below
+    db_config = json.loads(json.dumps(data))
 
     for k, v in data.items():
         if "target" in k:
@@ -1467,11 +1479,9 @@ if __name__ == "__main__":
                 target_obj = KernelTarget(k, data["general"], v)
                 pass
         elif "initiator" in k:
-            if data[k]["mode"] == "spdk":
-                init_obj = SPDKInitiator(k, data["general"], v)
-            elif data[k]["mode"] == "kernel":
-                init_obj = KernelInitiator(k, data["general"], v)
-            initiators.append(init_obj)
+            # Initiators are set up in parallel once the target is ready,
+            # as they need the SPDK sources zipped by the target.
+            initiators.append((k, v))
         elif "fio" in k:
             fio_workloads = itertools.product(data[k]["bs"],
                                               data[k]["qd"],
@@ -1486,90 +1496,195 @@ if __name__ == "__main__":
             fio_rate_iops = 0
             if "rate_iops" in data[k]:
                 fio_rate_iops = data[k]["rate_iops"]
+            if "start_lead_time" in data[k]:
+                fio_start_lead_time = data[k]["start_lead_time"]
+            if "sweep" in data[k]:
+                fio_sweep = data[k]["sweep"]
+                if fio_sweep["param"] not in ["rate_iops", "qd"]:
+                    print("Unsupported sweep param %s, use either rate_iops or qd" % fio_sweep["param"])
+                    sys.exit(1)
+                if not 0 < fio_sweep["start"] <= fio_sweep["max"]:
+                    print("Invalid sweep range: start %s, max %s; expected 0 < start <= max" %
+                          (fio_sweep["start"], fio_sweep["max"]))
+                    sys.exit(1)
+                if fio_sweep["slo_p99_us"] <= 0:
+                    print("Invalid sweep slo_p99_us %s, it must be positive" % fio_sweep["slo_p99_us"])
+                    sys.exit(1)
         else:
             continue
 
+    def create_initiator(item):
+        k, v = item
+        if v["mode"] == "spdk":
+            return SPDKInitiator(k, data["general"], v)
+        elif v["mode"] == "kernel":
+            return KernelInitiator(k, data["general"], v)
+
+    initiators = run_parallel(create_initiator, initiators)
+
     try:
         os.mkdir(args.results)
     except FileExistsError:
         pass
 
+    def after_start(start_barrier, func, *args):
+        # Thread target starting a measurement along with the fio workload
+        def run():
+            start_barrier.wait_for_start()
+            func(*args)
+        return run
+
+    def setup_initiator(i):
+        i.discover_subsystems(i.target_nic_ips, target_obj.subsys_no)
+        if i.enable_adq:
+            i.adq_configure_tc()
+
+    def collect_results(i):
+        if i.mode == "kernel":
+            i.kernel_init_disconnect()
+        i.copy_result_files(args.results)
+
+    def restore(server):
+        server.restore_governor()
+        server.restore_tuned()
+        server.restore_services()
+        server.restore_sysctl()
+
+    def run_workload(block_size, io_depth, rw, rate_iops, run_num):
+        # Run a single fio workload on all initiators, along with the target measurements.
+        # Returns the list of (initiator, run number, result file) tuples.
+        threads = []
+        name = [str(block_size), str(rw), str(io_depth)]
+        if rate_iops:
+            name.append("r%s" % rate_iops)
+
+        def prepare_fio(i):
+            if i.mode == "kernel":
+                i.kernel_init_connect()
+
+            return i.gen_fio_config(rw, fio_rw_mix_read, block_size, io_depth, target_obj.subsys_no,
+                                    fio_num_jobs, fio_ramp_time, fio_run_time, rate_iops)
+
+        configs = run_parallel(prepare_fio, initiators)
+
+        # All initiators start each fio run at the same, clock-aligned time
+        start_barrier = StartBarrier(len(initiators), fio_start_lead_time)
+        for i, cfg in zip(initiators, configs):
+            t = threading.Thread(target=i.run_fio, args=(cfg, run_num, start_barrier))
+            threads.append(t)
+        if target_obj.enable_sar:
+            sar_file_name = "_".join([*name, "sar"])
+            sar_file_name = ".".join([sar_file_name, "txt"])
+            t = threading.Thread(target=after_start(start_barrier, target_obj.measure_sar, args.results, sar_file_name))
+            threads.append(t)
+
+        if target_obj.enable_pcm and target_obj.enable_telemetry:
+            # Two PCM instances would compete for the same counters, PCM runs as part of telemetry
+            target_obj.log_print("INFO: PCM metrics are recorded by telemetry sampling")
+        elif target_obj.enable_pcm:
+            pcm_fnames = ["%s_%s.csv" % ("_".join(name), x) for x in ["pcm_cpu", "pcm_memory", "pcm_power"]]
+
+            pcm_cpu_t = threading.Thread(target=after_start(start_barrier, target_obj.measure_pcm, args.results, pcm_fnames[0]))
+            pcm_mem_t = threading.Thread(target=after_start(start_barrier, target_obj.measure_pcm_memory, args.results, pcm_fnames[1]))
+            pcm_pow_t = threading.Thread(target=after_start(start_barrier, target_obj.measure_pcm_power, args.results, pcm_fnames[2]))
+
+            threads.append(pcm_cpu_t)
+            threads.append(pcm_mem_t)
+            threads.append(pcm_pow_t)
+
+        if target_obj.enable_bandwidth:
+            bandwidth_file_name = "_".join(["bandwidth", *name])
+            bandwidth_file_name = ".".join([bandwidth_file_name, "csv"])
+            t = threading.Thread(target=after_start(start_barrier, target_obj.measure_network_bandwidth,
+                                                    args.results, bandwidth_file_name))
+            threads.append(t)
+
+        if target_obj.enable_dpdk_memory:
+            t = threading.Thread(target=after_start(start_barrier, target_obj.measure_dpdk_memory, args.results))
+            threads.append(t)
+
+        if target_obj.enable_telemetry:
+            telemetry_file_name = "_".join([*name, "telemetry"])
+            telemetry_file_name = ".".join([telemetry_file_name, target_obj.telemetry_format])
+            t = threading.Thread(target=after_start(start_barrier, target_obj.measure_telemetry,
+                                                    args.results, telemetry_file_name))
+            threads.append(t)
+
+        if target_obj.enable_adq:
+            ethtool_thread = threading.Thread(target=after_start(start_barrier, target_obj.ethtool_after_fio_ramp,
+                                                                 fio_ramp_time))
+            threads.append(ethtool_thread)
+
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        run_parallel(collect_results, initiators)
+
+        result_files = []
+        for i, cfg in zip(initiators, configs):
+            job_name, _ = os.path.splitext(os.path.basename(cfg))
+            if run_num:
+                result_files += [(i, r, "%s_run_%s_%s.json" % (job_name, r, i.name)) for r in range(1, run_num + 1)]
+            else:
+                result_files.append((i, 1, "%s_%s.json" % (job_name, i.name)))
+        result_files = [(i, r, os.path.join(args.results, f)) for i, r, f in result_files]
+
+        if results_db:
+            workload = {"block_size": block_size, "io_depth": io_depth, "rw": rw, "rwmixread": fio_rw_mix_read,
+                        "num_jobs": fio_num_jobs, "rate_iops": rate_iops}
+            for i, r, result_file in result_files:
+                try:
+                    results_db.add_run(db_session, i.name, workload, r, result_file)
+                except (OSError, ValueError, KeyError) as e:
+                    i.log_print("ERROR: Failed to store %s results in the database: %s" % (result_file, e))
+        return result_files
+
+    def run_sweep(block_size, rw, io_depth):
+        # Find the knee of the latency/throughput curve, sweeping either rate_iops or qd
+        param = fio_sweep["param"]
+        curve_name = "_".join([str(block_size), str(rw)] + ([str(io_depth)] if param == "rate_iops" else []))
+        target_obj.log_print("Sweeping %s for %s" % (param, curve_name))
+
+        def measure(load):
+            if param == "rate_iops":
+                result_files = run_workload(block_size, io_depth, rw, load, None)
+            else:
+                result_files = run_workload(block_size, load, rw, fio_rate_iops, None)
+            return summarize_fio_results([f for _, _, f in result_files])
+
+        sweep = LoadSweep(measure, fio_sweep["start"], fio_sweep["max"], fio_sweep["slo_p99_us"],
+                          fio_sweep.get("resolution", 0.05), fio_sweep.get("min_efficiency", 0.5),
+                          log=target_obj.log_print)
+        sweep.run()
+        curve_file = os.path.join(args.results, "%s_sweep_%s.csv" % (curve_name, param))
+        sweep.write_curve(curve_file)
+        target_obj.log_print("Sweep curve saved in %s" % curve_file)
+
     # TODO: This try block is definietly too large. Need to break this up into separate
     # logical blocks to reduce size.
     try:
         target_obj.tgt_start()
 
-        for i in initiators:
-            i.discover_subsystems(i.target_nic_ips, target_obj.subsys_no)
-            if i.enable_adq:
-                i.adq_configure_tc()
+        if results_db:
+            db_session = results_db.add_session(get_git_sha(target_obj.spdk_dir), db_config)
+
+        run_parallel(setup_initiator, initiators)
 
         # Poor mans threading
         # Run FIO tests
-        for block_size, io_depth, rw in fio_workloads:
-            threads = []
-            configs = []
-            for i in initiators:
-                if i.mode == "kernel":
-                    i.kernel_init_connect()
-
-                cfg = i.gen_fio_config(rw, fio_rw_mix_read, block_size, io_depth, target_obj.subsys_no,
-                                       fio_num_jobs, fio_ramp_time, fio_run_time, fio_rate_iops)
-                configs.append(cfg)
-
-            for i, cfg in zip(initiators, configs):
-                t = threading.Thread(target=i.run_fio, args=(cfg, fio_run_num))
-                threads.append(t)
-            if target_obj.enable_sar:
-                sar_file_name = "_".join([str(block_size), str(rw), str(io_depth), "sar"])
-                sar_file_name = ".".join([sar_file_name, "txt"])
-                t = threading.Thread(target=target_obj.measure_sar, args=(args.results, sar_file_name))
-                threads.append(t)
-
-            if target_obj.enable_pcm:
-                pcm_fnames = ["%s_%s_%s_%s.csv" % (block_size, rw, io_depth, x) for x in ["pcm_cpu", "pcm_memory", "pcm_power"]]
-
-                pcm_cpu_t = threading.Thread(target=target_obj.measure_pcm, args=(args.results, pcm_fnames[0],))
-                pcm_mem_t = threading.Thread(target=target_obj.measure_pcm_memory, args=(args.results, pcm_fnames[1],))
-                pcm_pow_t = threading.Thread(target=target_obj.measure_pcm_power, args=(args.results, pcm_fnames[2],))
-
-                threads.append(pcm_cpu_t)
-                threads.append(pcm_mem_t)
-                threads.append(pcm_pow_t)
-
-            if target_obj.enable_bandwidth:
-                bandwidth_file_name = "_".join(["bandwidth", str(block_size), str(rw), str(io_depth)])
-                bandwidth_file_name = ".".join([bandwidth_file_name, "csv"])
-                t = threading.Thread(target=target_obj.measure_network_bandwidth, args=(args.results, bandwidth_file_name,))
-                threads.append(t)
-
-            if target_obj.enable_dpdk_memory:
-                t = threading.Thread(target=target_obj.measure_dpdk_memory, args=(args.results))
-                threads.append(t)
-
-            if target_obj.enable_adq:
-                ethtool_thread = threading.Thread(target=target_obj.ethtool_after_fio_ramp, args=(fio_ramp_time,))
-                threads.append(ethtool_thread)
-
-            for t in threads:
-                t.start()
-            for t in threads:
-                t.join()
-
-            for i in initiators:
-                if i.mode == "kernel":
-                    i.kernel_init_disconnect()
-                i.copy_result_files(args.results)
-
-        target_obj.restore_governor()
-        target_obj.restore_tuned()
-        target_obj.restore_services()
-        target_obj.restore_sysctl()
-        for i in initiators:
-            i.restore_governor()
-            i.restore_tuned()
-            i.restore_services()
-            i.restore_sysctl()
+        if fio_sweep is None:
+            for block_size, io_depth, rw in fio_workloads:
+                run_workload(block_size, io_depth, rw, fio_rate_iops, fio_run_num)
+        elif fio_sweep["param"] == "rate_iops":
+            for block_size, io_depth, rw in fio_workloads:
+                run_sweep(block_size, rw, io_depth)
+        else:
+            for block_size, rw in OrderedDict.fromkeys((bs, rw) for bs, _, rw in fio_workloads):
+                run_sweep(block_size, rw, None)
+
+        run_parallel(restore, [target_obj, *initiators])
         target_obj.parse_results(args.results, args.csv_filename)
     finally:
         for i in initiators:
@@ -1578,3 +1693,5 @@ if __name__ == "__main__":
             except Exception as err:
                 pass
         target_obj.stop()
+        if results_db:
+            results_db.close()
@@ -0,0 +1,114 @@
+import os
+import sys
+import csv
+
+sys.path.append(os.path.dirname(__file__) + '/..')
+
+from fio_results import FioStats, read_fio_results  # noqa
+
+CURVE_HEADERS = ["load", "iops", "bw", "avg_lat_us", "p50_lat_us", "p99_lat_us", "p99.9_lat_us", "p99.99_lat_us",
+                 "within_slo", "knee"]
+PERCENTILES = [50, 99, 99.9, 99.99]
+
+
+def summarize_fio_results(result_files):
+    """Combine fio results of all initiators taking part in a single run: throughput is
+    summed and latency percentiles are computed from the merged read and write clat histograms,
+    or approximated from the reported percentiles if some results have no histograms."""
+    merged = FioStats.merge(read_fio_results(result_files).stats.values())
+    point = {"iops": merged.iops, "bw": merged.bw, "avg_lat_us": merged.lat_mean}
+    for p, value in zip(PERCENTILES, merged.percentiles(PERCENTILES)):
+        point["p%s_lat_us" % p] = float(value)
+    return point
+
+
+class LoadSweep:
+    """Finds the knee of the latency/throughput curve of a workload.
+
+    Offered load (fio rate_iops or iodepth) is doubled, starting at start, until
+    either p99 latency passes slo_p99_us, throughput stops scaling with load or
+    max_load is reached. The knee, i.e. the highest load still within the SLO at
+    which throughput scales, is then found by bisection between the last good and
+    the first bad load, down to resolution (a fraction of load, but at least 1).
+    Throughput is considered to scale if its relative gain is at least
+    min_efficiency times the relative gain in load.
+
+    measure(load) runs the workload and returns its summary, as returned by
+    summarize_fio_results(). All the measured points make up the curve.
+    """
+
+    def __init__(self, measure, start, max_load, slo_p99_us, resolution=0.05, min_efficiency=0.5, log=print):
+        self.measure = measure
+        self.start = start
+        self.max_load = max_load
+        self.slo_p99_us = slo_p99_us
+        self.resolution = resolution
+        self.min_efficiency = min_efficiency
+        self.log = log
+        self.points = {}
+        self.knee = None
+
+    def _measure(self, load):
+        if load not in self.points:
+            point = self.measure(load)
+            point["load"] = load
+            point["within_slo"] = point["p99_lat_us"] <= self.slo_p99_us
+            self.points[load] = point
+            self.log("Sweep: load %s: %.0f IOPS, p99 %.3f us%s" %
+                     (load, point["iops"], point["p99_lat_us"], "" if point["within_slo"] else " (over SLO)"))
+        return self.points[load]
+
+    def _scales(self, base, point):
+        if base is None:
+            return True
+        if not base["iops"]:
+            return point["iops"] > 0
+        iops_gain = (point["iops"] - base["iops"]) / base["iops"]
+        load_gain = (point["load"] - base["load"]) / base["load"]
+        return iops_gain >= self.min_efficiency * load_gain
+
+    def _is_good(self, base, point):
+        return point["within_slo"] and self._scales(base, point)
+
+    def _converged(self, good, bad):
+        return bad - good <= max(1, self.resolution * good)
+
+    def run(self):
+        good, bad = None, None
+        load = self.start
+        while True:
+            point = self._measure(load)
+            if not self._is_good(self.points.get(good), point):
+                bad = load
+                break
+            good = load
+            if load >= self.max_load:
+                break
+            load = min(load * 2, self.max_load)
+
+        # Nothing within the SLO: the knee is below the starting load
+        if good is None:
+            self.log("Sweep: SLO not met even at the starting load %s" % self.start)
+            return self.curve()
+
+        while bad is not None and not self._converged(good, bad):
+            mid = (good + bad) // 2
+            if self._is_good(self.points[good], self._measure(mid)):
+                good = mid
+            else:
+                bad = mid
+
+        self.knee = good
+        self.log("Sweep: knee at load %s: %.0f IOPS, p99 %.3f us" %
+                 (good, self.points[good]["iops"], self.points[good]["p99_lat_us"]))
+        return self.curve()
+
+    def curve(self):
+        return [dict(self.points[load], knee=load == self.knee) for load in sorted(self.points)]
+
+    def write_curve(self, path):
+        with open(path, "w") as fh:
+            writer = csv.DictWriter(fh, CURVE_HEADERS, extrasaction="ignore")
+            writer.writeheader()
+            for point in self.curve():
+                writer.writerow({k: "{0:.3f}".format(v) if isinstance(v, float) else v for k, v in point.items()})
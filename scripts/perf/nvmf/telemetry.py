@@ -0,0 +1,227 @@
+import os
+import re
+import sys
+import time
+import subprocess
+from collections import OrderedDict
+
+import pandas as pd
+
+sys.path.append(os.path.dirname(__file__) + '/../..')
+sys.path.append(os.path.dirname(__file__) + '/../../../python')
+
+import spdk.rpc as rpc  # noqa
+from dpdk_mem_info import parse_mem_stats, get_mem_stats_sample  # noqa
+
+
+class TelemetrySampler:
+    """Samples system and SPDK target statistics at a fixed interval into a single table.
+
+    Each row holds one sample, taken at the same time for all the sources, so that
+    e.g. a throughput dip can be correlated with CPU, NIC and reactor state:
+
+    - cpu.* - CPU utilization in percent, from /proc/stat (as reported by sar)
+    - net.<nic>.* - NIC throughput in MiB/s and packets/s, from /proc/net/dev
+    - thread.<name>.* - SPDK thread utilization (thread_get_stats)
+    - bdev.<name>.* - bdev IOPS, MiB/s and average latency (bdev_get_iostat)
+    - nvmf.* - NVMe-oF poll group and transport statistics (nvmf_get_stats)
+    - dpdk.* - DPDK heap and mempool usage (env_dpdk_get_mem_stats)
+    - pcm.*, pcm_memory.*, pcm_power.* - PCM metrics, if PCM is enabled
+
+    Counters are converted to per second rates (or utilization) over the preceding interval,
+    gauges (e.g. nvmf current_io_qpairs or pending_bdev_io) are reported as sampled.
+    PCM tools run as separate processes for the whole sampling period and their output is
+    joined to the nearest sample afterwards. They take the place of the target's own
+    measure_pcm* runs, as only one PCM instance can use the performance counters at a time.
+    """
+
+    FORMATS = ("csv", "parquet")
+    PCM_TOOLS = ("pcm", "pcm-memory", "pcm-power")
+
+    def __init__(self, target, interval, count):
+        self.target = target
+        self.interval = interval
+        self.count = count
+        self.nics = [target.get_nic_name_by_ip(ip) for ip in target.nic_ips]
+        self.client = getattr(target, "client", None)
+        self.sources = OrderedDict([("cpu", self.sample_cpu), ("net", self.sample_net)])
+        if self.client:
+            self.sources.update([("thread", self.sample_threads), ("bdev", self.sample_bdevs),
+                                 ("nvmf", self.sample_nvmf), ("dpdk", self.sample_dpdk_memory)])
+        self._last = {}
+
+    def _rates(self, source, counters, now):
+        # Convert cumulative counters to per second rates against the previous sample
+        last_time, last = self._last.get(source, (None, {}))
+        self._last[source] = (now, counters)
+        if last_time is None:
+            return {}
+        elapsed = now - last_time
+        return {k: (v - last[k]) / elapsed for k, v in counters.items() if k in last}
+
+    def sample_cpu(self, now):
+        counters = {}
+        with open("/proc/stat", "r") as fh:
+            for line in fh:
+                if not line.startswith("cpu"):
+                    break
+                fields = line.split()
+                # user nice system idle iowait irq softirq steal; guest time is included in user
+                ticks = [int(x) for x in fields[1:9]]
+                cpu = fields[0][3:] or "all"
+                counters["cpu.%s.idle" % cpu] = ticks[3] + ticks[4]
+                counters["cpu.%s.total" % cpu] = sum(ticks)
+
+        rates = self._rates("cpu", counters, now)
+        row = {}
+        for key, total in rates.items():
+            if key.endswith(".total") and total:
+                cpu = key[:-len(".total")]
+                row["%s.busy" % cpu] = 100 * (1 - rates["%s.idle" % cpu] / total)
+        return row
+
+    def sample_net(self, now):
+        counters = {}
+        with open("/proc/net/dev", "r") as fh:
+            for line in fh.readlines()[2:]:
+                nic, fields = line.split(":", 1)
+                nic = nic.strip()
+                if nic not in self.nics:
+                    continue
+                fields = [int(x) for x in fields.split()]
+                counters.update({"net.%s.rx_mib" % nic: fields[0] / 2**20, "net.%s.rx_packets" % nic: fields[1],
+                                 "net.%s.tx_mib" % nic: fields[8] / 2**20, "net.%s.tx_packets" % nic: fields[9]})
+        return self._rates("net", counters, now)
+
+    def sample_threads(self, now):
+        counters = {}
+        for thread in rpc.app.thread_get_stats(self.client)["threads"]:
+            counters["thread.%s.busy" % thread["name"]] = thread["busy"]
+            counters["thread.%s.total" % thread["name"]] = thread["busy"] + thread["idle"]
+
+        rates = self._rates("thread", counters, now)
+        row = {}
+        for key, total in rates.items():
+            if key.endswith(".total"):
+                name = key[:-len(".total")]
+                row["%s.busy" % name] = 100 * rates["%s.busy" % name] / total if total else 0.0
+        return row
+
+    def sample_bdevs(self, now):
+        stats = rpc.bdev.bdev_get_iostat(self.client)
+        counters = {}
+        for bdev in stats["bdevs"]:
+            for op in ["read", "write"]:
+                prefix = "bdev.%s.%s" % (bdev["name"], op)
+                counters.update({"%s_iops" % prefix: bdev["num_%s_ops" % op],
+                                 "%s_mib" % prefix: bdev["bytes_%s" % op] / 2**20,
+                                 "%s_lat_us" % prefix: bdev["%s_latency_ticks" % op] * 10**6 / stats["tick_rate"]})
+
+        rates = self._rates("bdev", counters, now)
+        for key in [k for k in rates if k.endswith("_lat_us")]:
+            # Average latency of the IO completed during the interval
+            ops = rates[key.replace("_lat_us", "_iops")]
+            rates[key] = rates[key] / ops if ops else 0.0
+        return rates
+
+    def sample_nvmf(self, now):
+        row, counters = {}, {}
+
+        def add(prefix, stats):
+            for key, value in stats.items():
+                if not isinstance(value, (int, float)) or isinstance(value, bool):
+                    continue
+                # current_* and pending_* values are gauges, the rest are cumulative counters
+                if key.startswith(("current_", "pending_")):
+                    row["%s.%s" % (prefix, key)] = value
+                else:
+                    counters["%s.%s" % (prefix, key)] = value
+
+        for group in rpc.nvmf.nvmf_get_stats(self.client)["poll_groups"]:
+            add("nvmf.%s" % group["name"], group)
+            for transport in group.get("transports", []):
+                add("nvmf.%s.%s" % (group["name"], transport["trtype"]), transport)
+        row.update(self._rates("nvmf", counters, now))
+        return row
+
+    def sample_dpdk_memory(self, now):
+        dump_file = rpc.env_dpdk.env_dpdk_get_mem_stats(self.client)["filename"]
+        sample = get_mem_stats_sample(parse_mem_stats(dump_file), now)
+        row = {}
+        for heap_id, (busy, free, largest_free, fragmentation) in sample["heaps"].items():
+            row.update({"dpdk.heap%s.busy" % heap_id: busy, "dpdk.heap%s.free" % heap_id: free,
+                        "dpdk.heap%s.largest_free" % heap_id: largest_free,
+                        "dpdk.heap%s.fragmentation" % heap_id: fragmentation})
+        for name, (size, used) in sample["mempools"].items():
+            if used is not None:
+                row["dpdk.mempool.%s.used_objs" % name] = used
+        return row
+
+    def sample(self):
+        now = time.time()
+        row = OrderedDict([("time", now)])
+        for name in list(self.sources):
+            try:
+                row.update(self.sources[name](now))
+            except Exception as e:
+                self.target.log_print("WARNING: failed to sample %s statistics, disabling them: %s" % (name, e))
+                del self.sources[name]
+        return row
+
+    def start_pcm(self, results_dir, file_name):
+        procs = []
+        for tool in self.PCM_TOOLS:
+            name = tool.replace("-", "_")
+            csv_file = os.path.join(results_dir, "%s_%s.csv" % (file_name, name))
+            cmd = ["%s/%s.x" % (self.target.pcm_dir, tool), "%s" % self.interval, "-csv=%s" % csv_file]
+            procs.append((name, csv_file, subprocess.Popen(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)))
+        return procs
+
+    def read_pcm(self, name, csv_file):
+        df = pd.read_csv(csv_file, header=[0, 1])
+        df.columns = [".".join([x for x in c if not re.match(r"Unnamed:", x)]) for c in df.columns]
+        date_col, time_col = [c for c in df.columns if c.endswith("Date")][0], [c for c in df.columns if c.endswith("Time")][0]
+        timestamps = pd.to_datetime(df[date_col] + " " + df[time_col])
+        df = df.drop(columns=[date_col, time_col])
+        df.columns = ["%s.%s" % (name, c) for c in df.columns]
+        # PCM writes local time, convert it to the same epoch based time as the samples
+        df.insert(0, "time", [time.mktime(t.timetuple()) + t.microsecond / 10**6 for t in timestamps])
+        return df
+
+    def run(self, results_dir, file_name):
+        """Take count samples and write them to results_dir/file_name, in one of FORMATS
+        chosen by its extension. Parquet requires pyarrow."""
+        self.target.log_print("INFO: starting telemetry sampling")
+        base_name, _ = os.path.splitext(file_name)
+        pcm = self.start_pcm(results_dir, base_name) if self.target.enable_pcm else []
+
+        rows = []
+        # Initial sample, it only serves as the base for counter rates
+        self.sample()
+        start = time.time()
+        try:
+            for n in range(1, self.count + 1):
+                # Schedule samples against the start time to avoid drift
+                time.sleep(max(0, start + n * self.interval - time.time()))
+                rows.append(self.sample())
+        finally:
+            for _, _, proc in pcm:
+                proc.terminate()
+                proc.wait()
+
+        df = pd.DataFrame(rows)
+        for name, csv_file, _ in pcm:
+            try:
+                df = pd.merge_asof(df, self.read_pcm(name, csv_file), on="time", direction="nearest",
+                                   tolerance=self.interval)
+            except Exception as e:
+                self.target.log_print("WARNING: failed to read %s results from %s: %s" % (name, csv_file, e))
+        df.insert(1, "elapsed", df["time"] - start)
+
+        path = os.path.join(results_dir, file_name)
+        if file_name.endswith(".parquet"):
+            df.to_parquet(path, index=False)
+        else:
+            df.to_csv(path, index=False, float_format="%.3f")
+        self.target.log_print("INFO: telemetry written to %s" % path)
+        return df
@@ -0,0 +1,214 @@
+#!/usr/bin/env python3
+"""Control-plane scale benchmark of the SPDK Python tooling.
+
+For each configuration size a mock target (mock_tgt.py) is started in a separate
+process with N malloc bdevs, N/10 lvols and N/10 NVMe-oF subsystems, and common
+operations are executed against it through spdk.rpc: small requests, listing the
+whole configuration, creating and deleting objects (one at a time and pipelined),
+save_config and load_config and, optionally, building the SPDKCLI tree.
+
+For every operation calls/sec, median and p99 latency and the peak memory
+allocated by Python while executing it (tracemalloc) are reported. Since the
+mock answers from memory, the results reflect the cost of the tooling itself:
+JSON (de)serialization, socket handling and data processing.
+"""
+
+import argparse
+import io
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.append(os.path.dirname(__file__) + '/../../../python')
+
+import spdk.rpc as rpc  # noqa
+from spdk.rpc.client import JSONRPCClient  # noqa
+
+MOCK_TGT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "mock_tgt.py")
+HEADERS = ["objects", "operation", "calls", "calls/s", "p50_ms", "p99_ms", "peak_mem_kib"]
+
+
+class MockTargetProcess:
+    """mock_tgt.py running in its own process, so it doesn't compete for the GIL with the measured code"""
+
+    def __init__(self, socket_path, latency=0.0, object_latency=0.0, wait_for_rpc=False, bdevs=0, lvols=0,
+                 subsystems=0, iops=0):
+        cmd = [sys.executable, MOCK_TGT, "-s", socket_path, "-l", str(latency), "-L", str(object_latency),
+               "--bdevs", str(bdevs), "--lvols", str(lvols), "--subsystems", str(subsystems), "--iops", str(iops)]
+        if wait_for_rpc:
+            cmd.append("--wait-for-rpc")
+        self.socket_path = socket_path
+        self.proc = subprocess.Popen(cmd, stdout=subprocess.PIPE)
+        # The target prints its banner once it's populated and listening
+        if not self.proc.stdout.readline():
+            raise RuntimeError("Mock target failed to start")
+
+    def client(self, timeout=600.0):
+        return JSONRPCClient(self.socket_path, timeout=timeout)
+
+    def stop(self):
+        self.proc.terminate()
+        self.proc.wait()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exception_type, exception_value, traceback):
+        self.stop()
+
+
+def percentile(sorted_values, p):
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * p / 100))]
+
+
+def measure(objects, name, func, iterations):
+    """Call func iterations times, timing each call, then once more under tracemalloc"""
+    latencies = []
+    start = time.perf_counter()
+    for i in range(iterations):
+        t = time.perf_counter()
+        func(i)
+        latencies.append(time.perf_counter() - t)
+    elapsed = time.perf_counter() - start
+
+    tracemalloc.start()
+    func(iterations)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    latencies.sort()
+    result = {"objects": objects, "operation": name, "calls": iterations, "calls/s": iterations / elapsed,
+              "p50_ms": percentile(latencies, 50) * 1000, "p99_ms": percentile(latencies, 99) * 1000,
+              "peak_mem_kib": peak / 1024}
+    print("%8d %-40s %8d %10.1f %10.3f %10.3f %12.1f" % tuple(result[h] for h in HEADERS), flush=True)
+    return result
+
+
+def pipelined(client, requests, window):
+    """Send requests keeping up to window of them in flight, return the number of errors"""
+    errors = 0
+    in_flight = 0
+    for method, params in requests:
+        client.add_request(method, params)
+        in_flight += 1
+        if in_flight == window:
+            client.flush()
+            for _ in range(in_flight):
+                errors += "error" in client.recv()
+            in_flight = 0
+    if in_flight:
+        client.flush()
+        for _ in range(in_flight):
+            errors += "error" in client.recv()
+    return errors
+
+
+def bench_rpc(client, objects, args):
+    small = args.count
+    # Listing calls transfer the whole configuration, scale their number down with its size
+    large = max(3, min(args.count, 100000 // objects))
+    results = []
+
+    def run(name, func, iterations):
+        results.append(measure(objects, name, func, iterations))
+
+    run("spdk_get_version", lambda i: rpc.spdk_get_version(client), small)
+    run("bdev_get_bdevs (one)", lambda i: rpc.bdev.bdev_get_bdevs(client, name="Malloc%d" % (i % objects)), small)
+    run("bdev_get_bdevs (all)", lambda i: rpc.bdev.bdev_get_bdevs(client), large)
+    run("bdev_get_iostat (all)", lambda i: rpc.bdev.bdev_get_iostat(client), large)
+    run("bdev_lvol_get_lvstores", lambda i: rpc.lvol.bdev_lvol_get_lvstores(client), small)
+    run("nvmf_get_subsystems (all)", lambda i: rpc.nvmf.nvmf_get_subsystems(client), large)
+
+    def create_delete(i):
+        rpc.bdev.bdev_null_create(client, 1024, 512, "BenchNull%d" % i)
+        rpc.bdev.bdev_null_delete(client, "BenchNull%d" % i)
+    run("bdev_null_create+delete", create_delete, small)
+
+    def create_pipelined(i):
+        names = ["BenchNull%d_%d" % (i, n) for n in range(args.window * 4)]
+        errors = pipelined(client, [("bdev_null_create", {"name": n, "num_blocks": 1024, "block_size": 512})
+                                    for n in names], args.window)
+        errors += pipelined(client, [("bdev_null_delete", {"name": n}) for n in names], args.window)
+        assert errors == 0
+    run("bdev_null_create+delete x%d (pipelined)" % (args.window * 4), create_pipelined, max(3, small // 100))
+
+    run("save_config", lambda i: rpc.save_config(client, io.StringIO()), large)
+    return results
+
+
+def bench_load_config(objects, config, args):
+    """Replay a saved configuration into a fresh target waiting for framework_start_init"""
+    results = []
+
+    def load(i):
+        with MockTargetProcess(args.socket, wait_for_rpc=True) as target:
+            with target.client() as client:
+                rpc.load_config(client, io.StringIO(config))
+
+    results.append(measure(objects, "load_config", load, 3))
+    return results
+
+
+def bench_spdkcli(client, objects, args):
+    from configshell_fb import ConfigShell
+    from spdk.spdkcli import UIRoot
+
+    shell = ConfigShell(tempfile.mkdtemp())
+
+    def materialize(node):
+        for child in node.children:
+            materialize(child)
+
+    def build(i):
+        root = UIRoot(client, shell)
+        root.refresh()
+        root.stop_prefetch()
+        materialize(root)
+
+    return [measure(objects, "spdkcli build tree", build, 3)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark SPDK control-plane tooling against a mock target")
+    parser.add_argument("-n", "--objects", type=int, nargs="+", default=[1000, 10000, 100000],
+                        help="Configuration sizes (number of malloc bdevs). Default: 1000 10000 100000")
+    parser.add_argument("-c", "--count", type=int, default=1000,
+                        help="Number of calls of per-object operations. Default: 1000")
+    parser.add_argument("-w", "--window", type=int, default=64,
+                        help="Number of requests in flight in pipelined operations. Default: 64")
+    parser.add_argument("-l", "--latency", type=float, default=0.0,
+                        help="Processing time of each request on the target in seconds. Default: 0")
+    parser.add_argument("-L", "--object-latency", type=float, default=0.0,
+                        help="Target processing time per returned object in seconds. Default: 0")
+    parser.add_argument("-s", dest="socket", default="/var/tmp/spdk_mock_bench.sock",
+                        help="Mock target socket path")
+    parser.add_argument("--load-config", action="store_true", help="Also measure load_config of the saved configuration")
+    parser.add_argument("--spdkcli", action="store_true", help="Also measure building of the SPDKCLI tree")
+    parser.add_argument("-j", "--json", dest="json_file", help="Write the results to a JSON file")
+    args = parser.parse_args()
+
+    print("%8s %-40s %8s %10s %10s %10s %12s" % tuple(HEADERS))
+    results = []
+    for objects in args.objects:
+        with MockTargetProcess(args.socket, args.latency, args.object_latency, bdevs=objects,
+                               lvols=objects // 10, subsystems=objects // 10) as target:
+            with target.client() as client:
+                results += bench_rpc(client, objects, args)
+                if args.spdkcli:
+                    results += bench_spdkcli(client, objects, args)
+                config = io.StringIO()
+                rpc.save_config(client, config)
+        if args.load_config:
+            results += bench_load_config(objects, config.getvalue(), args)
+
+    if args.json_file:
+        with open(args.json_file, "w") as fh:
+            json.dump(results, fh, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+"""Load benchmark of scripts/rpc_http_proxy.py.
+
+Starts a mock target (mock_tgt.py) and the proxy in front of it, then drives the
+proxy from a number of concurrent HTTP clients, each running in its own process.
+Every client sends POST requests with a single JSON-RPC request or a batch of them
+(-b) over a keep-alive connection, or over a new connection per request
+(--no-keepalive). For each level of concurrency calls/sec and latency percentiles
+of HTTP requests are reported.
+"""
+
+import argparse
+import base64
+import http.client
+import json
+import multiprocessing
+import os
+import subprocess
+import sys
+import time
+
+from control_plane_bench import MockTargetProcess, percentile
+
+PROXY = os.path.join(os.path.dirname(os.path.abspath(__file__)), "../../rpc_http_proxy.py")
+USER, PASSWORD = "bench", "bench"
+HEADERS = ["clients", "requests", "calls/s", "p50_ms", "p99_ms", "errors"]
+
+
+def make_requests(method, batch, objects, n):
+    requests = []
+    for i in range(batch):
+        params = {"name": "Malloc%d" % ((n * batch + i) % objects)} if method == "bdev_get_bdevs" else None
+        request = {"jsonrpc": "2.0", "id": i, "method": method}
+        if params:
+            request["params"] = params
+        requests.append(request)
+    return json.dumps(requests if batch > 1 else requests[0])
+
+
+def client_worker(args, start_time, results):
+    headers = {"Authorization": "Basic " + base64.b64encode(("%s:%s" % (USER, PASSWORD)).encode()).decode(),
+               "Content-Type": "application/json"}
+    conn = None
+    latencies = []
+    errors = 0
+    # Start all the clients at the same time
+    time.sleep(max(0, start_time - time.time()))
+    end = time.perf_counter() + args.duration
+    n = 0
+    while time.perf_counter() < end:
+        body = make_requests(args.method, args.batch, args.objects, n)
+        t = time.perf_counter()
+        try:
+            if conn is None:
+                conn = http.client.HTTPConnection(args.host, args.port, timeout=60)
+            conn.request("POST", "/", body=body, headers=headers)
+            response = conn.getresponse()
+            data = response.read()
+        except (OSError, http.client.HTTPException):
+            # Count failed requests instead of losing the results of the client
+            errors += args.batch
+            conn.close()
+            conn = None
+            continue
+        finally:
+            latencies.append(time.perf_counter() - t)
+            n += 1
+        if response.status != 200:
+            errors += args.batch
+        else:
+            responses = json.loads(data)
+            errors += sum("error" in r for r in (responses if isinstance(responses, list) else [responses]))
+        if not args.keepalive:
+            conn.close()
+            conn = None
+    results.put((latencies, errors))
+
+
+def run(args, clients):
+    results = multiprocessing.Queue()
+    start_time = time.time() + 0.5
+    procs = [multiprocessing.Process(target=client_worker, args=(args, start_time, results)) for _ in range(clients)]
+    for proc in procs:
+        proc.start()
+    latencies = []
+    errors = 0
+    for _ in procs:
+        lat, err = results.get()
+        latencies += lat
+        errors += err
+    for proc in procs:
+        proc.join()
+    latencies.sort()
+    return {"clients": clients, "requests": len(latencies), "calls/s": len(latencies) * args.batch / args.duration,
+            "p50_ms": percentile(latencies, 50) * 1000, "p99_ms": percentile(latencies, 99) * 1000,
+            "errors": errors}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark rpc_http_proxy.py with concurrent HTTP clients")
+    parser.add_argument("-c", "--clients", type=int, nargs="+", default=[1, 4, 16, 64],
+                        help="Numbers of concurrent HTTP clients. Default: 1 4 16 64")
+    parser.add_argument("-d", "--duration", type=float, default=5.0, help="Duration of each run in seconds. Default: 5")
+    parser.add_argument("-m", "--method", default="bdev_get_bdevs", choices=["bdev_get_bdevs", "spdk_get_version"],
+                        help="Method to call; bdev_get_bdevs queries a single bdev. Default: bdev_get_bdevs")
+    parser.add_argument("-b", "--batch", type=int, default=1, help="Number of JSON-RPC requests per HTTP request. Default: 1")
+    parser.add_argument("-n", "--connections", type=int, default=8,
+                        help="Proxy's maximum number of connections to the target. Default: 8")
+    parser.add_argument("-N", "--objects", type=int, default=1000, help="Number of bdevs on the mock target. Default: 1000")
+    parser.add_argument("-l", "--latency", type=float, default=0.0,
+                        help="Processing time of each request on the target in seconds. Default: 0")
+    parser.add_argument("--no-keepalive", dest="keepalive", action="store_false",
+                        help="Open a new HTTP connection for each request")
+    parser.add_argument("--port", type=int, default=8765, help="Proxy port. Default: 8765")
+    parser.add_argument("-s", dest="socket", default="/var/tmp/spdk_mock_bench.sock", help="Mock target socket path")
+    parser.add_argument("-j", "--json", dest="json_file", help="Write the results to a JSON file")
+    args = parser.parse_args()
+    args.host = "127.0.0.1"
+
+    with MockTargetProcess(args.socket, args.latency, bdevs=args.objects):
+        proxy = subprocess.Popen([sys.executable, PROXY, args.host, str(args.port), USER, PASSWORD,
+                                  "-s", args.socket, "-n", str(args.connections)], stdout=subprocess.PIPE)
+        try:
+            if not proxy.stdout.readline():
+                raise RuntimeError("Proxy failed to start")
+            print("%8s %10s %10s %10s %10s %8s" % tuple(HEADERS))
+            results = []
+            for clients in args.clients:
+                result = run(args, clients)
+                results.append(result)
+                print("%8d %10d %10.1f %10.3f %10.3f %8d" % tuple(result[k] for k in HEADERS), flush=True)
+        finally:
+            proxy.terminate()
+            proxy.wait()
+
+    if args.json_file:
+        with open(args.json_file, "w") as fh:
+            json.dump(results, fh, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,630 @@
+#!/usr/bin/env python3
+"""Stand-in for spdk_tgt answering JSON-RPC requests on a UNIX domain socket.
+
+The mock keeps bdevs (malloc, null, lvol), lvol stores, NVMe-oF transports and
+subsystems in memory, so that the control-plane tooling (spdk.rpc, spdkcli, iostat,
+load_config, SMA) can be exercised at scale without SPDK or any hardware. Requests
+use the same framing as the SPDK RPC server: JSON objects, one after another, with
+each response written as soon as its request is processed. Like on spdk_tgt,
+requests are executed one at a time, as if they were all handled by the app thread.
+
+Objects returned by the listing methods have the same fields as on a real target,
+so that response sizes and parsing costs are representative. The latency of the
+target can be tuned with a fixed cost per request and a cost per returned object.
+"""
+
+import argparse
+import codecs
+import json
+import os
+import socketserver
+import sys
+import threading
+import time
+import uuid
+
+DEFAULT_SOCKET = "/var/tmp/spdk_mock.sock"
+
+# JSON-RPC and SPDK specific error codes, see include/spdk/jsonrpc.h
+INVALID_REQUEST = -32600
+METHOD_NOT_FOUND = -32601
+INVALID_PARAMS = -32602
+INTERNAL_ERROR = -32603
+INVALID_STATE = -32604
+ENODEV = -19
+EEXIST = -17
+
+STARTUP = 0x1
+RUNTIME = 0x2
+
+SUBSYSTEMS = [("accel", []), ("sock", []), ("iobuf", []), ("vmd", []), ("bdev", ["accel", "vmd", "iobuf"]),
+              ("nvmf", ["bdev", "sock"]), ("scheduler", [])]
+
+TICK_RATE = 2300000000
+# Number of notifications kept by the target (SPDK_NOTIFY_MAX_EVENTS)
+NOTIFY_MAX_EVENTS = 1024
+
+
+class RPCError(Exception):
+    def __init__(self, code, message):
+        super().__init__(message)
+        self.code = code
+        self.message = message
+
+
+def rpc_method(state_mask=RUNTIME):
+    """Mark a MockTarget method as an RPC handler, allowed in the given application states"""
+    def decorator(func):
+        func.state_mask = state_mask
+        return func
+    return decorator
+
+
+def _param(params, name, default=None, required=False):
+    if name not in params:
+        if required:
+            raise RPCError(INVALID_PARAMS, "Missing parameter: %s" % name)
+        return default
+    return params[name]
+
+
+class MockTarget:
+    """In-memory state and RPC methods of the mock target"""
+
+    def __init__(self, latency=0.0, object_latency=0.0, wait_for_rpc=False, iops=0):
+        self.latency = latency
+        self.object_latency = object_latency
+        self.iops = iops
+        self.initialized = not wait_for_rpc
+        self.start_time = time.monotonic()
+        self.lock = threading.Lock()
+        self.bdevs = {}
+        self.aliases = {}
+        self.lvstores = {}
+        self.transports = {}
+        self.subsystems = {}
+        self.notifications = []
+        self.requests = 0
+        self.methods = {name[len("rpc_"):]: getattr(self, name) for name in dir(self)
+                        if name.startswith("rpc_") and hasattr(getattr(self, name), "state_mask")}
+        self._add_subsystem("nqn.2014-08.org.nvmexpress.discovery", subtype="Discovery", allow_any_host=True)
+
+    def handle(self, request):
+        """Execute a single decoded request and return its response, or None for notifications"""
+        if not isinstance(request, dict) or request.get("jsonrpc") != "2.0" or \
+                not isinstance(request.get("method"), str):
+            return {"jsonrpc": "2.0", "id": None,
+                    "error": {"code": INVALID_REQUEST, "message": "Invalid request"}}
+
+        with self.lock:
+            self.requests += 1
+            start = time.perf_counter()
+            try:
+                result = self.call(request["method"], request.get("params") or {})
+                response = {"jsonrpc": "2.0", "id": request.get("id"), "result": result}
+            except RPCError as e:
+                result = None
+                response = {"jsonrpc": "2.0", "id": request.get("id"),
+                            "error": {"code": e.code, "message": e.message}}
+            delay = self.latency
+            if isinstance(result, list):
+                delay += self.object_latency * len(result)
+            if delay:
+                time.sleep(max(0, delay - (time.perf_counter() - start)))
+
+        return response if "id" in request else None
+
+    def call(self, method, params):
+        handler = self.methods.get(method)
+        if handler is None:
+            raise RPCError(METHOD_NOT_FOUND, "Method not found")
+        if not handler.state_mask & self.state:
+            raise RPCError(INVALID_STATE, "Method may only be called after framework is initialized "
+                           "using framework_start_init RPC." if not self.initialized else
+                           "Method may only be called before framework is initialized.")
+        if not isinstance(params, dict):
+            raise RPCError(INVALID_PARAMS, "Invalid parameters")
+        try:
+            return handler(params)
+        except (KeyError, TypeError, ValueError) as e:
+            raise RPCError(INVALID_PARAMS, "Invalid parameters: %s" % e)
+
+    @property
+    def state(self):
+        return RUNTIME if self.initialized else STARTUP
+
+    def _notify(self, notify_type, ctx):
+        self.notifications.append({"type": notify_type, "ctx": ctx, "id": len(self.notifications)})
+
+    # Object builders
+
+    def _add_bdev(self, name, product_name, num_blocks, block_size, bdev_uuid=None, aliases=None,
+                  driver_specific=None, module=None, params=None):
+        if name in self.bdevs or any(a in self.aliases for a in aliases or []):
+            raise RPCError(EEXIST, "File exists")
+        self.aliases.update((a, name) for a in aliases or [])
+        self.bdevs[name] = {
+            "name": name,
+            "aliases": aliases or [],
+            "product_name": product_name,
+            "block_size": block_size,
+            "num_blocks": num_blocks,
+            "uuid": bdev_uuid or str(uuid.uuid4()),
+            "assigned_rate_limits": {"rw_ios_per_sec": 0, "rw_mbytes_per_sec": 0,
+                                     "r_mbytes_per_sec": 0, "w_mbytes_per_sec": 0},
+            "claimed": False,
+            "zoned": False,
+            "supported_io_types": {"read": True, "write": True, "unmap": True, "write_zeroes": True,
+                                   "flush": True, "reset": True, "compare": False, "compare_and_write": False,
+                                   "abort": True, "nvme_admin": False, "nvme_io": False},
+            "driver_specific": driver_specific or {},
+            # Not part of bdev_get_bdevs output
+            "_module": module,
+            "_params": params,
+            "_created": time.monotonic(),
+        }
+        self._notify("bdev_register", name)
+        return name
+
+    def _get_bdev(self, name):
+        name = self.aliases.get(name, name)
+        if name not in self.bdevs:
+            raise RPCError(ENODEV, "No such device")
+        return self.bdevs[name]
+
+    def _delete_bdev(self, name, module):
+        bdev = self._get_bdev(name)
+        if bdev["_module"] != module:
+            raise RPCError(ENODEV, "No such device")
+        if bdev["claimed"]:
+            raise RPCError(-16, "Device or resource busy")
+        for alias in bdev["aliases"]:
+            del self.aliases[alias]
+        del self.bdevs[bdev["name"]]
+        self._notify("bdev_unregister", bdev["name"])
+        return True
+
+    @staticmethod
+    def _public(obj):
+        return {k: v for k, v in obj.items() if not k.startswith("_")}
+
+    def _add_subsystem(self, nqn, subtype="NVMe", serial_number="00000000000000000000",
+                       model_number="SPDK bdev Controller", allow_any_host=False, max_namespaces=0,
+                       min_cntlid=1, max_cntlid=0xffef):
+        if nqn in self.subsystems:
+            raise RPCError(INVALID_PARAMS, "Unable to create subsystem %s" % nqn)
+        self.subsystems[nqn] = {"nqn": nqn, "subtype": subtype, "listen_addresses": [],
+                                "allow_any_host": allow_any_host, "hosts": []}
+        if subtype == "NVMe":
+            self.subsystems[nqn].update({"serial_number": serial_number, "model_number": model_number,
+                                         "max_namespaces": max_namespaces, "min_cntlid": min_cntlid,
+                                         "max_cntlid": max_cntlid, "namespaces": []})
+        return True
+
+    def _get_subsystem(self, nqn):
+        if nqn not in self.subsystems:
+            raise RPCError(INVALID_PARAMS, "Unable to find subsystem with NQN %s" % nqn)
+        return self.subsystems[nqn]
+
+    # Framework
+
+    @rpc_method(STARTUP | RUNTIME)
+    def rpc_rpc_get_methods(self, params):
+        if params.get("current"):
+            return [name for name, handler in self.methods.items() if handler.state_mask & self.state]
+        return list(self.methods)
+
+    @rpc_method(STARTUP | RUNTIME)
+    def rpc_spdk_get_version(self, params):
+        return {"version": "SPDK v22.05-pre mock", "fields": {"major": 22, "minor": 5, "patch": 0,
+                                                              "suffix": "-pre", "commit": "mock"}}
+
+    @rpc_method(STARTUP)
+    def rpc_framework_start_init(self, params):
+        self.initialized = True
+        return True
+
+    @rpc_method(STARTUP | RUNTIME)
+    def rpc_framework_wait_init(self, params):
+        return True
+
+    @rpc_method(STARTUP | RUNTIME)
+    def rpc_framework_get_subsystems(self, params):
+        return [{"subsystem": name, "depends_on": deps} for name, deps in SUBSYSTEMS]
+
+    @rpc_method(STARTUP | RUNTIME)
+    def rpc_framework_get_config(self, params):
+        name = _param(params, "name", required=True)
+        if name not in dict(SUBSYSTEMS):
+            raise RPCError(INVALID_PARAMS, "Subsystem '%s' not found" % name)
+        if name == "bdev":
+            return [{"method": b["_module"], "params": b["_params"]} for b in self.bdevs.values()
+                    if b["_params"] is not None]
+        if name == "nvmf":
+            return self._nvmf_config()
+        return []
+
+    def _nvmf_config(self):
+        config = [{"method": "nvmf_create_transport", "params": dict(t)} for t in self.transports.values()]
+        for s in self.subsystems.values():
+            if s["subtype"] != "NVMe":
+                continue
+            config.append({"method": "nvmf_create_subsystem",
+                           "params": {"nqn": s["nqn"], "allow_any_host": s["allow_any_host"],
+                                      "serial_number": s["serial_number"], "model_number": s["model_number"],
+                                      "max_namespaces": s["max_namespaces"]}})
+            config.extend({"method": "nvmf_subsystem_add_listener",
+                           "params": {"nqn": s["nqn"], "listen_address": dict(a)}} for a in s["listen_addresses"])
+            config.extend({"method": "nvmf_subsystem_add_host", "params": {"nqn": s["nqn"], "host": h["nqn"]}}
+                          for h in s["hosts"])
+            config.extend({"method": "nvmf_subsystem_add_ns",
+                           "params": {"nqn": s["nqn"], "namespace": {"nsid": ns["nsid"], "bdev_name": ns["bdev_name"]}}}
+                          for ns in s["namespaces"])
+        return config
+
+    @rpc_method(STARTUP | RUNTIME)
+    def rpc_sock_impl_get_options(self, params):
+        return {"recv_buf_size": 2097152, "send_buf_size": 2097152, "enable_recv_pipe": True,
+                "enable_quickack": False, "enable_placement_id": 0, "enable_zerocopy_send_server": True,
+                "enable_zerocopy_send_client": False, "zerocopy_threshold": 0}
+
+    @rpc_method(STARTUP | RUNTIME)
+    def rpc_notify_get_types(self, params):
+        return ["bdev_register", "bdev_unregister"]
+
+    @rpc_method(STARTUP | RUNTIME)
+    def rpc_notify_get_notifications(self, params):
+        # Older notifications are overwritten, like in the ring of the real target
+        start = max(_param(params, "id", 0), len(self.notifications) - NOTIFY_MAX_EVENTS)
+        count = _param(params, "max", 0)
+        end = start + count if count else len(self.notifications)
+        return self.notifications[start:end]
+
+    @rpc_method()
+    def rpc_thread_get_stats(self, params):
+        # Threads are assumed to be fully busy polling while the target is under IO load
+        ticks = int((time.monotonic() - self.start_time) * TICK_RATE)
+        busy = ticks if self.iops else ticks // 100
+        threads = [{"name": "app_thread", "id": 1, "cpumask": "1", "busy": ticks // 100,
+                    "idle": ticks - ticks // 100, "active_pollers_count": 1, "timed_pollers_count": 2,
+                    "paused_pollers_count": 0}]
+        threads.extend({"name": "nvmf_tgt_poll_group_%d" % i, "id": i + 2, "cpumask": "%x" % (1 << i),
+                        "busy": busy, "idle": ticks - busy, "active_pollers_count": 2,
+                        "timed_pollers_count": 1, "paused_pollers_count": 0} for i in range(4 if self.transports else 0))
+        return {"tick_rate": TICK_RATE, "threads": threads}
+
+    # Bdevs
+
+    @rpc_method()
+    def rpc_bdev_get_bdevs(self, params):
+        name = _param(params, "name")
+        if name is not None:
+            return [self._public(self._get_bdev(name))]
+        return [self._public(b) for b in self.bdevs.values()]
+
+    @rpc_method()
+    def rpc_bdev_get_iostat(self, params):
+        now = time.monotonic()
+        name = _param(params, "name")
+        bdevs = [self._get_bdev(name)] if name is not None else self.bdevs.values()
+        stats = []
+        for bdev in bdevs:
+            # Simulated 70/30 random read/write workload running since the bdev was created
+            ops = int((now - bdev["_created"]) * self.iops)
+            reads, writes = ops * 7 // 10, ops - ops * 7 // 10
+            stats.append({"name": bdev["name"], "bytes_read": reads * 4096, "num_read_ops": reads,
+                          "bytes_written": writes * 4096, "num_write_ops": writes, "bytes_unmapped": 0,
+                          "num_unmap_ops": 0, "read_latency_ticks": reads * TICK_RATE // 10000,
+                          "write_latency_ticks": writes * TICK_RATE // 5000, "unmap_latency_ticks": 0,
+                          "queue_depth_polling_period": 0, "queue_depth": 0, "io_time": 0, "weighted_io_time": 0})
+        return {"tick_rate": TICK_RATE, "ticks": int((now - self.start_time) * TICK_RATE), "bdevs": stats}
+
+    @rpc_method()
+    def rpc_bdev_malloc_create(self, params):
+        name = _param(params, "name") or "Malloc%d" % sum(b["_module"] == "bdev_malloc_create"
+                                                          for b in self.bdevs.values())
+        return self._add_bdev(name, "Malloc disk", params["num_blocks"], params["block_size"], params.get("uuid"),
+                              module="bdev_malloc_create", params=dict(params, name=name))
+
+    @rpc_method()
+    def rpc_bdev_malloc_delete(self, params):
+        return self._delete_bdev(params["name"], "bdev_malloc_create")
+
+    @rpc_method()
+    def rpc_bdev_null_create(self, params):
+        return self._add_bdev(params["name"], "Null disk", params["num_blocks"], params["block_size"],
+                              params.get("uuid"), module="bdev_null_create", params=dict(params))
+
+    @rpc_method()
+    def rpc_bdev_null_delete(self, params):
+        return self._delete_bdev(params["name"], "bdev_null_create")
+
+    # Logical volumes
+
+    @rpc_method()
+    def rpc_bdev_lvol_create_lvstore(self, params):
+        base = self._get_bdev(params["bdev_name"])
+        if base["claimed"] or any(s["name"] == params["lvs_name"] for s in self.lvstores.values()):
+            raise RPCError(EEXIST, "File exists")
+        cluster_size = params.get("cluster_sz", 4 * 1024 * 1024)
+        clusters = base["num_blocks"] * base["block_size"] // cluster_size - 1
+        lvs_uuid = str(uuid.uuid4())
+        base["claimed"] = True
+        self.lvstores[lvs_uuid] = {"uuid": lvs_uuid, "name": params["lvs_name"], "base_bdev": base["name"],
+                                   "total_data_clusters": clusters, "free_clusters": clusters,
+                                   "block_size": base["block_size"], "cluster_size": cluster_size}
+        return lvs_uuid
+
+    def _get_lvstore(self, uuid=None, lvs_name=None):
+        for lvs in self.lvstores.values():
+            if lvs["uuid"] == uuid or lvs["name"] == lvs_name:
+                return lvs
+        raise RPCError(ENODEV, "No such device")
+
+    @rpc_method()
+    def rpc_bdev_lvol_get_lvstores(self, params):
+        if "uuid" in params or "lvs_name" in params:
+            return [self._get_lvstore(params.get("uuid"), params.get("lvs_name"))]
+        return list(self.lvstores.values())
+
+    @rpc_method()
+    def rpc_bdev_lvol_delete_lvstore(self, params):
+        lvs = self._get_lvstore(params.get("uuid"), params.get("lvs_name"))
+        for bdev in list(self.bdevs.values()):
+            if bdev["driver_specific"].get("lvol", {}).get("lvol_store_uuid") == lvs["uuid"]:
+                self._delete_bdev(bdev["name"], "bdev_lvol_create")
+        self.bdevs[lvs["base_bdev"]]["claimed"] = False
+        del self.lvstores[lvs["uuid"]]
+        return True
+
+    @rpc_method()
+    def rpc_bdev_lvol_create(self, params):
+        lvs = self._get_lvstore(params.get("uuid"), params.get("lvs_name"))
+        clusters = -(-params["size"] // lvs["cluster_size"])
+        thin = params.get("thin_provision", False)
+        if not thin:
+            if clusters > lvs["free_clusters"]:
+                raise RPCError(-28, "No space left on device")
+            lvs["free_clusters"] -= clusters
+        alias = "%s/%s" % (lvs["name"], params["lvol_name"])
+        lvol_uuid = params.get("uuid") or str(uuid.uuid4())
+        driver_specific = {"lvol": {"lvol_store_uuid": lvs["uuid"], "base_bdev": lvs["base_bdev"],
+                                    "thin_provision": thin, "snapshot": False, "clone": False}}
+        # Lvols are saved in the lvol store metadata, not in the bdev subsystem config
+        return self._add_bdev(lvol_uuid, "Logical Volume", clusters * lvs["cluster_size"] // lvs["block_size"],
+                              lvs["block_size"], lvol_uuid, [alias], driver_specific, module="bdev_lvol_create")
+
+    @rpc_method()
+    def rpc_bdev_lvol_delete(self, params):
+        bdev = self._get_bdev(params["name"])
+        lvol = bdev["driver_specific"].get("lvol", {})
+        lvs = self.lvstores.get(lvol.get("lvol_store_uuid"))
+        if lvs and not lvol["thin_provision"]:
+            lvs["free_clusters"] += bdev["num_blocks"] * bdev["block_size"] // lvs["cluster_size"]
+        return self._delete_bdev(bdev["name"], "bdev_lvol_create")
+
+    # NVMe-oF
+
+    @rpc_method()
+    def rpc_nvmf_create_transport(self, params):
+        trtype = params["trtype"].upper()
+        if trtype in self.transports:
+            raise RPCError(INVALID_PARAMS, "Transport type '%s' already exists" % trtype)
+        transport = {"trtype": trtype, "max_queue_depth": 128, "max_io_qpairs_per_ctrlr": 127,
+                     "in_capsule_data_size": 4096, "max_io_size": 131072, "io_unit_size": 131072,
+                     "max_aq_depth": 128, "num_shared_buffers": 511, "buf_cache_size": 32,
+                     "dif_insert_or_strip": False, "zcopy": False, "c2h_success": True,
+                     "sock_priority": 0, "abort_timeout_sec": 1}
+        transport.update((k, v) for k, v in params.items() if k not in ["trtype", "tgt_name"])
+        self.transports[trtype] = transport
+        return True
+
+    @rpc_method()
+    def rpc_nvmf_get_transports(self, params):
+        trtype = _param(params, "trtype")
+        if trtype is not None:
+            if trtype.upper() not in self.transports:
+                raise RPCError(INVALID_PARAMS, "Invalid parameters")
+            return [self.transports[trtype.upper()]]
+        return list(self.transports.values())
+
+    @rpc_method()
+    def rpc_nvmf_get_stats(self, params):
+        groups = [{"name": "nvmf_tgt_poll_group_%d" % i, "admin_qpairs": 0, "io_qpairs": 0,
+                   "current_admin_qpairs": 0, "current_io_qpairs": 0, "pending_bdev_io": 0,
+                   "transports": [{"trtype": t} for t in self.transports]} for i in range(4)]
+        return {"tick_rate": TICK_RATE, "poll_groups": groups}
+
+    @rpc_method()
+    def rpc_nvmf_create_subsystem(self, params):
+        return self._add_subsystem(params["nqn"], serial_number=params.get("serial_number", "00000000000000000000"),
+                                   model_number=params.get("model_number", "SPDK bdev Controller"),
+                                   allow_any_host=params.get("allow_any_host", False),
+                                   max_namespaces=params.get("max_namespaces", 0))
+
+    @rpc_method()
+    def rpc_nvmf_delete_subsystem(self, params):
+        subsystem = self._get_subsystem(params["nqn"])
+        for ns in subsystem.get("namespaces", []):
+            self.bdevs[ns["bdev_name"]]["claimed"] = False
+        del self.subsystems[params["nqn"]]
+        return True
+
+    @rpc_method()
+    def rpc_nvmf_get_subsystems(self, params):
+        nqn = _param(params, "nqn")
+        if nqn is not None:
+            return [self._get_subsystem(nqn)]
+        return list(self.subsystems.values())
+
+    @rpc_method()
+    def rpc_nvmf_subsystem_add_listener(self, params):
+        subsystem = self._get_subsystem(params["nqn"])
+        address = dict(params["listen_address"])
+        address["trtype"] = address["trtype"].upper()
+        if address["trtype"] not in self.transports:
+            raise RPCError(INVALID_PARAMS, "Invalid parameters")
+        address.setdefault("adrfam", "IPv4")
+        address["transport"] = address["trtype"]
+        if address in subsystem["listen_addresses"]:
+            raise RPCError(INVALID_PARAMS, "Invalid parameters")
+        subsystem["listen_addresses"].append(address)
+        return True
+
+    @rpc_method()
+    def rpc_nvmf_subsystem_add_host(self, params):
+        subsystem = self._get_subsystem(params["nqn"])
+        if any(h["nqn"] == params["host"] for h in subsystem["hosts"]):
+            raise RPCError(INTERNAL_ERROR, "Internal error")
+        subsystem["hosts"].append({"nqn": params["host"]})
+        return True
+
+    @rpc_method()
+    def rpc_nvmf_subsystem_add_ns(self, params):
+        subsystem = self._get_subsystem(params["nqn"])
+        namespace = params["namespace"]
+        bdev = self._get_bdev(namespace["bdev_name"])
+        if bdev["claimed"]:
+            raise RPCError(INVALID_PARAMS, "Invalid parameters")
+        nsids = set(ns["nsid"] for ns in subsystem["namespaces"])
+        nsid = namespace.get("nsid") or next(n for n in range(1, len(nsids) + 2) if n not in nsids)
+        if nsid in nsids or (subsystem["max_namespaces"] and nsid > subsystem["max_namespaces"]):
+            raise RPCError(INVALID_PARAMS, "Invalid parameters")
+        bdev["claimed"] = True
+        subsystem["namespaces"].append({"nsid": nsid, "bdev_name": bdev["name"], "name": bdev["name"],
+                                        "nguid": bdev["uuid"].replace("-", "").upper(), "uuid": bdev["uuid"]})
+        subsystem["namespaces"].sort(key=lambda ns: ns["nsid"])
+        return nsid
+
+    @rpc_method()
+    def rpc_nvmf_subsystem_remove_ns(self, params):
+        subsystem = self._get_subsystem(params["nqn"])
+        for ns in subsystem["namespaces"]:
+            if ns["nsid"] == params["nsid"]:
+                subsystem["namespaces"].remove(ns)
+                self.bdevs[ns["bdev_name"]]["claimed"] = False
+                return True
+        raise RPCError(INVALID_PARAMS, "Invalid parameters")
+
+    def populate(self, num_bdevs=0, num_lvols=0, num_subsystems=0):
+        """Create malloc bdevs, lvols on a dedicated lvol store and NVMe-oF subsystems,
+        each exporting one of the malloc bdevs, without going through the RPC server"""
+        for i in range(num_bdevs):
+            self.rpc_bdev_malloc_create({"name": "Malloc%d" % i, "num_blocks": 131072, "block_size": 512})
+        if num_lvols:
+            self.rpc_bdev_malloc_create({"name": "MallocLvs", "num_blocks": 2 ** 31 // 512, "block_size": 512})
+            self.rpc_bdev_lvol_create_lvstore({"bdev_name": "MallocLvs", "lvs_name": "lvs0", "cluster_sz": 65536})
+        for i in range(num_lvols):
+            self.rpc_bdev_lvol_create({"lvol_name": "lvol%d" % i, "size": 65536, "lvs_name": "lvs0",
+                                       "thin_provision": True})
+        if num_subsystems and "TCP" not in self.transports:
+            self.rpc_nvmf_create_transport({"trtype": "TCP"})
+        for i in range(num_subsystems):
+            nqn = "nqn.2016-06.io.spdk:cnode%d" % i
+            self.rpc_nvmf_create_subsystem({"nqn": nqn, "serial_number": "SPDK%014d" % i, "allow_any_host": True})
+            self.rpc_nvmf_subsystem_add_listener({"nqn": nqn, "listen_address": {
+                "trtype": "TCP", "adrfam": "IPv4", "traddr": "127.0.0.1", "trsvcid": "4420"}})
+            if i < num_bdevs:
+                self.rpc_nvmf_subsystem_add_ns({"nqn": nqn, "namespace": {"bdev_name": "Malloc%d" % i}})
+
+
+class _RequestHandler(socketserver.BaseRequestHandler):
+    def handle(self):
+        decoder = json.JSONDecoder()
+        utf8 = codecs.getincrementaldecoder("utf-8")()
+        buf = ""
+        while True:
+            try:
+                data = self.request.recv(65536)
+            except OSError:
+                return
+            if not data:
+                return
+            buf += utf8.decode(data)
+            responses = []
+            pos = 0
+            while True:
+                while pos < len(buf) and buf[pos].isspace():
+                    pos += 1
+                if pos == len(buf):
+                    break
+                try:
+                    request, pos = decoder.raw_decode(buf, pos)
+                except ValueError:
+                    # Incomplete request, wait for the rest of it
+                    break
+                if isinstance(request, list):
+                    response = {"jsonrpc": "2.0", "id": None,
+                                "error": {"code": INVALID_REQUEST, "message": "Batch requests are not supported"}}
+                else:
+                    response = self.server.target.handle(request)
+                if response is not None:
+                    responses.append(json.dumps(response))
+            buf = buf[pos:]
+            if responses:
+                try:
+                    self.request.sendall(("\n".join(responses) + "\n").encode())
+                except OSError:
+                    return
+
+
+class MockServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """UNIX domain socket server of a MockTarget, accepting any number of connections"""
+
+    daemon_threads = True
+    # Like spdk_tgt, don't refuse bursts of connections (UNIX sockets fail with EAGAIN then)
+    request_queue_size = 128
+
+    def __init__(self, target, socket_path=DEFAULT_SOCKET):
+        if os.path.exists(socket_path):
+            os.unlink(socket_path)
+        super().__init__(socket_path, _RequestHandler)
+        self.target = target
+        self.socket_path = socket_path
+        self._thread = None
+
+    def start(self):
+        """Serve requests in a background thread"""
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Mock SPDK target serving JSON-RPC requests from memory")
+    parser.add_argument("-s", dest="server_addr", default=DEFAULT_SOCKET, help="RPC UNIX domain socket path")
+    parser.add_argument("-l", "--latency", type=float, default=0.0,
+                        help="Processing time of each request in seconds")
+    parser.add_argument("-L", "--object-latency", type=float, default=0.0,
+                        help="Additional processing time per object returned by listing methods, in seconds")
+    parser.add_argument("--iops", type=int, default=0,
+                        help="Simulated IOPS of each bdev, reported by bdev_get_iostat")
+    parser.add_argument("--wait-for-rpc", action="store_true",
+                        help="Start in the pre-init state, waiting for framework_start_init")
+    parser.add_argument("--bdevs", type=int, default=0, help="Number of malloc bdevs to create on startup")
+    parser.add_argument("--lvols", type=int, default=0, help="Number of lvols to create on startup")
+    parser.add_argument("--subsystems", type=int, default=0,
+                        help="Number of NVMe-oF subsystems to create on startup")
+    args = parser.parse_args()
+
+    target = MockTarget(args.latency, args.object_latency, args.wait_for_rpc, args.iops)
+    target.populate(args.bdevs, args.lvols, args.subsystems)
+    server = MockServer(target, args.server_addr)
+    print("Mock SPDK target listening on %s" % args.server_addr, flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        os.unlink(args.server_addr)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
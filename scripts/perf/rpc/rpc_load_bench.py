@@ -0,0 +1,195 @@
+#!/usr/bin/env python3
+"""Load benchmark of the JSON-RPC server of an SPDK application.
+
+Drives a mix of read-only (bdev_get_iostat, thread_get_stats, ...) and mutating
+(bdev_null_create followed by bdev_null_delete) operations over N concurrent
+connections, each served by its own process through JSONRPCClient, and reports
+calls/sec and the latency distribution of each operation.
+
+With --bdevperf the application is expected to be bdevperf started with -z. Each run
+then lasts for one perform_tests call (the duration of bdevperf's -t) and is preceded
+by a run without RPC load. I/O operations per second and the mean I/O latency of each
+run, taken from bdev_get_iostat, show the effect of the RPC load on I/O.
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import random
+import sys
+import time
+
+from control_plane_bench import MockTargetProcess
+
+sys.path.append(os.path.dirname(__file__) + '/../../../python')
+
+import spdk.rpc as rpc  # noqa
+from spdk.rpc.client import JSONRPCClient, JSONRPCException  # noqa
+from spdk.rpc.instrumentation import LatencyHistogram  # noqa
+
+
+def create_delete_null(client, name):
+    rpc.bdev.bdev_null_create(client, 1024, 512, "LoadNull%s" % name)
+    rpc.bdev.bdev_null_delete(client, "LoadNull%s" % name)
+
+
+# Operations and the functions executing them, given a client and a name unique to the call
+OPERATIONS = {
+    "spdk_get_version": lambda client, name: rpc.spdk_get_version(client),
+    "bdev_get_iostat": lambda client, name: rpc.bdev.bdev_get_iostat(client),
+    "bdev_get_bdevs": lambda client, name: rpc.bdev.bdev_get_bdevs(client),
+    "thread_get_stats": lambda client, name: rpc.app.thread_get_stats(client),
+    "framework_get_reactors": lambda client, name: rpc.app.framework_get_reactors(client),
+    "bdev_null_create+delete": create_delete_null,
+}
+DEFAULT_MIX = "bdev_get_iostat:4,thread_get_stats:4,bdev_null_create+delete:1"
+PERCENTILES = [50, 90, 99, 99.9]
+HEADERS = ["connections", "operation", "calls", "calls/s", "p50_ms", "p90_ms", "p99_ms", "p99.9_ms", "max_ms",
+           "errors"]
+
+
+def parse_mix(mix):
+    operations = []
+    for item in mix.split(","):
+        name, _, weight = item.partition(":")
+        if name not in OPERATIONS:
+            raise argparse.ArgumentTypeError("Unknown operation %s, valid ones: %s" % (name, ", ".join(OPERATIONS)))
+        operations.append((name, float(weight or 1)))
+    return operations
+
+
+def worker(index, args, ready, start, stop, results):
+    client = JSONRPCClient(args.socket, args.port, timeout=args.timeout)
+    names, weights = zip(*args.mix)
+    rand = random.Random(index)
+    histograms = {name: LatencyHistogram() for name in names}
+    errors = dict.fromkeys(names, 0)
+    interval = 1.0 / args.rate if args.rate else 0
+    n = 0
+    ready.release()
+    start.wait()
+    next_time = time.perf_counter()
+    while not stop.is_set():
+        name = rand.choices(names, weights)[0]
+        t = time.perf_counter()
+        try:
+            OPERATIONS[name](client, "%d_%d" % (index, n))
+        except JSONRPCException:
+            errors[name] += 1
+            if client.sock is None:
+                client = JSONRPCClient(args.socket, args.port, timeout=args.timeout)
+        histograms[name].record(time.perf_counter() - t)
+        n += 1
+        if interval:
+            next_time += interval
+            time.sleep(max(0, next_time - time.perf_counter()))
+    client.close()
+    results.put((histograms, errors))
+
+
+def io_stats(client):
+    """Get I/O counters of all bdevs: {name: (ops, latency ticks)} and the time in seconds"""
+    iostat = rpc.bdev.bdev_get_iostat(client)
+    return {b["name"]: (b["num_read_ops"] + b["num_write_ops"],
+                        b.get("read_latency_ticks", 0) + b.get("write_latency_ticks", 0))
+            for b in iostat["bdevs"]}, iostat["ticks"] / iostat["tick_rate"], iostat["tick_rate"]
+
+
+def io_delta(before, after):
+    ops = sum(after[0][n][0] - before[0][n][0] for n in before[0] if n in after[0])
+    ticks = sum(after[0][n][1] - before[0][n][1] for n in before[0] if n in after[0])
+    return {"io_ops/s": ops / (after[1] - before[1]),
+            "io_mean_latency_us": ticks / ops / after[2] * 1e6 if ops else 0.0}
+
+
+def run(args, connections, control):
+    """Run the load with the given number of connections for the duration of the benchmark or of perform_tests"""
+    ready = multiprocessing.Semaphore(0)
+    start = multiprocessing.Event()
+    stop = multiprocessing.Event()
+    results = multiprocessing.Queue()
+    procs = [multiprocessing.Process(target=worker, args=(i, args, ready, start, stop, results))
+             for i in range(connections)]
+    for proc in procs:
+        proc.start()
+    for _ in procs:
+        ready.acquire()
+
+    before = io_stats(control)
+    start.set()
+    t = time.perf_counter()
+    if args.bdevperf:
+        control.call("perform_tests")
+    else:
+        time.sleep(args.duration)
+    elapsed = time.perf_counter() - t
+    stop.set()
+    after = io_stats(control)
+
+    histograms = {}
+    errors = {}
+    for _ in procs:
+        worker_histograms, worker_errors = results.get()
+        for name, histogram in worker_histograms.items():
+            histograms.setdefault(name, LatencyHistogram()).merge(histogram)
+            errors[name] = errors.get(name, 0) + worker_errors[name]
+    for proc in procs:
+        proc.join()
+
+    rows = []
+    for name in sorted(histograms):
+        histogram = histograms[name]
+        row = {"connections": connections, "operation": name, "calls": histogram.count,
+               "calls/s": histogram.count / elapsed, "max_ms": (histogram.max or 0) / 1e6, "errors": errors[name]}
+        row.update(("p%s_ms" % p, v * 1e3) for p, v in zip(PERCENTILES, histogram.percentiles(PERCENTILES)))
+        rows.append(row)
+    return rows, io_delta(before, after)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load the JSON-RPC server of an SPDK application with a mix of RPCs")
+    parser.add_argument("-s", dest="socket", default="/var/tmp/spdk.sock", help="RPC domain socket path or IP address")
+    parser.add_argument("-p", dest="port", type=int, default=5260, help="RPC port number (if the address is an IP address)")
+    parser.add_argument("-c", "--connections", type=int, nargs="+", default=[1, 4, 16],
+                        help="Numbers of concurrent connections, one run each. Default: 1 4 16")
+    parser.add_argument("-m", "--mix", type=parse_mix, default=parse_mix(DEFAULT_MIX),
+                        help="Operations and their weights, valid operations: %s. Default: %s" %
+                        (", ".join(OPERATIONS), DEFAULT_MIX))
+    parser.add_argument("-d", "--duration", type=float, default=10.0,
+                        help="Duration of each run in seconds, unless --bdevperf is given. Default: 10")
+    parser.add_argument("-r", "--rate", type=float, default=0,
+                        help="Operations per second of each connection. Default: as many as possible")
+    parser.add_argument("-t", dest="timeout", type=float, default=60.0, help="Timeout of each call in seconds. Default: 60")
+    parser.add_argument("--bdevperf", action="store_true",
+                        help="Run the load during perform_tests of bdevperf started with -z, after a run without load")
+    parser.add_argument("--mock", action="store_true", help="Start a mock target (mock_tgt.py) on the socket")
+    parser.add_argument("-j", "--json", dest="json_file", help="Write the results to a JSON file")
+    args = parser.parse_args()
+
+    target = MockTargetProcess(args.socket, bdevs=100, iops=100000) if args.mock else None
+    results = []
+    try:
+        with JSONRPCClient(args.socket, args.port, timeout=3600.0) as control:
+            runs = ([0] if args.bdevperf else []) + args.connections
+            print("%11s %-24s %8s %10s %8s %8s %8s %8s %8s %7s %12s %12s" %
+                  tuple(HEADERS + ["io_ops/s", "io_lat_us"]))
+            for connections in runs:
+                rows, io = run(args, connections, control)
+                for row in rows or [{"connections": connections}]:
+                    row.update(io)
+                    results.append(row)
+                    print("%11d %-24s %8d %10.1f %8.3f %8.3f %8.3f %8.3f %8.3f %7d %12.1f %12.2f" %
+                          tuple(row.get(h, 0) if h != "operation" else row.get(h, "-")
+                                for h in HEADERS + ["io_ops/s", "io_mean_latency_us"]), flush=True)
+    finally:
+        if target:
+            target.stop()
+
+    if args.json_file:
+        with open(args.json_file, "w") as fh:
+            json.dump(results, fh, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,264 @@
+#!/usr/bin/env python3
+
+import argparse
+import curses
+import json
+import logging
+import os
+import sys
+import time
+
+sys.path.append(os.path.dirname(__file__) + '/../python')
+
+import spdk.rpc as rpc  # noqa
+from spdk.rpc.client import JSONRPCException  # noqa
+
+
+class Snapshot:
+    """Reactor, thread and poller statistics collected at a single point in time"""
+
+    def __init__(self, client, pollers=True):
+        self.time = time.monotonic()
+        self.reactors = rpc.app.framework_get_reactors(client)
+        self.threads = rpc.app.thread_get_stats(client)
+        self.pollers = rpc.app.thread_get_pollers(client) if pollers else None
+
+
+class Report:
+    """Statistics computed from the difference between two subsequent snapshots"""
+
+    POLLER_TYPES = ['active_pollers', 'timed_pollers', 'paused_pollers']
+
+    def __init__(self, prev, cur):
+        self.interval = cur.time - prev.time
+        self.tick_rate = cur.reactors['tick_rate']
+        self.reactors = self._reactors(prev.reactors, cur.reactors)
+        self.threads = self._threads(prev.threads, cur.threads, cur.reactors)
+        self.pollers = []
+        if prev.pollers is not None and cur.pollers is not None:
+            self.pollers = self._pollers(prev.pollers, cur.pollers)
+
+    @staticmethod
+    def _busy(busy, idle):
+        return busy / (busy + idle) if busy + idle > 0 else 0.0
+
+    def _reactors(self, prev, cur):
+        last = {r['lcore']: r for r in prev['reactors']}
+        reactors = []
+        for reactor in cur['reactors']:
+            old = last.get(reactor['lcore'], {'busy': 0, 'idle': 0})
+            busy, idle = reactor['busy'] - old['busy'], reactor['idle'] - old['idle']
+            reactors.append({'lcore': reactor['lcore'],
+                             'busy': self._busy(busy, idle),
+                             'busy_ticks': busy,
+                             'ticks': busy + idle,
+                             'in_interrupt': reactor['in_interrupt'],
+                             'threads': [t['id'] for t in reactor['lw_threads']]})
+        return reactors
+
+    def _threads(self, prev, cur, reactors):
+        last = {t['id']: t for t in prev['threads']}
+        lcores = {t['id']: r['lcore'] for r in reactors['reactors'] for t in r['lw_threads']}
+        threads = []
+        for thread in cur['threads']:
+            old = last.get(thread['id'], {'busy': 0, 'idle': 0})
+            busy, idle = thread['busy'] - old['busy'], thread['idle'] - old['idle']
+            threads.append({'id': thread['id'],
+                            'name': thread['name'],
+                            'lcore': lcores.get(thread['id']),
+                            'cpumask': thread['cpumask'],
+                            'busy': self._busy(busy, idle),
+                            'busy_ticks': busy,
+                            'active_pollers_count': thread['active_pollers_count'],
+                            'timed_pollers_count': thread['timed_pollers_count'],
+                            'paused_pollers_count': thread['paused_pollers_count']})
+        return threads
+
+    def _pollers(self, prev, cur):
+        last = {}
+        for thread in prev['threads']:
+            for ptype in self.POLLER_TYPES:
+                for poller in thread[ptype]:
+                    last[(thread['id'], poller['id'])] = poller
+        pollers = []
+        for thread in cur['threads']:
+            for ptype in self.POLLER_TYPES:
+                for poller in thread[ptype]:
+                    old = last.get((thread['id'], poller['id']), {'run_count': 0, 'busy_count': 0})
+                    runs = poller['run_count'] - old['run_count']
+                    busy = poller['busy_count'] - old['busy_count']
+                    pollers.append({'thread': thread['name'],
+                                    'name': poller['name'],
+                                    'type': ptype.split('_')[0],
+                                    'state': poller['state'],
+                                    'run_rate': runs / self.interval if self.interval > 0 else 0.0,
+                                    'busy_rate': busy / self.interval if self.interval > 0 else 0.0,
+                                    'idle_ratio': 1.0 - busy / runs if runs > 0 else 0.0})
+        return pollers
+
+    def advise(self, threshold=0.1):
+        """Suggests thread moves (via thread_set_cpumask) evening out the load across the reactors.
+        Threads are greedily moved from the busiest to the least busy reactor for as long as it
+        reduces the load imbalance by more than the threshold.  The app thread is never moved.
+
+        Returns:
+            List of (thread, source_lcore, target_lcore, cpumask) tuples.
+        """
+        capacity = {r['lcore']: r['ticks'] for r in self.reactors if r['ticks'] > 0}
+        load = {lcore: 0.0 for lcore in capacity}
+        placement = {}
+        for thread in self.threads:
+            if thread['lcore'] in capacity:
+                load[thread['lcore']] += thread['busy_ticks'] / capacity[thread['lcore']]
+                placement[thread['id']] = thread['lcore']
+
+        moves = []
+        while len(load) > 1:
+            src = max(load, key=load.get)
+            dst = min(load, key=load.get)
+            best, best_peak = None, load[src]
+            for thread in self.threads:
+                if placement.get(thread['id']) != src or thread['name'] == 'app_thread':
+                    continue
+                share = thread['busy_ticks'] / capacity[src]
+                peak = max(load[src] - share, load[dst] + share * capacity[src] / capacity[dst])
+                if peak < best_peak:
+                    best, best_peak = thread, peak
+            if best is None or load[src] - best_peak < threshold:
+                break
+            share = best['busy_ticks'] / capacity[src]
+            load[src] -= share
+            load[dst] += share * capacity[src] / capacity[dst]
+            placement[best['id']] = dst
+            moves.append((best, src, dst, hex(1 << dst)))
+        return moves
+
+    def to_json(self, threshold=0.1):
+        return {'interval': self.interval,
+                'reactors': self.reactors,
+                'threads': self.threads,
+                'pollers': self.pollers,
+                'advice': [{'thread_id': t['id'], 'thread_name': t['name'], 'from_lcore': src,
+                            'to_lcore': dst, 'cpumask': mask}
+                           for t, src, dst, mask in self.advise(threshold)]}
+
+
+def format_report(report, args):
+    lines = ['{:>5}  {:>7}  {:>9}  {}'.format('lcore', 'busy', 'interrupt', 'threads')]
+    for r in report.reactors:
+        lines.append('{:>5}  {:>7.2%}  {:>9}  {}'.format(
+            r['lcore'], r['busy'], 'yes' if r['in_interrupt'] else 'no',
+            ','.join(str(t) for t in r['threads'])))
+
+    lines += ['', '{:>5}  {:24}  {:>5}  {:>7}  {:>6}  {:>5}  {:>6}'.format(
+        'id', 'thread', 'lcore', 'busy', 'active', 'timed', 'paused')]
+    for t in sorted(report.threads, key=lambda t: -t['busy'])[:args.max_rows]:
+        lines.append('{:>5}  {:24}  {:>5}  {:>7.2%}  {:>6}  {:>5}  {:>6}'.format(
+            t['id'], t['name'][:24], t['lcore'] if t['lcore'] is not None else '-', t['busy'],
+            t['active_pollers_count'], t['timed_pollers_count'], t['paused_pollers_count']))
+
+    if report.pollers:
+        lines += ['', '{:24}  {:24}  {:6}  {:>12}  {:>12}  {:>7}'.format(
+            'thread', 'poller', 'type', 'runs/s', 'busy/s', 'idle')]
+        for p in sorted(report.pollers, key=lambda p: -p['run_rate'])[:args.max_rows]:
+            lines.append('{:24}  {:24}  {:6}  {:>12.1f}  {:>12.1f}  {:>7.2%}'.format(
+                p['thread'][:24], p['name'][:24], p['type'], p['run_rate'], p['busy_rate'],
+                p['idle_ratio']))
+
+    moves = report.advise(args.threshold)
+    if moves:
+        lines += ['', 'Suggested moves:']
+        for thread, src, dst, mask in moves:
+            lines.append('  {} (id {}): lcore {} -> {}: rpc.py thread_set_cpumask -i {} -m {}'.format(
+                thread['name'], thread['id'], src, dst, thread['id'], mask))
+    return lines
+
+
+def monitor(args, display):
+    client = rpc.client.JSONRPCClient(args.server_addr, args.port, args.timeout,
+                                      log_level=getattr(logging, args.verbose.upper()))
+    prev = Snapshot(client, not args.no_pollers)
+    count = 0
+    while args.count == 0 or count < args.count:
+        time.sleep(args.interval)
+        cur = Snapshot(client, not args.no_pollers)
+        if display(Report(prev, cur)) is False:
+            break
+        prev = cur
+        count += 1
+    client.close()
+
+
+def run_batch(args):
+    def display(report):
+        if args.json:
+            print(json.dumps(report.to_json(args.threshold)))
+        else:
+            print('\n'.join(format_report(report, args)) + '\n')
+        sys.stdout.flush()
+
+    monitor(args, display)
+
+
+def run_curses(args):
+    def main(screen):
+        screen.nodelay(True)
+        curses.curs_set(0)
+
+        def display(report):
+            screen.erase()
+            height, width = screen.getmaxyx()
+            header = 'SPDK reactor monitor - {}  (interval {:.1f}s, q to quit)'.format(
+                args.server_addr, report.interval)
+            for row, line in enumerate([header, ''] + format_report(report, args)):
+                if row >= height - 1:
+                    break
+                screen.addnstr(row, 0, line, width - 1)
+            screen.refresh()
+            return screen.getch() not in (ord('q'), ord('Q'))
+
+        monitor(args, display)
+
+    curses.wrapper(main)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description='SPDK reactor, thread and poller monitor')
+    parser.add_argument('-s', '--server', dest='server_addr',
+                        help='RPC domain socket path or IP address', default='/var/tmp/spdk.sock')
+    parser.add_argument('-p', '--port', dest='port',
+                        help='RPC port number (if server_addr is IP address)',
+                        default=5260, type=int)
+    parser.add_argument('-o', '--timeout', dest='timeout',
+                        help='Timeout as a floating point number expressed in seconds waiting for response. Default: 60.0',
+                        default=60.0, type=float)
+    parser.add_argument('-i', '--interval', dest='interval', type=float, default=1.0,
+                        help='Time interval (in seconds) between snapshots. Default: 1.0')
+    parser.add_argument('-n', '--count', dest='count', type=int, default=0,
+                        help='Number of reports to display before exiting (0 means run forever)')
+    parser.add_argument('-b', '--batch', dest='batch', action='store_true',
+                        help='Print the reports to stdout instead of using curses')
+    parser.add_argument('-j', '--json', dest='json', action='store_true',
+                        help='Print each report as a single line of JSON (implies --batch)')
+    parser.add_argument('-r', '--max-rows', dest='max_rows', type=int, default=20,
+                        help='Maximum number of threads and pollers to display. Default: 20')
+    parser.add_argument('--no-pollers', dest='no_pollers', action='store_true',
+                        help='Do not query thread_get_pollers')
+    parser.add_argument('--threshold', dest='threshold', type=float, default=0.1,
+                        help='Minimum reduction of the busiest reactor\'s load (as a fraction) for ' +
+                             'a thread move to be suggested. Default: 0.1')
+    parser.add_argument('-v', dest='verbose', action='store_const', const="INFO",
+                        help='Set verbose mode to INFO', default="ERROR")
+    args = parser.parse_args()
+
+    try:
+        if args.batch or args.json:
+            run_batch(args)
+        else:
+            run_curses(args)
+    except JSONRPCException as ex:
+        print(ex.message)
+        exit(1)
+    except KeyboardInterrupt:
+        pass
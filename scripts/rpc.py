@@ -1,5 +1,7 @@
 #!/usr/bin/env python3
 
+import atexit
+import contextlib
 import logging
 import argparse
 import importlib
@@ -16,8 +18,12 @@ except ImportError:
 sys.path.append(os.path.dirname(__file__) + '/../python')
 
 import spdk.rpc as rpc  # noqa
-from spdk.rpc.client import print_dict, print_json, JSONRPCException  # noqa
+import spdk.rpc.provision  # noqa
+from spdk.rpc.client import print_dict, print_json, error_response_message, JSONRPCException  # noqa
 from spdk.rpc.helpers import deprecated_aliases  # noqa
+from spdk.rpc.instrumentation import RPCStats  # noqa
+from spdk.rpc.cache import RPCCache  # noqa
+from spdk.rpc.pipeline import Pipeline  # noqa
 
 
 def print_array(a):
@@ -53,6 +59,17 @@ if __name__ == "__main__":
                                 must be executed without any other parameters.")
     parser.set_defaults(is_server=False)
     parser.add_argument('--plugin', dest='rpc_plugin', help='Module name of plugin with additional RPC commands')
+    parser.add_argument('--rpc-stats', dest='rpc_stats', metavar='FILE',
+                        help='Record per-method statistics of the RPC calls and write them to FILE at exit, \
+                              in the OpenMetrics format if its name ends with .prom, as JSON otherwise')
+    parser.add_argument('--rpc-cache', dest='rpc_cache', action='store_true',
+                        help='Cache results of metadata RPCs (e.g. rpc_get_methods) for the duration of their TTLs, \
+                              until a state-changing RPC which may affect them is called')
+    parser.add_argument('--pipeline', dest='pipeline', metavar='WINDOW', type=int, default=0,
+                        help='When executing a script from stdin, parse the whole script first and keep up to WINDOW \
+                              requests in flight. Requests following one whose method may complete asynchronously \
+                              are only sent once it completed. On error, up to WINDOW - 1 requests of the following \
+                              commands may have been executed already')
     subparsers = parser.add_subparsers(help='RPC methods', dest='called_rpc_name', metavar='')
 
     def framework_start_init(args):
@@ -107,6 +124,26 @@ if __name__ == "__main__":
     p.add_argument('-j', '--json-conf', help='Valid JSON configuration', default=sys.stdin)
     p.set_defaults(func=load_config)
 
+    def provision(args):
+        template = rpc.provision.load_template(args.template)
+        if args.config:
+            rpc.provision.write_config(template, sys.stdout)
+        elif args.load:
+            rpc.provision.load(args.client, template, include_aliases=args.include_aliases)
+        else:
+            rpc.provision.provision(args.client, template, window=args.window)
+
+    p = subparsers.add_parser('provision', help="""Execute the requests described by a provisioning template, see
+    python/spdk/rpc/provision.py for its format.""")
+    p.add_argument('-j', '--template', help='Provisioning template', default=sys.stdin)
+    p.add_argument('-w', '--window', help='Maximum number of requests in flight. Default: 64', type=int, default=64)
+    p.add_argument('-c', '--config', help='Write the requests as a configuration for load_config to stdout instead. \
+                   Use with --dry-run to do it without a running target', action='store_true')
+    p.add_argument('-l', '--load', help='Execute the requests one by one as load_config would, \
+                   e.g. for a target started with --wait-for-rpc', action='store_true')
+    p.add_argument('-i', '--include-aliases', help='include RPC aliases with --load', action='store_true')
+    p.set_defaults(func=provision)
+
     def save_subsystem_config(args):
         rpc.save_subsystem_config(args.client,
                                   sys.stdout,
@@ -2886,13 +2923,19 @@ Format: 'user:u1 secret:s1 muser:mu1 msecret:ms1,user:u2 secret:s2 muser:mu2 mse
         args.func(args)
         check_called_name(args.called_rpc_name)
 
+    def split_command(line):
+        # shlex is slow, only use it for lines with quotes or escapes
+        if '"' in line or "'" in line or '\\' in line:
+            return shlex.split(line)
+        return line.split()
+
     def execute_script(parser, client, fd):
         executed_rpc = ""
         for rpc_call in map(str.rstrip, fd):
             if not rpc_call.strip():
                 continue
             executed_rpc = "\n".join([executed_rpc, rpc_call])
-            rpc_args = shlex.split(rpc_call)
+            rpc_args = split_command(rpc_call)
             if rpc_args[0][0] == '#':
                 # Ignore lines starting with # - treat them as comments
                 continue
@@ -2906,6 +2949,89 @@ Format: 'user:u1 secret:s1 muser:mu1 msecret:ms1,user:u2 secret:s2 muser:mu2 mse
                 print(ex.message)
                 exit(1)
 
+    class recording_client:
+        """Records the requests of a command instead of sending them"""
+        def __init__(self):
+            self.requests = []
+
+        def call(self, method, params=None):
+            self.requests.append((method, params))
+
+    class replay_client:
+        """Returns the response to a request already sent for a command"""
+        def __init__(self, method, params, response):
+            self.request = (method, params)
+            self.response = response
+
+        def call(self, method, params=None):
+            if self.response is None or (method, params) != self.request:
+                raise JSONRPCException("Command made a different request when executed: %s" % method)
+            response, self.response = self.response, None
+            if 'error' in response:
+                raise JSONRPCException(error_response_message(method, params, response['id'], response['error']))
+            return response['result']
+
+    def script_error(lines, line_count, ex):
+        print("Exception:")
+        print("\n".join(lines[:line_count]).strip() + " <<<")
+        print(ex.message)
+        exit(1)
+
+    def execute_script_pipelined(parser, client, fd, window):
+        # Parse the whole script first. Commands making a single request, without using its
+        # result, are pipelined, others are executed on their own.
+        lines = []
+        commands = []
+        with open(os.devnull, 'w') as devnull:
+            for rpc_call in map(str.rstrip, fd):
+                if not rpc_call.strip():
+                    continue
+                lines.append(rpc_call)
+                rpc_args = split_command(rpc_call)
+                if rpc_args[0][0] == '#':
+                    continue
+                try:
+                    args = parser.parse_args(rpc_args)
+                except SystemExit:
+                    print("Invalid command in line %d: %s" % (len(lines), rpc_call), file=sys.stderr)
+                    raise
+                args.client = recording_client()
+                try:
+                    with contextlib.redirect_stdout(devnull):
+                        args.func(args)
+                    requests = args.client.requests if len(args.client.requests) == 1 else None
+                except Exception:
+                    requests = None
+                commands.append((len(lines), args, requests))
+
+        def complete(completed):
+            for (line_count, args, method, params), response in completed:
+                args.client = replay_client(method, params, response)
+                try:
+                    call_rpc_func(args)
+                except JSONRPCException as ex:
+                    script_error(lines, line_count, ex)
+
+        pipeline = Pipeline(client, window)
+        for line_count, args, requests in commands:
+            if requests is None:
+                complete(pipeline.drain())
+                args.client = client
+                try:
+                    call_rpc_func(args)
+                except JSONRPCException as ex:
+                    script_error(lines, line_count, ex)
+                continue
+            method, params = requests[0]
+            try:
+                complete(pipeline.submit(method, params, (line_count, args, method, params)))
+            except JSONRPCException as ex:
+                script_error(lines, line_count, ex)
+        try:
+            complete(pipeline.drain())
+        except JSONRPCException as ex:
+            script_error(lines, len(lines), ex)
+
     def load_plugin(args):
         # Create temporary parser, pull out the plugin parameter, load the module, and then run the real argument parser
         plugin_parser = argparse.ArgumentParser(add_help=False)
@@ -2945,6 +3071,12 @@ Format: 'user:u1 secret:s1 muser:mu1 msecret:ms1,user:u2 secret:s2 muser:mu2 mse
         # No arguments and no data piped through stdin
         parser.print_help()
         exit(1)
+    hooks = []
+    if args.rpc_stats:
+        rpc_stats = RPCStats()
+        hooks.append(rpc_stats)
+        atexit.register(rpc_stats.write, args.rpc_stats)
+    rpc_cache = RPCCache() if args.rpc_cache else None
     if args.is_server:
         for input in sys.stdin:
             cmd = shlex.split(input)
@@ -2959,7 +3091,10 @@ Format: 'user:u1 secret:s1 muser:mu1 msecret:ms1,user:u2 secret:s2 muser:mu2 mse
             try:
                 tmp_args.client = rpc.client.JSONRPCClient(
                     tmp_args.server_addr, tmp_args.port, tmp_args.timeout,
-                    log_level=getattr(logging, tmp_args.verbose.upper()), conn_retries=tmp_args.conn_retries)
+                    log_level=getattr(logging, tmp_args.verbose.upper()), conn_retries=tmp_args.conn_retries,
+                    hooks=hooks)
+                if rpc_cache:
+                    tmp_args.client = rpc_cache.wrap(tmp_args.client)
                 call_rpc_func(tmp_args)
                 print("**STATUS=0", flush=True)
             except JSONRPCException as ex:
@@ -2975,7 +3110,9 @@ Format: 'user:u1 secret:s1 muser:mu1 msecret:ms1,user:u2 secret:s2 muser:mu2 mse
         try:
             args.client = rpc.client.JSONRPCClient(args.server_addr, args.port, args.timeout,
                                                    log_level=getattr(logging, args.verbose.upper()),
-                                                   conn_retries=args.conn_retries)
+                                                   conn_retries=args.conn_retries, hooks=hooks)
+            if rpc_cache:
+                args.client = rpc_cache.wrap(args.client)
         except JSONRPCException as ex:
             print(ex.message)
             exit(1)
@@ -2986,5 +3123,7 @@ Format: 'user:u1 secret:s1 muser:mu1 msecret:ms1,user:u2 secret:s2 muser:mu2 mse
         except JSONRPCException as ex:
             print(ex.message)
             exit(1)
+    elif args.pipeline > 0 and not args.dry_run:
+        execute_script_pipelined(parser, args.client, sys.stdin, args.pipeline)
     else:
         execute_script(parser, args.client, sys.stdin)
@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+
+import argparse
+import json
+import os
+import sys
+
+sys.path.append(os.path.dirname(__file__) + '/../python')
+
+import spdk.rpc.provision  # noqa
+from spdk.rpc.client import print_dict  # noqa
+from spdk.rpc.fleet import DEFAULT_PORT, Fleet, Target, aggregate_iostat, merge_histograms  # noqa
+from spdk.rpc.instrumentation import PERCENTILES  # noqa
+
+
+def read_targets(args):
+    specs = list(args.targets or [])
+    if args.targets_file:
+        with open(args.targets_file, 'r') as fh:
+            for line in fh:
+                line = line.split('#', 1)[0].strip()
+                if line:
+                    specs.append(line)
+    if not specs:
+        raise SystemExit("No targets given, use -s or -f")
+    return [Target.parse(spec, args.port) for spec in specs]
+
+
+def run(args, results):
+    """Print the results of the targets as JSON lines as they come, return the successful ones"""
+    succeeded = []
+    failed = 0
+    for result in results:
+        if not args.quiet or result.error is not None:
+            print(json.dumps(result.to_dict()), flush=True)
+        if result.error is None:
+            succeeded.append(result.result)
+        else:
+            failed += 1
+    print("%d targets, %d failed" % (len(succeeded) + failed, failed), file=sys.stderr)
+    args.failed = failed
+    return succeeded
+
+
+def call(args):
+    params = json.loads(args.params) if args.params else None
+    run(args, args.fleet.call(args.method, params))
+
+
+def load_config(args):
+    with open(args.config, 'r') as fh:
+        config = json.load(fh)
+    run(args, args.fleet.load_config(config))
+
+
+def provision(args):
+    template = spdk.rpc.provision.load_template(args.template)
+    run(args, args.fleet.load_subsystems(spdk.rpc.provision.subsystems(template)))
+
+
+def iostat(args):
+    params = {'name': args.name} if args.name else None
+    print_dict(aggregate_iostat(run(args, args.fleet.call('bdev_get_iostat', params))))
+
+
+def histogram(args):
+    merged = merge_histograms(run(args, args.fleet.call('bdev_get_histogram', {'name': args.name})))
+    ret = {'count': merged.count, 'min_us': (merged.min or 0) / 1e3, 'mean_us': merged.mean() * 1e6,
+           'max_us': (merged.max or 0) / 1e3}
+    ret.update(('p%s_us' % p, v * 1e6) for p, v in zip(PERCENTILES, merged.percentiles(PERCENTILES)))
+    ret['buckets'] = [[v * 1e6, count] for v, count in merged.buckets()]
+    print_dict(ret)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Execute an RPC on many SPDK targets concurrently. Results of the '
+                                     'targets are printed as JSON lines as soon as each of them is done.')
+    parser.add_argument('-s', dest='targets', action='append', metavar='TARGET',
+                        help='RPC domain socket path or IP address, optionally followed by :port ([addr]:port for IPv6). '
+                        'Can be given multiple times')
+    parser.add_argument('-f', dest='targets_file', help='File with one target per line')
+    parser.add_argument('-p', dest='port', type=int, default=DEFAULT_PORT,
+                        help='RPC port number of targets given without one. Default: %d' % DEFAULT_PORT)
+    parser.add_argument('-c', dest='concurrency', type=int, default=32,
+                        help='Maximum number of targets operated on at the same time. Default: 32')
+    parser.add_argument('-t', dest='timeout', type=float, default=10.0,
+                        help='Timeout in seconds for connecting to a target and waiting for each response. Default: 10.0')
+    parser.add_argument('-r', dest='conn_retries', type=int, default=0,
+                        help='Retry connecting to each target N times with 0.2s interval. Default: 0')
+    parser.add_argument('-q', dest='quiet', action='store_true', help='Print only the results of failed targets')
+    subparsers = parser.add_subparsers(dest='command', metavar='')
+    subparsers.required = True
+
+    p = subparsers.add_parser('call', help='Call a method on every target')
+    p.add_argument('method', help='Method name')
+    p.add_argument('params', nargs='?', help='Parameters as a JSON object')
+    p.set_defaults(func=call)
+
+    p = subparsers.add_parser('load_config', help='Load a JSON configuration into every target')
+    p.add_argument('config', help='Configuration file, as written by save_config')
+    p.set_defaults(func=load_config)
+
+    p = subparsers.add_parser('provision', help='Load the requests described by a provisioning template into every '
+                              'target, see python/spdk/rpc/provision.py for its format')
+    p.add_argument('template', help='Provisioning template')
+    p.set_defaults(func=provision)
+
+    p = subparsers.add_parser('iostat', help='Sum bdev_get_iostat counters of all the targets')
+    p.add_argument('-b', dest='name', help='Name of the bdev, all bdevs by default')
+    p.set_defaults(func=iostat)
+
+    p = subparsers.add_parser('histogram', help='Merge latency histograms of a bdev of all the targets')
+    p.add_argument('-b', dest='name', required=True, help='Name of the bdev')
+    p.set_defaults(func=histogram)
+
+    args = parser.parse_args()
+    args.fleet = Fleet(read_targets(args), args.concurrency, args.timeout, args.conn_retries)
+    args.func(args)
+    sys.exit(1 if args.failed else 0)
+
+
+if __name__ == '__main__':
+    main()
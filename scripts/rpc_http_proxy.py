@@ -2,23 +2,19 @@
 
 import argparse
 import base64
-import errno
 import json
+import logging
 import os
-import socket
+import queue
 import ssl
 import sys
-try:
-    from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
-except ImportError:
-    from http.server import HTTPServer
-    from http.server import BaseHTTPRequestHandler
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
 
 sys.path.append(os.path.dirname(__file__) + '/../python')
 
-from spdk.rpc.client import print_json  # noqa
-
-rpc_sock = None
+from spdk.rpc.client import JSONRPCClient, JSONRPCException  # noqa
+from spdk.rpc.pipeline import Pipeline  # noqa
 
 parser = argparse.ArgumentParser(description='http(s) proxy for SPDK RPC calls')
 parser.add_argument('host', help='Host name / IP representing proxy server')
@@ -27,102 +23,180 @@ parser.add_argument('user', help='User name used for authentication')
 parser.add_argument('password', help='Password used for authentication')
 parser.add_argument('-s', dest='sock', help='RPC domain socket path', default='/var/tmp/spdk.sock')
 parser.add_argument('-c', dest='cert', help='SSL certificate')
+parser.add_argument('-n', dest='connections', type=int, default=8,
+                    help='Maximum number of connections to the SPDK RPC server. Default: 8')
+parser.add_argument('-t', dest='timeout', type=float, default=60.0,
+                    help='Timeout in seconds waiting for a connection to the SPDK RPC server and for its response. '
+                    'Default: 60.0')
+parser.add_argument('-v', dest='verbose', action='store_true', help='Print HTTP requests and JSON-RPC requests and responses')
 
+INVALID_REQUEST = -32600
 
-def print_usage_and_exit(status):
-    print('Usage: rpc_http_proxy.py <server IP> <server port> <user name>' +
-          ' <password> <SPDK RPC socket (optional, default: /var/tmp/spdk.sock)>')
-    sys.exit(status)
-
-
-def rpc_call(req):
-    global rpc_sock
 
-    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
-    sock.connect(rpc_sock)
-    sock.sendall(req)
+class ConnectionPool:
+    """Pool of persistent connections to the SPDK RPC server, created on demand.
 
-    if 'id' not in json.loads(req.decode('ascii')):
-        sock.close()
-        return None
+    Each HTTP request gets a connection for exclusive use, so responses never have to
+    be matched across requests. Connections which failed are closed and replaced.
+    """
 
-    buf = ''
-    closed = False
-    response = None
+    def __init__(self, sock, size, timeout):
+        self.sock = sock
+        self.timeout = timeout
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(size)
 
-    print_json(req.decode('ascii'))
-
-    while not closed:
-        newdata = sock.recv(1024)
-        if (newdata == b''):
-            closed = True
-        buf += newdata.decode('ascii')
+    def acquire(self):
+        if not self._slots.acquire(timeout=self.timeout):
+            raise JSONRPCException("Timeout while waiting for a connection to %s" % self.sock)
         try:
-            response = json.loads(buf)
-        except ValueError:
-            continue  # incomplete response; keep buffering
-        break
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        try:
+            return JSONRPCClient(self.sock, timeout=self.timeout)
+        except Exception:
+            self._slots.release()
+            raise
+
+    def release(self, client, healthy=True):
+        if healthy and client.sock is not None:
+            self._idle.put(client)
+        else:
+            try:
+                client.close()
+            except OSError:
+                pass
+        self._slots.release()
+
+    def execute(self, requests):
+        """Send requests over a single connection and return the responses to the ones
+        having an id, in order. The SPDK RPC server doesn't support batches, so requests
+        are sent over a Pipeline, which keeps the semantics of executing them one by one.
+        Request ids are replaced by unique ones for the duration of the call, so that
+        clients may reuse them."""
+        client = self.acquire()
+        healthy = False
+        try:
+            responses = []
+            pipeline = Pipeline(client, window=len(requests))
+            for request, response in pipeline.run((r['method'], r.get('params'), r) for r in requests):
+                if 'id' in request:
+                    response['id'] = request['id']
+                    responses.append(response)
+            healthy = True
+            return responses
+        finally:
+            self.release(client, healthy)
 
-    sock.close()
 
-    if not response and len(buf) > 0:
-        raise
+class ProxyServer(ThreadingHTTPServer):
+    daemon_threads = True
+    # Don't refuse bursts of connections from many clients
+    request_queue_size = 128
 
-    print_json(buf)
 
-    return buf
+def validate_request(request):
+    if not isinstance(request, dict) or not isinstance(request.get('method'), str):
+        return {'jsonrpc': '2.0', 'id': request.get('id') if isinstance(request, dict) else None,
+                'error': {'code': INVALID_REQUEST, 'message': 'Invalid request'}}
+    return None
 
 
 class ServerHandler(BaseHTTPRequestHandler):
 
+    # Keep connections alive between requests, without delaying small responses
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
     key = ""
+    pool = None
+    verbose = False
+
+    def log_message(self, format, *args):
+        if self.verbose:
+            super().log_message(format, *args)
+
+    def send_body(self, status, body=b'', content_type='application/json'):
+        self.send_response(status)
+        self.send_header('Content-type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
 
     def do_HEAD(self):
         self.send_response(200)
         self.send_header('Content-type', 'text/html')
+        self.send_header('Content-Length', '0')
         self.end_headers()
 
     def do_AUTHHEAD(self):
         self.send_response(401)
         self.send_header('WWW-Authenticate', 'text/html')
         self.send_header('Content-type', 'text/html')
-        self.end_headers()
-
-    def do_INTERNALERROR(self):
-        self.send_response(500)
-        self.send_header('Content-type', 'text/html')
+        self.send_header('Content-Length', '0')
         self.end_headers()
 
     def do_POST(self):
+        data = self.rfile.read(int(self.headers.get('Content-Length', 0)))
         if self.headers['Authorization'] != 'Basic ' + self.key:
             self.do_AUTHHEAD()
-        else:
-            data_string = self.rfile.read(int(self.headers['Content-Length']))
+            return
 
-            try:
-                response = rpc_call(data_string)
-                if response is not None:
-                    self.do_HEAD()
-                    self.wfile.write(bytes(response.encode(encoding='ascii')))
-            except ValueError:
-                self.do_INTERNALERROR()
+        try:
+            payload = json.loads(data)
+        except ValueError:
+            self.send_body(400, b'', 'text/html')
+            return
+        if self.verbose:
+            print(json.dumps(payload, indent=2), flush=True)
+
+        batch = isinstance(payload, list)
+        requests = payload if batch else [payload]
+        if not requests:
+            self.send_body(200, json.dumps(validate_request(None)).encode())
+            return
+
+        errors = [validate_request(r) for r in requests]
+        valid = [r for r, e in zip(requests, errors) if e is None]
+        try:
+            results = iter(self.pool.execute(valid) if valid else [])
+        except JSONRPCException as ex:
+            logging.error("SPDK RPC request failed: %s", ex.message)
+            self.send_body(502, b'', 'text/html')
+            return
+
+        # Put the responses back in the order of the requests, notifications have none
+        responses = []
+        for request, error in zip(requests, errors):
+            if error is not None:
+                responses.append(error)
+            elif 'id' in request:
+                responses.append(next(results))
+        if not responses:
+            self.send_body(204, content_type='text/html')
+            return
+
+        body = json.dumps(responses if batch else responses[0])
+        if self.verbose:
+            print(body, flush=True)
+        self.send_body(200, body.encode())
 
 
 def main():
-    global rpc_sock
-
     args = parser.parse_args()
-    rpc_sock = args.sock
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.ERROR)
 
     # encoding user name and password
     key = base64.b64encode((args.user+':'+args.password).encode(encoding='ascii')).decode('ascii')
 
     try:
         ServerHandler.key = key
-        httpd = HTTPServer((args.host, args.port), ServerHandler)
+        ServerHandler.pool = ConnectionPool(args.sock, args.connections, args.timeout)
+        ServerHandler.verbose = args.verbose
+        httpd = ProxyServer((args.host, args.port), ServerHandler)
         if args.cert is not None:
             httpd.socket = ssl.wrap_socket(httpd.socket, certfile=args.cert, server_side=True)
-        print('Started RPC http proxy server')
+        print('Started RPC http proxy server', flush=True)
         httpd.serve_forever()
     except KeyboardInterrupt:
         print('Shutting down server')
@@ -0,0 +1,348 @@
+#!/usr/bin/env python3
+
+import argparse
+import itertools
+import json
+import logging
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.append(os.path.dirname(__file__) + '/../python')
+
+import spdk.rpc as rpc  # noqa
+from spdk.rpc.client import JSONRPCException  # noqa
+
+
+def record(args):
+    client = rpc.client.JSONRPCClient(args.server_addr, args.port, args.timeout,
+                                      log_level=getattr(logging, args.verbose.upper()))
+    with open(args.output, 'w') as file:
+        count = 0
+        while args.count == 0 or count < args.count:
+            sample = {'time': time.monotonic(),
+                      'reactors': rpc.app.framework_get_reactors(client),
+                      'threads': rpc.app.thread_get_stats(client)}
+            file.write(json.dumps(sample) + '\n')
+            file.flush()
+            count += 1
+            time.sleep(args.interval)
+    client.close()
+
+
+class Workload:
+    """Per-thread load derived from a recording of framework_get_reactors and thread_get_stats
+    snapshots.  The busy ticks each thread accumulated between two subsequent snapshots are
+    treated as its demand for that interval, regardless of the core it was running on.
+    """
+
+    def __init__(self, samples, main_lcore=None):
+        if len(samples) < 2:
+            raise ValueError('At least two samples are needed')
+        self.lcores = sorted({r['lcore'] for s in samples for r in s['reactors']['reactors']})
+        self.main = self.lcores.index(main_lcore if main_lcore is not None else self.lcores[0])
+        ids = sorted({t['id'] for s in samples for t in s['threads']['threads']})
+        tindex = {tid: i for i, tid in enumerate(ids)}
+        cindex = {lcore: i for i, lcore in enumerate(self.lcores)}
+        self.threads = [None] * len(ids)
+        self.cpumask = np.zeros((len(ids), len(self.lcores)), dtype=bool)
+        self.placement = np.full(len(ids), self.main)
+
+        nperiods = len(samples) - 1
+        self.demand = np.zeros((nperiods, len(ids)), dtype=np.int64)
+        self.alive = np.zeros((nperiods, len(ids)), dtype=bool)
+        self.period = np.zeros(nperiods, dtype=np.int64)
+        for n, (prev, cur) in enumerate(zip(samples, samples[1:])):
+            self.period[n] = int((cur['time'] - prev['time']) * cur['reactors']['tick_rate'])
+            last = {t['id']: t for t in prev['threads']['threads']}
+            for thread in cur['threads']['threads']:
+                i = tindex[thread['id']]
+                self.threads[i] = thread['name']
+                mask = int(thread['cpumask'], 16)
+                self.cpumask[i] = [bool(mask & (1 << lcore)) for lcore in self.lcores]
+                self.alive[n, i] = True
+                self.demand[n, i] = thread['busy'] - last.get(thread['id'], {'busy': 0})['busy']
+        for reactor in samples[0]['reactors']['reactors']:
+            for thread in reactor['lw_threads']:
+                self.placement[tindex[thread['id']]] = cindex[reactor['lcore']]
+        self.interval = (samples[-1]['time'] - samples[0]['time']) / nperiods
+
+    @classmethod
+    def load(cls, file, main_lcore=None):
+        return cls([json.loads(line) for line in file if line.strip()], main_lcore)
+
+
+class DynamicScheduler:
+    """Model of the dynamic scheduler's (module/scheduler/dynamic) balancing policy, evaluated
+    for many parameter sets at once.  All state is kept in arrays whose first dimension is the
+    parameter set, so each step of the policy is applied to all of them with a single numpy
+    operation.  A balance visits the threads once per pass, in the order of their cores and,
+    within a core, of their IDs, which is what the scheduler does for threads created in that
+    order; the k-th thread visited may differ between parameter sets.
+    """
+
+    def __init__(self, workload, period, load_limit, core_limit, core_busy):
+        self.workload = workload
+        # Number of recorded intervals in a single scheduling period
+        self.steps = np.maximum(np.rint(np.asarray(period) / 10 ** 6 /
+                                        workload.interval), 1).astype(np.int64)
+        self.load_limit = np.asarray(load_limit, dtype=np.int64)
+        self.core_limit = np.asarray(core_limit, dtype=np.int64)
+        self.core_busy = np.asarray(core_busy, dtype=np.int64)
+        # No thread is restricted to a subset of the cores
+        self._unpinned = workload.cpumask.all()
+
+    @staticmethod
+    def _busy_pct(busy, idle):
+        total = busy + idle
+        return np.where(total > 0, busy * 100 // np.maximum(total, 1), 0)
+
+    def _move(self, rows, thread, dst, place, busy, idle, count):
+        """Moves thread[i] to core dst[i] in parameter set rows[i], like _move_thread()"""
+        moved = place[rows, thread] != dst
+        rows, thread, dst = rows[moved], thread[moved], dst[moved]
+        if len(rows) == 0:
+            return
+        src = place[rows, thread]
+        tsc = self._tbusy[rows, thread]
+        src_busy, src_idle, dst_idle = busy[rows, src], idle[rows, src], idle[rows, dst]
+        pct = self._busy_pct(src_busy, src_idle)
+
+        busy[rows, dst] += tsc
+        idle[rows, dst] = dst_idle - np.minimum(dst_idle, tsc)
+        count[rows, dst] += 1
+        src_busy = src_busy - np.minimum(src_busy, tsc)
+        src_idle = src_idle + tsc
+        # The core was so busy that the remaining threads are likely to use the freed cycles
+        limit = self._core_limit[rows]
+        capped = (pct >= self._core_busy[rows]) & (self._busy_pct(src_busy, src_idle) < limit)
+        total = src_busy + src_idle
+        busy[rows, src] = np.where(capped, total * limit // 100, src_busy)
+        idle[rows, src] = np.where(capped, total - total * limit // 100, src_idle)
+        count[rows, src] -= 1
+        place[rows, thread] = dst
+
+    def _find_optimal_core(self, rows, thread, place, busy, idle, count):
+        """Returns the core _find_optimal_core() picks for thread[i] in parameter set rows[i]"""
+        ncores = busy.shape[1]
+        cores = np.arange(ncores)
+        current = place[rows, thread]
+        if len(rows) < len(busy):
+            busy, idle, count = busy[rows], idle[rows], count[rows]
+        index = np.arange(len(rows))
+        limit = self._core_limit[rows]
+        cur_busy, cur_idle = busy[index, current], idle[index, current]
+        at_limit = (count[index, current] > 1) & (cur_busy > 0) & (self._busy_pct(cur_busy, cur_idle) >= limit)
+        tsc = self._tbusy[rows, thread][:, None]
+        # Busy % after taking the thread below the limit, without dividing: the total doesn't
+        # change if the core has enough idle ticks, and cores with no ticks always fit
+        total = busy + idle
+        candidates = (total == 0) | (count == 0) | ((idle >= tsc) & ((busy + tsc) * 100 < limit[:, None] * total))
+        # Better cores are the main one, lower ones unless the thread is on the main one, or
+        # any one if the current core is at the limit
+        lower = np.where(at_limit, ncores, np.where(current != self.workload.main, current, 0))
+        candidates &= (cores < lower[:, None]) | (cores == self.workload.main)
+        candidates[index, current] = False
+        allowed = None
+        if not self._unpinned:
+            allowed = self.workload.cpumask[thread]
+            candidates &= allowed
+        # The scheduler returns the first such core
+        first = candidates.argmax(axis=1)
+        result = np.where(candidates[index, first], first, current)
+        # ...or, at the limit, the first least busy one, if it's less busy than the current one
+        least = np.nonzero(at_limit & (result == current))[0]
+        if len(least):
+            masked = busy[least] if allowed is None else np.where(allowed[least], busy[least], np.iinfo(busy.dtype).max)
+            core = masked.argmin(axis=1)
+            result[least] = np.where(masked[np.arange(len(least)), core] < cur_busy[least], core, current[least])
+        return result
+
+    def _balance(self, sets, place, cbusy, cidle, tbusy, tload):
+        """Balances the threads of the parameter sets whose period ends, returns their new placement"""
+        nthreads, ncores = place.shape[1], cbusy.shape[1]
+        place = place[sets]
+        busy, idle = cbusy[sets], cidle[sets]
+        count = self._count(place)
+        tload = tload[sets]
+        self._tbusy = tbusy[sets]
+        self._core_limit, self._core_busy = self.core_limit[sets], self.core_busy[sets]
+        idle_thread = tload < self.load_limit[sets, None]
+        # Threads that aren't alive are sorted last and skipped
+        threads = np.arange(nthreads)
+        order = np.argsort(np.where(self._alive, place, ncores) * nthreads + threads, axis=1)
+        rows = np.arange(len(sets))
+        main = np.full(len(sets), self.workload.main)
+        # 1) Move all idle threads to the main core
+        for thread in order.T:
+            sel = self._alive[thread] & idle_thread[rows, thread]
+            self._move(rows[sel], thread[sel], main[sel], place, busy, idle, count)
+        # 2) Distribute the active threads across all cores
+        for thread in order.T:
+            sel = self._alive[thread] & ~idle_thread[rows, thread]
+            if not sel.any():
+                continue
+            dst = self._find_optimal_core(rows[sel], thread[sel], place, busy, idle, count)
+            self._move(rows[sel], thread[sel], dst, place, busy, idle, count)
+        return place
+
+    def _per_core(self, place, values):
+        """Sums the values of the alive threads on each core of every parameter set"""
+        nsets, ncores = place.shape[0], len(self.workload.lcores)
+        index = place + np.arange(nsets)[:, None] * ncores
+        weights = np.broadcast_to(values * self._alive, place.shape)
+        return np.bincount(index.ravel(), weights.ravel(), nsets * ncores).reshape(nsets, ncores).astype(np.int64)
+
+    def _count(self, place):
+        return self._per_core(place, 1)
+
+    def run(self):
+        """Replays the workload and returns a dict of per-parameter-set metrics"""
+        wl = self.workload
+        nsets, ncores = len(self.steps), len(wl.lcores)
+        place = np.tile(wl.placement, (nsets, 1))
+        cbusy = np.zeros((nsets, ncores), dtype=np.int64)
+        cidle = np.zeros((nsets, ncores), dtype=np.int64)
+        tbusy = np.zeros((nsets, len(wl.threads)), dtype=np.int64)
+        tidle = np.zeros((nsets, len(wl.threads)), dtype=np.int64)
+        cores_used = np.zeros(nsets)
+        busy_pct = np.zeros(nsets)
+        peak_pct = np.zeros(nsets)
+        unserved = np.zeros(nsets)
+        migrations = np.zeros(nsets, dtype=np.int64)
+
+        for n in range(len(wl.period)):
+            self._alive = wl.alive[n]
+            period, demand = wl.period[n], wl.demand[n]
+            count = self._count(place)
+            core_demand = self._per_core(place, demand)
+            core_busy = np.minimum(core_demand, period)
+            # An overloaded core serves each of its threads proportionally to their demand
+            scale = np.where(core_demand > period, period / np.maximum(core_demand, 1), 1.0)
+            rows = np.arange(nsets)[:, None]
+            thread_busy = (demand[None, :] * scale[rows, place]).astype(np.int64)
+            thread_idle = ((period - core_busy[rows, place]) // np.maximum(count[rows, place], 1))
+
+            used = count > 0
+            cores_used += used.sum(axis=1)
+            busy_pct += (core_busy * 100 / period * used).sum(axis=1) / np.maximum(used.sum(axis=1), 1)
+            peak_pct = np.maximum(peak_pct, core_demand.max(axis=1) * 100 / period)
+            unserved += np.maximum(core_demand - period, 0).sum(axis=1)
+
+            cbusy += core_busy
+            cidle += period - core_busy
+            tbusy += thread_busy * self._alive
+            tidle += thread_idle * self._alive
+            sel = (n + 1) % self.steps == 0
+            if sel.any():
+                sets = np.nonzero(sel)[0]
+                tload = self._busy_pct(tbusy, tidle)
+                balanced = self._balance(sets, place, cbusy, cidle, tbusy, tload)
+                migrations[sets] += (balanced != place[sets]).sum(axis=1)
+                place[sets] = balanced
+                for arr in (cbusy, cidle, tbusy, tidle):
+                    arr[sel] = 0
+
+        nperiods = len(wl.period)
+        return {'cores': cores_used / nperiods,
+                'busy': busy_pct / nperiods,
+                'peak': peak_pct,
+                'unserved': unserved * 100 / max(wl.demand.sum(), 1),
+                'migrations': migrations}
+
+
+def parse_range(value):
+    """Parses a list of values given either as 'a,b,c' or as an inclusive 'start:stop:step' range"""
+    values = []
+    for part in value.split(','):
+        if ':' in part:
+            start, stop, step = (int(v) for v in part.split(':'))
+            values += list(range(start, stop + 1, step))
+        else:
+            values.append(int(part))
+    return values
+
+
+def simulate(args):
+    with open(args.input, 'r') as file:
+        workload = Workload.load(file, args.main_lcore)
+    sets = list(itertools.product(args.period, args.load_limit, args.core_limit, args.core_busy))
+    period, load_limit, core_limit, core_busy = (np.array(v) for v in zip(*sets))
+    start = time.monotonic()
+    metrics = DynamicScheduler(workload, period, load_limit, core_limit, core_busy).run()
+    elapsed = time.monotonic() - start
+
+    results = [{'period': int(p), 'load_limit': int(ll), 'core_limit': int(cl), 'core_busy': int(cb),
+                'cores': float(metrics['cores'][i]), 'busy': float(metrics['busy'][i]),
+                'peak': float(metrics['peak'][i]), 'unserved': float(metrics['unserved'][i]),
+                'migrations': int(metrics['migrations'][i])}
+               for i, (p, ll, cl, cb) in enumerate(sets)]
+    results.sort(key=lambda r: (r['unserved'] > args.max_unserved, r[args.sort], r['migrations']))
+    if args.json:
+        print(json.dumps({'elapsed': elapsed, 'results': results}, indent=2))
+        return
+
+    print('Simulated {} parameter sets over {} periods ({} threads, {} cores) in {:.2f}s'.format(
+        len(sets), len(workload.period), len(workload.threads), len(workload.lcores), elapsed))
+    print('{:>8}  {:>10}  {:>10}  {:>9}  {:>7}  {:>7}  {:>7}  {:>8}  {:>10}'.format(
+        'period', 'load_limit', 'core_limit', 'core_busy', 'cores', 'busy', 'peak', 'unserved',
+        'migrations'))
+    for r in results[:args.top]:
+        print('{:>8}  {:>10}  {:>10}  {:>9}  {:>7.2f}  {:>6.1f}%  {:>6.1f}%  {:>7.2f}%  {:>10}'.format(
+            r['period'], r['load_limit'], r['core_limit'], r['core_busy'], r['cores'], r['busy'],
+            r['peak'], r['unserved'], r['migrations']))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description='Record thread statistics and replay them through a model of the dynamic scheduler')
+    subparsers = parser.add_subparsers(help='Mode', dest='mode', required=True)
+
+    p = subparsers.add_parser('record', help='Record framework_get_reactors and thread_get_stats snapshots')
+    p.add_argument('-s', '--server', dest='server_addr',
+                   help='RPC domain socket path or IP address', default='/var/tmp/spdk.sock')
+    p.add_argument('-p', '--port', dest='port',
+                   help='RPC port number (if server_addr is IP address)', default=5260, type=int)
+    p.add_argument('-o', '--timeout', dest='timeout', default=60.0, type=float,
+                   help='Timeout as a floating point number expressed in seconds waiting for response. Default: 60.0')
+    p.add_argument('-i', '--interval', dest='interval', type=float, default=1.0,
+                   help='Time interval (in seconds) between snapshots, should be lower than or equal to the ' +
+                        'shortest scheduler period to simulate. Default: 1.0')
+    p.add_argument('-n', '--count', dest='count', type=int, default=0,
+                   help='Number of snapshots to record (0 means until interrupted)')
+    p.add_argument('-v', dest='verbose', action='store_const', const="INFO",
+                   help='Set verbose mode to INFO', default="ERROR")
+    p.add_argument('output', help='File to store the snapshots in')
+    p.set_defaults(func=record)
+
+    p = subparsers.add_parser('simulate', help='Replay a recording for a set of scheduler parameters')
+    p.add_argument('input', help='File with the recorded snapshots')
+    p.add_argument('--period', type=parse_range, default=[1000000],
+                   help='Scheduler periods in microseconds, e.g. 500000,1000000. Default: 1000000')
+    p.add_argument('--load-limit', dest='load_limit', type=parse_range, default=[20],
+                   help='Load limits to simulate, e.g. 10:50:10. Default: 20')
+    p.add_argument('--core-limit', dest='core_limit', type=parse_range, default=[80],
+                   help='Core limits to simulate. Default: 80')
+    p.add_argument('--core-busy', dest='core_busy', type=parse_range, default=[95],
+                   help='Core busy thresholds to simulate. Default: 95')
+    p.add_argument('--main-lcore', dest='main_lcore', type=int,
+                   help='Main lcore of the application. Default: the lowest recorded lcore')
+    p.add_argument('--sort', choices=['cores', 'busy', 'peak', 'unserved', 'migrations'], default='cores',
+                   help='Metric to sort the results by. Default: cores')
+    p.add_argument('--max-unserved', dest='max_unserved', type=float, default=1.0,
+                   help='Parameter sets leaving more than this percentage of the demand unserved ' +
+                        'are listed last. Default: 1.0')
+    p.add_argument('--top', type=int, default=20, help='Number of results to display. Default: 20')
+    p.add_argument('-j', '--json', dest='json', action='store_true', help='Print all results as JSON')
+    p.set_defaults(func=simulate)
+
+    args = parser.parse_args()
+    try:
+        args.func(args)
+    except JSONRPCException as ex:
+        print(ex.message)
+        exit(1)
+    except KeyboardInterrupt:
+        pass
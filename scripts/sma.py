@@ -1,6 +1,7 @@
 #!/usr/bin/env python3
 
 from argparse import ArgumentParser
+import atexit
 import importlib
 import logging
 import os
@@ -14,6 +15,8 @@ sys.path.append(os.path.dirname(__file__) + '/../python')
 
 import spdk.sma as sma               # noqa
 import spdk.rpc.client as rpcclient  # noqa
+from spdk.rpc.instrumentation import RPCStats  # noqa
+from spdk.rpc.cache import RPCCache  # noqa
 
 
 def parse_config(path):
@@ -33,12 +36,20 @@ def parse_argv():
     parser.add_argument('--priv-key', help='The PEM-encoded private key as a byte string')
     parser.add_argument('--cert-chain', help='The PEM-encoded certificate chain as a byte string')
     parser.add_argument('--root-cert', help='The PEM-encoded root certificates as a byte string')
+    parser.add_argument('--rpc-stats', help='Record per-method statistics of the RPC calls and write ' +
+                        'them to a file at exit, in the OpenMetrics format if its name ends with .prom, ' +
+                        'as JSON otherwise')
+    parser.add_argument('--rpc-cache', action='store_true', default=None,
+                        help='Cache results of metadata RPCs (e.g. nvmf_get_transports) for the ' +
+                        'duration of their TTLs, until a state-changing RPC which may affect them is called')
     defaults = {'address': 'localhost',
                 'socket': '/var/tmp/spdk.sock',
                 'port': 8080,
                 'priv_key': None,
                 'cert_chain': None,
-                'root_cert': None}
+                'root_cert': None,
+                'rpc_stats': None,
+                'rpc_cache': False}
     # Merge the default values, config file, and the command-line
     args = vars(parser.parse_args())
     config = parse_config(args.get('config'))
@@ -52,9 +63,10 @@ def parse_argv():
     return config
 
 
-def get_build_client(sock):
+def get_build_client(sock, hooks=(), cache=None):
     def build_client():
-        return rpcclient.JSONRPCClient(sock)
+        client = rpcclient.JSONRPCClient(sock, hooks=hooks, retry_policy=rpcclient.RetryPolicy())
+        return cache.wrap(client) if cache is not None else client
 
     return build_client
 
@@ -117,7 +129,13 @@ if __name__ == '__main__':
     logging.basicConfig(level=os.environ.get('SMA_LOGLEVEL', 'WARNING').upper())
 
     config = parse_argv()
-    client = get_build_client(config['socket'])
+    hooks = []
+    if config['rpc_stats'] is not None:
+        rpc_stats = RPCStats()
+        hooks.append(rpc_stats)
+        atexit.register(rpc_stats.write, config['rpc_stats'])
+    cache = RPCCache() if config['rpc_cache'] else None
+    client = get_build_client(config['socket'], hooks, cache)
 
     # Wait until the SPDK process starts responding to RPCs
     wait_for_listen(client, timeout=60.0)
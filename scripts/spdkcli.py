@@ -9,7 +9,8 @@ from pyparsing import (alphanums, Optional, Suppress, Word, Regex,
 sys.path.append(os.path.dirname(__file__) + '/../python')
 
 from spdk.rpc.client import JSONRPCException, JSONRPCClient  # noqa
-from spdk.spdkcli import UIRoot  # noqa
+from spdk.rpc.cache import RPCCache  # noqa
+from spdk.spdkcli import UIRoot, Batch  # noqa
 
 
 def add_quotes_to_shell(spdk_shell):
@@ -45,6 +46,12 @@ def main():
                         default=None, type=int)
     parser.add_argument("-v", dest="verbose", help="Print request/response JSON for configuration calls",
                         default=False, action="store_true")
+    parser.add_argument("-b", "--batch", dest="batch", metavar="FILE",
+                        help="Execute spdkcli commands from a file ('-' for stdin) as a single pipelined "
+                        "stream of requests, refreshing the tree only once at the end")
+    parser.add_argument("--rpc-cache", dest="rpc_cache", default=False, action="store_true",
+                        help="Cache results of metadata RPCs (e.g. rpc_get_methods) for the duration of their "
+                        "TTLs, until a state-changing RPC which may affect them is called")
     parser.add_argument("commands", metavar="command", type=str, nargs="*", default="",
                         help="commands to execute by SPDKCli as one-line command")
     args = parser.parse_args()
@@ -54,6 +61,8 @@ def main():
     except JSONRPCException as e:
         spdk_shell.log.error("%s. SPDK not running?" % e)
         sys.exit(1)
+    if args.rpc_cache:
+        client = RPCCache().wrap(client)
 
     with client:
         root_node = UIRoot(client, spdk_shell)
@@ -63,6 +72,14 @@ def main():
         except BaseException:
             pass
 
+        if args.batch:
+            with (sys.stdin if args.batch == "-" else open(args.batch, "r")) as fd:
+                batch = Batch(root_node, fd)
+            errors = batch.validate() or batch.run()
+            for lineno, line, error in errors:
+                sys.stderr.write("%s:%d: %s\n%s\n" % (args.batch, lineno, line, error))
+            sys.exit(1 if errors else 0)
+
         if args.commands:
             try:
                 spdk_shell.interactive = False
@@ -74,6 +91,7 @@ def main():
 
         spdk_shell.con.display("SPDK CLI v0.1")
         spdk_shell.con.display("")
+        root_node.prefetch()
 
         while not spdk_shell._exit:
             try:
@@ -82,6 +100,7 @@ def main():
                 spdk_shell.log.error("%s" % e)
             except BrokenPipeError as e:
                 spdk_shell.log.error("Lost connection with SPDK: %s" % e)
+        root_node.stop_prefetch()
 
 
 if __name__ == "__main__":
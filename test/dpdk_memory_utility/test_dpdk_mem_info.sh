@@ -20,5 +20,7 @@ $MEM_SCRIPT
 
 $MEM_SCRIPT -m 0
 
+$MEM_SCRIPT -i 0.1 -n 3 -w 2
+
 trap - SIGINT SIGTERM EXIT
 killprocess $spdkpid
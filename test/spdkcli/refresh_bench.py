@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+"""Measure the cost of building and refreshing the SPDKCLI tree on a large configuration.
+
+The SPDK application is replaced by an in-process fake answering the listing RPCs from
+generated data, so that the numbers reflect SPDKCLI itself and the number of RPCs it issues.
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+from collections import Counter
+
+from configshell_fb import ConfigShell
+
+sys.path.append(os.path.dirname(__file__) + '/../../python')
+
+from spdk.spdkcli import UIRoot, Batch  # noqa
+
+
+class FakeClient:
+    """Minimal stand-in for JSONRPCClient holding malloc bdevs and NVMe-oF subsystems"""
+
+    def __init__(self, num_bdevs, num_subsystems):
+        self.calls = Counter()
+        self.flushes = 0
+        self._request_id = 0
+        self._reqs = []
+        self._responses = []
+        self.bdevs = [self._bdev("Malloc%d" % i) for i in range(num_bdevs)]
+        self.subsystems = [self._subsystem("nqn.2016-06.io.spdk:cnode%d" % i)
+                           for i in range(num_subsystems)]
+
+    @staticmethod
+    def _bdev(name):
+        return {"name": name, "aliases": [], "product_name": "Malloc disk",
+                "block_size": 512, "num_blocks": 131072, "claimed": False}
+
+    @staticmethod
+    def _subsystem(nqn):
+        return {"nqn": nqn, "subtype": "NVMe", "serial_number": "SPDK00000000000001",
+                "allow_any_host": False, "hosts": [], "namespaces": [],
+                "listen_addresses": [{"trtype": "TCP", "adrfam": "IPv4",
+                                      "traddr": "127.0.0.1", "trsvcid": "4420"}]}
+
+    def log_set_level(self, lvl):
+        pass
+
+    def add_request(self, method, params):
+        self._request_id += 1
+        self._reqs.append((self._request_id, method, params))
+        return self._request_id
+
+    def flush(self):
+        self.flushes += 1
+        for req_id, method, params in self._reqs:
+            self._responses.append({"id": req_id, "result": self.call(method, params)})
+        self._reqs = []
+
+    def recv(self):
+        return self._responses.pop(0)
+
+    def call(self, method, params={}):
+        self.calls[method] += 1
+        if method == "rpc_get_methods":
+            return ["bdev_get_bdevs", "bdev_lvol_get_lvstores", "nvmf_get_subsystems",
+                    "nvmf_get_transports", "bdev_malloc_create", "nvmf_subsystem_add_host"]
+        if method == "framework_get_subsystems":
+            return [{"subsystem": "bdev"}, {"subsystem": "nvmf"}]
+        if method == "bdev_get_bdevs":
+            return self.bdevs
+        if method == "nvmf_get_subsystems":
+            return self.subsystems
+        if method == "bdev_malloc_create":
+            self.bdevs = self.bdevs + [self._bdev(params["name"])]
+            return params["name"]
+        if method == "nvmf_subsystem_add_host":
+            subsystems = []
+            for subsystem in self.subsystems:
+                if subsystem["nqn"] == params["nqn"]:
+                    subsystem = dict(subsystem, hosts=subsystem["hosts"] + [{"nqn": params["host"]}])
+                subsystems.append(subsystem)
+            self.subsystems = subsystems
+            return True
+        return []
+
+
+def measure(client, name, func):
+    client.calls.clear()
+    start = time.perf_counter()
+    func()
+    elapsed = time.perf_counter() - start
+    calls = ", ".join("%s=%d" % (m, c) for m, c in sorted(client.calls.items()))
+    print("%-28s %9.3f s  %s" % (name, elapsed, calls))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark SPDKCLI tree refresh")
+    parser.add_argument("-b", "--bdevs", type=int, default=10000,
+                        help="Number of malloc bdevs. Default: 10000")
+    parser.add_argument("-n", "--subsystems", type=int, default=2000,
+                        help="Number of NVMe-oF subsystems. Default: 2000")
+    parser.add_argument("-c", "--commands", type=int, default=1000,
+                        help="Number of commands executed in batch mode. Default: 1000")
+    args = parser.parse_args()
+
+    client = FakeClient(args.bdevs, args.subsystems)
+    shell = ConfigShell(tempfile.mkdtemp())
+    shell.interactive = True
+    root = None
+
+    def build():
+        nonlocal root
+        root = UIRoot(client, shell)
+        root.refresh()
+
+    def settle(func):
+        # Commands restart the background prefetch, wait for it to include its RPCs in the results
+        def w():
+            func()
+            if root._prefetch is not None:
+                root._prefetch.join()
+        return w
+
+    def materialize(node):
+        for child in node.children:
+            materialize(child)
+
+    measure(client, "initial build", build)
+    measure(client, "prefetch", settle(root.prefetch))
+    # What "ls /bdevs 1" prints, the summaries are computed without building the listed nodes
+    bdevs = root.get_node("/bdevs")
+    measure(client, "ls /bdevs 1", lambda: bdevs._render_tree(bdevs, depth=1))
+    assert not root.get_node("/bdevs/malloc").is_materialized()
+    measure(client, "build whole tree", lambda: materialize(root))
+    measure(client, "full refresh", lambda: (root.refresh(), materialize(root)))
+
+    malloc = root.get_node("/bdevs/malloc")
+    measure(client, "bdev_malloc_create",
+            settle(lambda: malloc.execute_command("create", ["32", "512"], {"name": "MallocNew"})))
+    measure(client, "build malloc bdevs", lambda: materialize(malloc))
+    assert "MallocNew" in [child.name for child in malloc.children]
+
+    nqn = client.subsystems[-1]["nqn"]
+    hosts = root.get_node("/nvmf/subsystem/%s/hosts" % nqn)
+    measure(client, "nvmf_subsystem_add_host",
+            settle(lambda: hosts.execute_command("create", ["nqn.2014-08.org.spdk:host0"])))
+    assert len(hosts.children) == 1
+    root.stop_prefetch()
+
+    script = ["/bdevs/malloc create 32 512 Batch%d" % i for i in range(args.commands)]
+    script += ["/nvmf/subsystem/%s/hosts create nqn.2014-08.org.spdk:host%d" % (nqn, i)
+               for i in range(1, args.commands + 1)]
+    batch = Batch(root, script)
+    measure(client, "batch (%d commands)" % len(script), lambda: batch.validate() or batch.run())
+    assert not batch.errors
+    assert len(root.get_node("/nvmf/subsystem/%s/hosts" % nqn).children) == args.commands + 1
+
+
+if __name__ == "__main__":
+    main()